@@ -1,10 +1,11 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.utils.html import format_html
 from django.urls import reverse, path
 from django.http import HttpResponseRedirect
 from django.utils import timezone
 from django.contrib import messages
-from .models import UserProfile, InvestorProfile, BorrowerProfile, Wallet, Transaction
+from .models import UserProfile, InvestorProfile, BorrowerProfile, Wallet, Transaction, ArchivedTransactionMonth
 
 class InvestorProfileInline(admin.StackedInline):
     model = InvestorProfile
@@ -150,9 +151,15 @@ class WalletAdmin(admin.ModelAdmin):
     
     transaction_count.short_description = 'Transactions'
 
+class TransactionChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # Resolve the related entities of the whole page at once
+        Transaction.prefetch_related_entities(self.result_list)
+
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'transaction_type', 'amount', 'timestamp', 'balance_after')
+    list_display = ('id', 'username', 'transaction_type', 'amount', 'timestamp', 'balance_after', 'related_to')
     list_filter = ('transaction_type', 'timestamp')
     search_fields = ('wallet__user__username', 'wallet__user__email', 'description')
     readonly_fields = ('wallet', 'transaction_type', 'amount', 'timestamp', 'description', 'balance_after', 
@@ -162,9 +169,49 @@ class TransactionAdmin(admin.ModelAdmin):
     def username(self, obj):
         return obj.wallet.user.username
     
+    def related_to(self, obj):
+        entity = obj.related_entity
+        if entity is None:
+            return '-'
+        if obj.related_entity_type == 'loan_payment':
+            return f"Payment #{entity.payment_number} of {entity.loan.title}"
+        return entity.loan.title
+    
+    related_to.short_description = 'Related To'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('wallet__user')
+    
+    def get_changelist(self, request, **kwargs):
+        return TransactionChangeList
+    
     def has_add_permission(self, request):
         return False
     
     def has_delete_permission(self, request, obj=None):
         # Only superusers can delete transactions for audit purposes
         return request.user.is_superuser
+
+@admin.register(ArchivedTransactionMonth)
+class ArchivedTransactionMonthAdmin(admin.ModelAdmin):
+    list_display = ('username', 'month', 'transaction_count', 'opening_balance', 'closing_balance', 'archived_at')
+    list_filter = ('month',)
+    search_fields = ('wallet__user__username', 'wallet__user__email')
+    exclude = ('data',)
+    readonly_fields = ('wallet', 'month', 'transaction_count', 'first_transaction_id', 'last_transaction_id',
+                       'first_timestamp', 'last_timestamp', 'opening_balance', 'closing_balance', 'totals',
+                       'archived_at')
+    actions = None  # Explicitly set actions to None
+    
+    def username(self, obj):
+        return obj.wallet.user.username
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        # Only superusers can delete archived transactions for audit purposes
+        return request.user.is_superuser
@@ -0,0 +1,193 @@
+"""
+Hot/cold split of the Transaction ledger.
+
+Transactions older than LEDGER_HOT_MONTHS whole months are moved, one wallet
+and one month at a time, into an ArchivedTransactionMonth row: the month's
+transactions as zlib-compressed JSON lines, with the wallet's opening and
+closing balance and per-type totals as the rollup. Archiving a month also
+stores a balance checkpoint at its last transaction, so Wallet.balance_as_of()
+never needs the archived rows after the month.
+
+wallet_history(), wallet_ledger(), history_page() and find_transaction()
+read the hot table and the archive together, so history pages and exports
+work the same for archived transactions.
+"""
+
+import json
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from lending.pagination import object_sort_key, paginate_chain, queryset_source, sort_key
+from .models import ArchivedTransactionMonth, BalanceCheckpoint, Transaction
+
+# Order of wallet history pages; the archive holds the rows that come last
+HISTORY_ORDERING = ('-timestamp', '-id')
+
+FIELDS = ('id', 'transaction_type', 'amount', 'timestamp', 'description', 'balance_after',
+          'related_entity_type', 'related_entity_id')
+
+
+def horizon(months=None):
+    """Start of the oldest month that stays in the Transaction table; `months` defaults to LEDGER_HOT_MONTHS"""
+    if months is None:
+        months = getattr(settings, 'LEDGER_HOT_MONTHS', 12)
+    first_of_month = timezone.localdate().replace(day=1) - relativedelta(months=months)
+    return timezone.make_aware(datetime.combine(first_of_month, datetime.min.time()))
+
+
+def months_to_archive(before):
+    """(wallet id, month start) of every wallet month with transactions before `before`, oldest first"""
+    return (Transaction.objects.filter(timestamp__lt=before)
+            .annotate(month=TruncMonth('timestamp'))
+            .values_list('wallet_id', 'month').distinct().order_by('month', 'wallet_id'))
+
+
+def pack(transactions):
+    lines = [json.dumps([
+        transaction.id, transaction.transaction_type, str(transaction.amount),
+        transaction.timestamp.isoformat(), transaction.description, str(transaction.balance_after),
+        transaction.related_entity_type, transaction.related_entity_id,
+    ]) for transaction in transactions]
+    return zlib.compress('\n'.join(lines).encode(), 9)
+
+
+def unpack(archived_month):
+    # Only hand on the wallet when it is already loaded, so unpacking never queries for it
+    if ArchivedTransactionMonth.wallet.is_cached(archived_month):
+        owner = {'wallet': archived_month.wallet}
+    else:
+        owner = {'wallet_id': archived_month.wallet_id}
+    transactions = []
+    for line in zlib.decompress(bytes(archived_month.data)).decode().splitlines():
+        values = dict(zip(FIELDS, json.loads(line)))
+        values['amount'] = Decimal(values['amount'])
+        values['balance_after'] = Decimal(values['balance_after'])
+        values['timestamp'] = datetime.fromisoformat(values['timestamp'])
+        transactions.append(Transaction(**owner, **values))
+    return transactions
+
+
+def archive_month(wallet, month):
+    """Move a wallet's transactions of the month starting at `month` into the archive"""
+    end = month + relativedelta(months=1)
+    with transaction.atomic():
+        rows = list(wallet.transactions.filter(timestamp__gte=month, timestamp__lt=end).order_by('timestamp', 'pk'))
+        if not rows:
+            return None
+
+        # An archived month only grows if transactions were backdated into it
+        existing = wallet.archived_months.select_for_update().filter(month=month.date()).first()
+        if existing:
+            rows = sorted(existing.transactions() + rows, key=lambda row: (row.timestamp, row.pk))
+            opening = existing.opening_balance
+        else:
+            opening = wallet.balance_as_of(month - timedelta(microseconds=1))
+
+        totals = {}
+        closing = opening
+        for row in rows:
+            closing += row.signed_amount
+            total = totals.setdefault(row.transaction_type, {'count': 0, 'amount': Decimal('0.00')})
+            total['count'] += 1
+            total['amount'] += row.amount
+
+        earlier = wallet.archived_months.filter(month__lt=month.date()).aggregate(
+            count=Sum('transaction_count'))['count'] or 0
+        count = earlier + wallet.transactions.filter(timestamp__lt=end).count() + (existing.transaction_count if existing else 0)
+
+        archived, _ = ArchivedTransactionMonth.objects.update_or_create(
+            wallet=wallet,
+            month=month.date(),
+            defaults={
+                'transaction_count': len(rows),
+                'first_transaction_id': min(row.pk for row in rows),
+                'last_transaction_id': max(row.pk for row in rows),
+                'first_timestamp': rows[0].timestamp,
+                'last_timestamp': rows[-1].timestamp,
+                'opening_balance': opening,
+                'closing_balance': closing,
+                'totals': {key: {'count': value['count'], 'amount': str(value['amount'])}
+                           for key, value in totals.items()},
+                'data': pack(rows),
+            },
+        )
+        BalanceCheckpoint.objects.update_or_create(
+            wallet=wallet, as_of=rows[-1].timestamp,
+            defaults={'balance': closing, 'transaction_count': count},
+        )
+        wallet.transactions.filter(timestamp__gte=month, timestamp__lt=end).delete()
+        return archived
+
+
+def wallet_history(wallet):
+    """All the wallet's transactions, newest first: the hot table, then the archived months"""
+    yield from wallet.transactions.order_by('-timestamp', '-pk').iterator(chunk_size=500)
+    # Each month's data is only loaded when the history reaches it
+    for archived_month in wallet.archived_months.defer('data').order_by('-month'):
+        yield from reversed(archived_month.transactions())
+
+
+def wallet_ledger(wallet, transaction_types=None, chunk_size=2000):
+    """All the wallet's transactions, oldest first: the archived months, then the Transaction table"""
+    for archived_month in wallet.archived_months.defer('data').order_by('month'):
+        for archived in archived_month.transactions():
+            if transaction_types is None or archived.transaction_type in transaction_types:
+                yield archived
+    hot = wallet.transactions.order_by('timestamp', 'id')
+    if transaction_types is not None:
+        hot = hot.filter(transaction_type__in=transaction_types)
+    yield from hot.iterator(chunk_size=chunk_size)
+
+
+def archive_source(wallet):
+    """paginate_chain() source of the wallet's archived transactions, which follow the hot ones"""
+    def rows(ordering, values, backwards, limit):
+        months = wallet.archived_months.defer('data')
+        position = None
+        if values is not None:
+            position = sort_key(values, ordering)
+            timestamp = datetime.fromisoformat(values[0])
+            # Only the months that can hold rows beyond the cursor
+            months = months.filter(last_timestamp__gte=timestamp) if backwards else months.filter(
+                first_timestamp__lte=timestamp)
+
+        found = []
+        for archived_month in months.order_by('month' if backwards else '-month'):
+            transactions = archived_month.transactions()
+            for archived in (transactions if backwards else reversed(transactions)):
+                key = object_sort_key(archived, ordering)
+                if position is None or (key < position if backwards else key > position):
+                    found.append(archived)
+                    if len(found) == limit:
+                        return found
+        return found
+    return rows
+
+
+def history_page(wallet, cursor=None, page_size=50):
+    """Keyset page of the wallet's transactions, newest first, across the hot table and the archive"""
+    return paginate_chain(
+        [queryset_source(wallet.transactions.all()), archive_source(wallet)],
+        HISTORY_ORDERING, cursor, page_size,
+    )
+
+
+def find_transaction(transaction_id, **wallet_filter):
+    """A transaction by id from the hot table or the archive, or None"""
+    found = Transaction.objects.filter(id=transaction_id, **wallet_filter).first()
+    if found:
+        return found
+    months = ArchivedTransactionMonth.objects.filter(
+        first_transaction_id__lte=transaction_id, last_transaction_id__gte=transaction_id,
+        **wallet_filter).select_related('wallet')
+    for archived_month in months:
+        for archived in archived_month.transactions():
+            if archived.pk == transaction_id:
+                return archived
+    return None
@@ -0,0 +1,76 @@
+"""
+Streaming CSV and JSONL exports.
+
+Rows are read with .iterator() in chunks and written out one line at a time
+through a StreamingHttpResponse, so the memory an export needs does not
+depend on how long the history is. The related entities of the transactions
+in each chunk are resolved together.
+"""
+
+import csv
+import json
+from itertools import islice
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from .models import Transaction
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+TRANSACTION_FIELDS = ('id', 'timestamp', 'type', 'amount', 'balance_after', 'description',
+                      'related_entity_type', 'related_entity_id', 'loan_id')
+
+
+class Echo:
+    """File-like object whose write() returns the line, so csv.writer produces strings"""
+
+    def write(self, value):
+        return value
+
+
+def chunks(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def encode_rows(fields, rows, fmt):
+    """Lines of a CSV document (with a header) or a JSONL document of `rows`, tuples ordered as `fields`"""
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
+
+
+def export_subject(request):
+    """The user whose history is exported: staff may export anyone's with ?user=<id>"""
+    if request.user.is_staff and request.GET.get('user', '').isdigit():
+        return get_object_or_404(User, pk=request.GET['user'])
+    return request.user
+
+
+def export_response(filename, fields, rows, fmt):
+    response = StreamingHttpResponse(encode_rows(fields, rows, fmt), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def transaction_rows(transactions):
+    """Export rows of transactions, resolving the related entities a chunk at a time"""
+    for chunk in chunks(transactions):
+        for transaction in Transaction.prefetch_related_entities(chunk):
+            entity = transaction.related_entity
+            yield (
+                transaction.id, transaction.timestamp, transaction.transaction_type, transaction.amount,
+                transaction.balance_after, transaction.description, transaction.related_entity_type or '',
+                transaction.related_entity_id or '', entity.loan_id if entity else '',
+            )
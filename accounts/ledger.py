@@ -0,0 +1,92 @@
+"""
+Balance checkpoints and daily summaries of the wallet ledger.
+
+A checkpoint records a wallet's balance after every transaction up to a
+moment, so Wallet.balance_as_of() only has to add the transactions after the
+nearest one. Checkpoints are placed every so many transactions and, if asked
+for, at the end of every day with activity, always between two distinct
+timestamps so that a checkpoint covers all transactions up to its moment.
+
+Building is incremental: each wallet continues from its latest checkpoint.
+Transactions younger than SETTLE_TIME are left for a later run, so one that
+commits late can never fall behind a checkpoint.
+
+WalletDailySummary rows are kept up to date by the code that writes the
+ledger; rebuild_daily_summaries() recomputes a wallet's from its archived
+and hot transactions, to backfill them or repair them.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import F, Max, OuterRef, Q, Subquery
+from django.utils import timezone
+from .archive import wallet_history
+from .models import BalanceCheckpoint, Transaction, Wallet, WalletDailySummary
+
+CHECKPOINT_EVERY = 500
+SETTLE_TIME = timedelta(minutes=5)
+
+
+def settled_until():
+    return timezone.now() - SETTLE_TIME
+
+
+def wallets_to_checkpoint(until):
+    """Wallets with transactions up to `until` that their latest checkpoint does not cover"""
+    latest = BalanceCheckpoint.objects.filter(wallet=OuterRef('pk')).order_by('-as_of').values('as_of')[:1]
+    return Wallet.objects.annotate(
+        checkpointed=Subquery(latest),
+        last_activity=Max('transactions__timestamp', filter=Q(transactions__timestamp__lte=until)),
+    ).filter(
+        Q(checkpointed__isnull=True) | Q(last_activity__gt=F('checkpointed')),
+        last_activity__isnull=False,
+    )
+
+
+def build_checkpoints(wallet, until, every=CHECKPOINT_EVERY, daily=False):
+    """Add the checkpoints of a wallet's transactions up to `until`; returns how many were added"""
+    latest = wallet.checkpoints.order_by('-as_of').first()
+    balance = latest.balance if latest else Decimal('0.00')
+    count = latest.transaction_count if latest else 0
+    since_checkpoint = 0
+
+    transactions = wallet.transactions.filter(timestamp__lte=until)
+    if latest:
+        transactions = transactions.filter(timestamp__gt=latest.as_of)
+    rows = transactions.order_by('timestamp', 'pk').values_list('timestamp', 'transaction_type', 'amount')
+
+    checkpoints = []
+    previous = None
+    for timestamp, transaction_type, amount in rows.iterator(chunk_size=2000):
+        # A checkpoint can only go between two distinct timestamps
+        if previous is not None and timestamp != previous:
+            day_ended = daily and timezone.localdate(timestamp) != timezone.localdate(previous)
+            if since_checkpoint >= every or day_ended:
+                checkpoints.append(BalanceCheckpoint(
+                    wallet=wallet, as_of=previous, balance=balance, transaction_count=count))
+                since_checkpoint = 0
+        balance += amount if transaction_type in Transaction.CREDIT_TYPES else -amount
+        count += 1
+        since_checkpoint += 1
+        previous = timestamp
+
+    # Every transaction up to `until` has been read, so the last one ends a complete run
+    day_ended = daily and previous is not None and timezone.localdate(previous) < timezone.localdate(until)
+    if since_checkpoint >= every or (day_ended and since_checkpoint):
+        checkpoints.append(BalanceCheckpoint(
+            wallet=wallet, as_of=previous, balance=balance, transaction_count=count))
+
+    BalanceCheckpoint.objects.bulk_create(checkpoints)
+    return len(checkpoints)
+
+
+def rebuild_daily_summaries(wallet):
+    """Replace a wallet's daily summaries with ones computed from its whole history; returns how many"""
+    # The same days recording every transaction as it was written would have produced
+    summaries = [
+        WalletDailySummary(wallet_id=wallet_id, date=day, **change)
+        for (wallet_id, day), change in WalletDailySummary.changes(wallet_history(wallet)).items()
+    ]
+    wallet.daily_summaries.all().delete()
+    WalletDailySummary.objects.bulk_create(summaries, batch_size=1000)
+    return len(summaries)
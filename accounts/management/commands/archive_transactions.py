@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from accounts.archive import archive_month, horizon, months_to_archive
+from accounts.models import Wallet
+
+class Command(BaseCommand):
+    help = 'Move wallet transactions older than the hot months into the compressed monthly archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months',
+            type=int,
+            help='Whole months of transactions to keep in the Transaction table (default: LEDGER_HOT_MONTHS)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the wallet months that would be archived without moving them',
+        )
+
+    def handle(self, *args, **options):
+        before = horizon(options['months'])
+        months = list(months_to_archive(before))
+        self.stdout.write(f'Found {len(months)} wallet months of transactions before {before:%Y-%m-%d}')
+
+        if options.get('dry_run', False):
+            return
+
+        wallets = Wallet.objects.in_bulk({wallet_id for wallet_id, _ in months})
+        transaction_count = 0
+        compressed = 0
+        for wallet_id, month in months:
+            # Oldest first, so every month's opening balance comes from the one before it
+            archived = archive_month(wallets[wallet_id], month)
+            if archived:
+                transaction_count += archived.transaction_count
+                compressed += len(archived.data)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {transaction_count} transactions of {len(months)} wallet months '
+            f'into {compressed / 1024:,.0f} KB'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.ledger import CHECKPOINT_EVERY, build_checkpoints, settled_until, wallets_to_checkpoint
+
+class Command(BaseCommand):
+    help = 'Add balance checkpoints for the wallet transactions made since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=CHECKPOINT_EVERY,
+            help='Transactions between two checkpoints of a wallet',
+        )
+        parser.add_argument(
+            '--daily',
+            action='store_true',
+            help='Also checkpoint every wallet at the end of each day it was used',
+        )
+
+    def handle(self, *args, **options):
+        until = settled_until()
+        wallets = wallets_to_checkpoint(until).order_by('pk')
+        self.stdout.write(f'Found {wallets.count()} wallets with transactions after their latest checkpoint')
+
+        wallet_count = 0
+        checkpoint_count = 0
+        for wallet in wallets.iterator(chunk_size=500):
+            with transaction.atomic():
+                added = build_checkpoints(wallet, until, every=options['every'], daily=options['daily'])
+            if added:
+                wallet_count += 1
+                checkpoint_count += added
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {checkpoint_count} checkpoints to {wallet_count} wallets'
+        ))
@@ -0,0 +1,96 @@
+import multiprocessing
+import time
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from accounts.statements import STATEMENT_ROOT, generate_statements, pending_wallets
+
+def _process_worker(args):
+    wallet_ids, month, directory = args
+    return generate_statements(wallet_ids, month, directory)
+
+class Command(BaseCommand):
+    help = 'Write the monthly statement of every wallet, resuming where an earlier run stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='Month of the statements as YYYY-MM (default: last month)',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Wallets per unit of work handed to a worker',
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=str(STATEMENT_ROOT),
+            help='Directory the statements are written to, one subdirectory per month',
+        )
+        parser.add_argument(
+            '--wallets',
+            type=int,
+            nargs='+',
+            help='Only write the statements of these wallets (by id)',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--month must be given as YYYY-MM')
+        else:
+            month = timezone.localdate().replace(day=1) - relativedelta(months=1)
+
+        # Wallets whose statement file exists were finished by an earlier run
+        wallet_ids = pending_wallets(month, options['output_dir'], options['wallets'])
+        if not wallet_ids:
+            self.stdout.write(self.style.SUCCESS(f'All statements for {month:%Y-%m} are already written'))
+            return
+
+        size = max(1, options['chunk_size'])
+        chunks = [(wallet_ids[index:index + size], month, options['output_dir'])
+                  for index in range(0, len(wallet_ids), size)]
+        processes = max(1, min(options['processes'], len(chunks)))
+        self.stdout.write(f'Writing {len(wallet_ids)} statements for {month:%Y-%m} in {len(chunks)} chunks '
+                          f'over {processes} process(es)')
+
+        start = time.perf_counter()
+        if processes == 1:
+            written, unbalanced = self.collect(map(_process_worker, chunks), len(wallet_ids), start)
+        else:
+            # Forked workers must not share this process's database connection
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                written, unbalanced = self.collect(
+                    pool.imap_unordered(_process_worker, chunks), len(wallet_ids), start)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} statements in {elapsed:.1f}s ({written / elapsed:.0f} statements/s)'
+        ))
+        if unbalanced:
+            self.stdout.write(self.style.WARNING(
+                f'{len(unbalanced)} statements do not balance; wallets: {", ".join(map(str, sorted(unbalanced)))}'
+            ))
+
+    def collect(self, results, total, start):
+        """Totals of the chunk results, reporting progress as each chunk finishes"""
+        written = 0
+        unbalanced = []
+        for chunk_written, chunk_unbalanced in results:
+            written += chunk_written
+            unbalanced.extend(chunk_unbalanced)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{written}/{total} statements, {written / elapsed:.0f}/s')
+        return written, unbalanced
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.ledger import rebuild_daily_summaries
+from accounts.models import Wallet
+
+class Command(BaseCommand):
+    help = 'Recompute the daily wallet summaries from the archived and hot transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--wallets',
+            type=int,
+            nargs='+',
+            help='Only rebuild these wallets (by id)',
+        )
+
+    def handle(self, *args, **options):
+        wallets = Wallet.objects.order_by('pk')
+        if options['wallets']:
+            wallets = wallets.filter(pk__in=options['wallets'])
+        self.stdout.write(f'Rebuilding the daily summaries of {wallets.count()} wallets')
+
+        summary_count = 0
+        for wallet in wallets.iterator(chunk_size=500):
+            # Locked, so no transaction is recorded while the wallet is rebuilt
+            with transaction.atomic():
+                Wallet.objects.select_for_update().filter(pk=wallet.pk).first()
+                summary_count += rebuild_daily_summaries(wallet)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {summary_count} daily summaries'))
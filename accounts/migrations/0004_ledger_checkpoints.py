@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 18:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_transaction_balance_after_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('transaction_count', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'timestamp'], name='transaction_wallet_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancecheckpoint',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='accounts.wallet'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('wallet', 'as_of'), name='checkpoint_unique_as_of'),
+        ),
+    ]
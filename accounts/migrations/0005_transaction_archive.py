@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 18:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_ledger_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransactionMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('transaction_count', models.PositiveIntegerField()),
+                ('first_transaction_id', models.PositiveBigIntegerField()),
+                ('last_transaction_id', models.PositiveBigIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('totals', models.JSONField(default=dict)),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_months', to='accounts.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='archivedtransactionmonth',
+            constraint=models.UniqueConstraint(fields=('wallet', 'month'), name='archived_month_unique'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 18:36
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('money_in', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('money_out', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('deposit_count', models.PositiveIntegerField(default=0)),
+                ('deposit_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('withdrawal_count', models.PositiveIntegerField(default=0)),
+                ('withdrawal_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('investment_count', models.PositiveIntegerField(default=0)),
+                ('investment_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('return_count', models.PositiveIntegerField(default=0)),
+                ('return_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('fee_count', models.PositiveIntegerField(default=0)),
+                ('fee_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('closing_balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='accounts.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletdailysummary',
+            constraint=models.UniqueConstraint(fields=('wallet', 'date'), name='daily_summary_unique_date'),
+        ),
+    ]
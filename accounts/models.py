@@ -1,6 +1,9 @@
-from django.db import models
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
+from django.utils import timezone
 from django.dispatch import receiver
 from decimal import Decimal
 
@@ -96,44 +99,98 @@ class Wallet(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet')
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
+    def adjust_balance(self, delta, minimum=None):
+        """Add `delta` to the balance in the database and return the new balance.
+        
+        The change is one UPDATE of `balance = balance + delta`, so concurrent
+        adjustments of the same wallet are never lost. With `minimum` the
+        update only happens if the balance stays at or above it; otherwise
+        nothing changes and None is returned.
+        """
+        with transaction.atomic():
+            wallets = Wallet.objects.filter(pk=self.pk)
+            if minimum is not None:
+                wallets = wallets.filter(balance__gte=minimum - delta)
+            adjusted = wallets.update(balance=F('balance') + delta)
+            # Read back inside the transaction, which now holds the row
+            self.refresh_from_db(fields=['balance'])
+        return self.balance if adjusted else None
+    
+    @classmethod
+    def adjust_balances(cls, deltas):
+        """Add {wallet id: delta} to many wallets with one UPDATE and return their new balances"""
+        if not deltas:
+            return {}
+        with transaction.atomic():
+            # Lock the wallets in primary key order so concurrent bulk adjustments cannot deadlock
+            wallet_ids = list(cls.objects.select_for_update().filter(pk__in=deltas)
+                              .order_by('pk').values_list('pk', flat=True))
+            cls.objects.filter(pk__in=wallet_ids).update(balance=F('balance') + Case(
+                *[When(pk=wallet_id, then=Value(deltas[wallet_id])) for wallet_id in wallet_ids],
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ))
+            return dict(cls.objects.filter(pk__in=wallet_ids).values_list('pk', 'balance'))
+    
     def deposit_funds(self, amount, description=None, related_entity_type=None, related_entity_id=None):
         """Add funds to wallet and record transaction"""
-        self.balance += amount
-        self.save()
-        
-        # Create transaction record
-        Transaction.objects.create(
-            wallet=self,
-            transaction_type='deposit',
-            amount=amount,
-            description=description or 'Deposit funds',
-            balance_after=self.balance,
-            related_entity_type=related_entity_type,
-            related_entity_id=related_entity_id
-        )
+        with transaction.atomic():
+            self.adjust_balance(amount)
+            
+            # Create transaction record
+            entry = Transaction.objects.create(
+                wallet=self,
+                transaction_type='deposit',
+                amount=amount,
+                description=description or 'Deposit funds',
+                balance_after=self.balance,
+                related_entity_type=related_entity_type,
+                related_entity_id=related_entity_id
+            )
+            WalletDailySummary.record([entry])
         
         return True
     
     def withdraw_funds(self, amount, description=None, related_entity_type=None, related_entity_id=None):
         """Withdraw funds from wallet and record transaction"""
-        if self.balance < amount:
-            return False
+        with transaction.atomic():
+            # Guarded update, so concurrent withdrawals can never overdraw the wallet
+            if self.adjust_balance(-amount, minimum=Decimal('0.00')) is None:
+                return False
+            
+            # Create transaction record
+            entry = Transaction.objects.create(
+                wallet=self,
+                transaction_type='withdrawal',
+                amount=amount,
+                description=description or 'Withdraw funds',
+                balance_after=self.balance,
+                related_entity_type=related_entity_type,
+                related_entity_id=related_entity_id
+            )
+            WalletDailySummary.record([entry])
         
-        self.balance -= amount
-        self.save()
+        return True
+    
+    def balance_as_of(self, when):
+        """Balance after every transaction made up to `when`.
         
-        # Create transaction record
-        Transaction.objects.create(
-            wallet=self,
-            transaction_type='withdrawal',
-            amount=amount,
-            description=description or 'Withdraw funds',
-            balance_after=self.balance,
-            related_entity_type=related_entity_type,
-            related_entity_id=related_entity_id
-        )
+        Starts from the wallet's latest checkpoint at or before `when` and
+        adds only the transactions after it, so the cost does not grow with
+        the length of the history.
+        """
+        # Inside an archived month the transactions are only in the archive
+        archived = self.archived_months.filter(first_timestamp__lte=when, last_timestamp__gt=when).first()
+        if archived:
+            return archived.balance_as_of(when)
         
-        return True
+        checkpoint = self.checkpoints.filter(as_of__lte=when).order_by('-as_of').first()
+        tail = self.transactions.filter(timestamp__lte=when)
+        balance = Decimal('0.00')
+        if checkpoint:
+            tail = tail.filter(timestamp__gt=checkpoint.as_of)
+            balance = checkpoint.balance
+        net = tail.aggregate(net=Sum(Transaction.net_amount()))['net'] or Decimal('0.00')
+        return (balance + net).quantize(Decimal('0.01'))
     
     def __str__(self):
         return f"{self.user.username}'s wallet"
@@ -156,23 +213,189 @@ class Transaction(models.Model):
     related_entity_type = models.CharField(max_length=20, blank=True, null=True)
     related_entity_id = models.PositiveIntegerField(blank=True, null=True)
     
+    # Types that add to the wallet balance; the others take from it
+    CREDIT_TYPES = ('deposit', 'return')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'timestamp'], name='transaction_wallet_time_idx'),
+        ]
+    
+    @classmethod
+    def net_amount(cls):
+        """The amount with the sign of its effect on the wallet balance, as a query expression"""
+        return Case(
+            When(transaction_type__in=cls.CREDIT_TYPES, then=F('amount')),
+            default=-F('amount'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+    
+    @property
+    def signed_amount(self):
+        return self.amount if self.transaction_type in self.CREDIT_TYPES else -self.amount
+    
+    # Models that related_entity_type refers to
+    RELATED_ENTITY_MODELS = {
+        'investment': 'lending.Investment',
+        'loan_payment': 'lending.LoanPayment',
+    }
+    
+    @classmethod
+    def prefetch_related_entities(cls, transactions):
+        """Resolve related_entity of many transactions with one query per entity type; returns them as a list"""
+        transactions = list(transactions)
+        ids = {}
+        for transaction in transactions:
+            if transaction.related_entity_type in cls.RELATED_ENTITY_MODELS and transaction.related_entity_id:
+                ids.setdefault(transaction.related_entity_type, set()).add(transaction.related_entity_id)
+        
+        entities = {}
+        for entity_type, entity_ids in ids.items():
+            model = apps.get_model(cls.RELATED_ENTITY_MODELS[entity_type])
+            entities[entity_type] = model.objects.select_related('loan').in_bulk(entity_ids)
+        
+        for transaction in transactions:
+            transaction._related_entity = entities.get(transaction.related_entity_type, {}).get(
+                transaction.related_entity_id)
+        return transactions
+    
     @property
     def related_entity(self):
         """Get the related entity (investment, loan payment, etc.) if applicable"""
-        if not self.related_entity_type or not self.related_entity_id:
-            return None
-            
-        if self.related_entity_type == 'investment':
-            from lending.models import Investment
-            return Investment.objects.filter(id=self.related_entity_id).first()
-        elif self.related_entity_type == 'loan_payment':
-            from lending.models import LoanPayment
-            return LoanPayment.objects.filter(id=self.related_entity_id).first()
-        return None
+        if not hasattr(self, '_related_entity'):
+            self.prefetch_related_entities([self])
+        return self._related_entity
     
     def __str__(self):
         return f"{self.wallet.user.username} - {self.get_transaction_type_display()} - R{self.amount}"
 
+class WalletDailySummary(models.Model):
+    """A wallet's transactions of one day, kept up to date as they are written"""
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='daily_summaries')
+    date = models.DateField()
+    money_in = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    money_out = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    deposit_count = models.PositiveIntegerField(default=0)
+    deposit_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    withdrawal_count = models.PositiveIntegerField(default=0)
+    withdrawal_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    investment_count = models.PositiveIntegerField(default=0)
+    investment_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    return_count = models.PositiveIntegerField(default=0)
+    return_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    fee_count = models.PositiveIntegerField(default=0)
+    fee_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'date'], name='daily_summary_unique_date'),
+        ]
+    
+    @staticmethod
+    def changes(transactions):
+        """{(wallet id, day): {field: amount to add}} of saved transactions, with their closing balances"""
+        changes = {}
+        for transaction in sorted(transactions, key=lambda transaction: (transaction.timestamp, transaction.pk)):
+            key = (transaction.wallet_id, timezone.localdate(transaction.timestamp))
+            change = changes.setdefault(key, {})
+            flow = 'money_in' if transaction.transaction_type in Transaction.CREDIT_TYPES else 'money_out'
+            for field, amount in ((flow, transaction.amount),
+                                  (f'{transaction.transaction_type}_count', 1),
+                                  (f'{transaction.transaction_type}_amount', transaction.amount)):
+                change[field] = change.get(field, 0) + amount
+            change['closing_balance'] = transaction.balance_after
+        return changes
+    
+    @classmethod
+    def record(cls, transactions):
+        """Add newly written transactions to their days' summaries.
+        
+        Missing days are inserted first, then each day's summaries are
+        incremented with one UPDATE of `field = field + amount`, so this
+        costs two statements per day however many wallets are involved.
+        Callers run it in the transaction that wrote the ledger entries,
+        while the wallets are still locked by their balance updates.
+        """
+        changes = cls.changes(transactions)
+        if not changes:
+            return
+        cls.objects.bulk_create([cls(wallet_id=wallet_id, date=day) for wallet_id, day in changes],
+                                ignore_conflicts=True)
+        
+        days = {}
+        for (wallet_id, day), change in changes.items():
+            days.setdefault(day, {})[wallet_id] = change
+        for day, wallet_changes in days.items():
+            fields = {field for change in wallet_changes.values() for field in change}
+            updates = {}
+            for field in fields:
+                output_field = cls._meta.get_field(field)
+                value = Case(
+                    *[When(wallet_id=wallet_id, then=Value(change[field], output_field=output_field))
+                      for wallet_id, change in wallet_changes.items() if field in change],
+                    default=Value(0, output_field=output_field) if field != 'closing_balance' else F(field),
+                    output_field=output_field,
+                )
+                updates[field] = value if field == 'closing_balance' else F(field) + value
+            cls.objects.filter(date=day, wallet_id__in=wallet_changes).update(**updates)
+    
+    def __str__(self):
+        return f"{self.wallet.user.username} - {self.date}"
+
+class BalanceCheckpoint(models.Model):
+    """A wallet's balance after every transaction up to `as_of`, built by build_ledger_checkpoints"""
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='checkpoints')
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    transaction_count = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'as_of'], name='checkpoint_unique_as_of'),
+        ]
+    
+    def __str__(self):
+        return f"{self.wallet.user.username} - R{self.balance} as of {self.as_of:%Y-%m-%d %H:%M}"
+
+class ArchivedTransactionMonth(models.Model):
+    """One wallet's transactions of one month, moved out of the Transaction table by archive_transactions"""
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='archived_months')
+    month = models.DateField()
+    transaction_count = models.PositiveIntegerField()
+    first_transaction_id = models.PositiveBigIntegerField()
+    last_transaction_id = models.PositiveBigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    # {transaction type: {'count': n, 'amount': 'total'}}
+    totals = models.JSONField(default=dict)
+    # zlib-compressed JSON lines of the transactions, oldest first
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'month'], name='archived_month_unique'),
+        ]
+    
+    def transactions(self):
+        """The archived transactions, oldest first, as unsaved Transaction instances"""
+        from .archive import unpack
+        return unpack(self)
+    
+    def balance_as_of(self, when):
+        balance = self.opening_balance
+        for transaction in self.transactions():
+            if transaction.timestamp > when:
+                break
+            balance += transaction.signed_amount
+        return balance
+    
+    def __str__(self):
+        return f"{self.wallet.user.username} - {self.month:%b %Y} ({self.transaction_count} transactions)"
+
 # Signal to create profiles and wallet automatically
 @receiver(post_save, sender=User)
 def create_user_profiles(sender, instance, created, **kwargs):
@@ -0,0 +1,111 @@
+"""
+Monthly wallet statements.
+
+A statement is built from the ledger: the opening and closing balances come
+from Wallet.balance_as_of(), and the month's transactions from the hot table
+and the archive, totalled per transaction type. Statements are rendered to
+HTML files under STATEMENT_ROOT/<YYYY-MM>/. Each file is written under a
+temporary name and renamed once complete, so an existing file is a finished
+statement and an interrupted run resumes with the wallets that have none.
+"""
+
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .models import ArchivedTransactionMonth, Transaction, Wallet
+
+STATEMENT_ROOT = Path(getattr(settings, 'STATEMENT_ROOT', settings.BASE_DIR / 'statements'))
+
+
+def month_bounds(month):
+    """Start of the month beginning on the date `month` and start of the next one"""
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    return start, timezone.make_aware(datetime.combine(month + relativedelta(months=1), datetime.min.time()))
+
+
+def statement_path(directory, month, wallet_id):
+    return Path(directory) / month.strftime('%Y-%m') / f'wallet-{wallet_id}.html'
+
+
+def pending_wallets(month, directory=STATEMENT_ROOT, wallet_ids=None):
+    """Ids of the wallets without a statement for the month, in id order"""
+    wallets = Wallet.objects.order_by('pk')
+    if wallet_ids:
+        wallets = wallets.filter(pk__in=wallet_ids)
+    written = {path.name for path in (Path(directory) / month.strftime('%Y-%m')).glob('wallet-*.html')}
+    return [pk for pk in wallets.values_list('pk', flat=True).iterator(chunk_size=2000)
+            if f'wallet-{pk}.html' not in written]
+
+
+def month_transactions(wallet_ids, month):
+    """{wallet id: transactions of the month, oldest first} from the archive and the hot table"""
+    start, end = month_bounds(month)
+    found = {pk: [] for pk in wallet_ids}
+    archived = ArchivedTransactionMonth.objects.filter(wallet_id__in=wallet_ids, month=month)
+    for archived_month in archived:
+        found[archived_month.wallet_id].extend(archived_month.transactions())
+    # Rows backdated into an archived month stay in the hot table until it is archived again
+    hot = Transaction.objects.filter(wallet_id__in=wallet_ids, timestamp__gte=start, timestamp__lt=end)
+    for transaction in hot.order_by('timestamp', 'pk'):
+        found[transaction.wallet_id].append(transaction)
+    for transactions in found.values():
+        transactions.sort(key=lambda transaction: (transaction.timestamp, transaction.pk))
+    Transaction.prefetch_related_entities([t for transactions in found.values() for t in transactions])
+    return found
+
+
+def build_statement(wallet, month, transactions):
+    start, end = month_bounds(month)
+    opening = wallet.balance_as_of(start - timedelta(microseconds=1))
+    closing = wallet.balance_as_of(end - timedelta(microseconds=1))
+
+    labels = dict(Transaction.TRANSACTION_TYPE_CHOICES)
+    totals = {key: {'label': label, 'count': 0, 'amount': Decimal('0.00')} for key, label in labels.items()}
+    for transaction in transactions:
+        totals[transaction.transaction_type]['count'] += 1
+        totals[transaction.transaction_type]['amount'] += transaction.amount
+    money_in = sum((totals[key]['amount'] for key in Transaction.CREDIT_TYPES), Decimal('0.00'))
+    money_out = sum((total['amount'] for key, total in totals.items() if key not in Transaction.CREDIT_TYPES),
+                    Decimal('0.00'))
+
+    return {
+        'wallet': wallet,
+        'month': month,
+        'period_end': (end - timedelta(days=1)).date(),
+        'opening_balance': opening,
+        'closing_balance': closing,
+        'money_in': money_in,
+        'money_out': money_out,
+        'totals': totals,
+        'transactions': transactions,
+        # The month's transactions must account for the change in balance
+        'balanced': opening + money_in - money_out == closing,
+        'generated_at': timezone.now(),
+    }
+
+
+def write_statement(statement, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+    partial.write_text(render_to_string('accounts/statement.html', {'statement': statement}))
+    os.replace(partial, path)
+
+
+def generate_statements(wallet_ids, month, directory=STATEMENT_ROOT):
+    """Write the month's statements of a chunk of wallets; returns (written, unbalanced wallet ids)"""
+    wallets = Wallet.objects.filter(pk__in=wallet_ids).select_related('user').order_by('pk')
+    transactions = month_transactions(wallet_ids, month)
+    written = 0
+    unbalanced = []
+    for wallet in wallets:
+        statement = build_statement(wallet, month, transactions[wallet.pk])
+        write_statement(statement, statement_path(directory, month, wallet.pk))
+        written += 1
+        if not statement['balanced']:
+            unbalanced.append(wallet.pk)
+    return written, unbalanced
@@ -1,3 +1,133 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from . import archive, exports, ledger, statements
+from .models import Transaction, WalletDailySummary
 
-# Create your tests here.
+
+def moment(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.wallet = User.objects.create_user('saver', password='password').wallet
+        history = [
+            (moment(2020, 1, 5, 9), 'deposit', Decimal('100.00')),
+            (moment(2020, 1, 20, 9), 'withdrawal', Decimal('30.00')),
+            (moment(2020, 2, 3, 9), 'deposit', Decimal('50.50')),
+            (moment(2020, 2, 28, 9), 'withdrawal', Decimal('20.25')),
+            (moment(2020, 3, 10, 9), 'deposit', Decimal('10.00')),
+        ]
+        for when, kind, amount in history:
+            if kind == 'deposit':
+                self.wallet.deposit_funds(amount)
+            else:
+                self.wallet.withdraw_funds(amount)
+            Transaction.objects.filter(pk=self.wallet.transactions.latest('pk').pk).update(timestamp=when)
+        self.moments = [moment(2019, 12, 31), *(when for when, _, _ in history),
+                        moment(2020, 1, 10), moment(2020, 2, 15), moment(2020, 2, 29), moment(2020, 4, 1)]
+
+    def ledger(self):
+        balances = [self.wallet.balance_as_of(when) for when in self.moments]
+        rows = {}
+        for month in (datetime(2020, 1, 1).date(), datetime(2020, 2, 1).date(), datetime(2020, 3, 1).date()):
+            transactions = statements.month_transactions([self.wallet.pk], month)[self.wallet.pk]
+            statement = statements.build_statement(self.wallet, month, transactions)
+            rows[month] = (statement['opening_balance'], statement['closing_balance'], statement['balanced'],
+                           [(row.pk, row.timestamp, row.transaction_type, row.amount, row.balance_after)
+                            for row in transactions])
+        export = list(exports.transaction_rows(archive.wallet_ledger(self.wallet)))
+        return balances, rows, export
+
+    def test_archiving_keeps_balances_statements_and_exports(self):
+        before = self.ledger()
+
+        archive.archive_month(self.wallet, moment(2020, 1, 1))
+        archive.archive_month(self.wallet, moment(2020, 2, 1))
+
+        self.assertEqual(self.wallet.transactions.count(), 1)
+        self.assertEqual(self.wallet.archived_months.count(), 2)
+        self.assertEqual(self.ledger(), before)
+
+    def test_month_transactions_does_not_load_wallets(self):
+        other = User.objects.create_user('spender', password='password').wallet
+        other.deposit_funds(Decimal('5.00'))
+        Transaction.objects.filter(wallet=other).update(timestamp=moment(2020, 1, 8))
+        for wallet in (self.wallet, other):
+            archive.archive_month(wallet, moment(2020, 1, 1))
+
+        # One query for the archived months and one for the hot table
+        with self.assertNumQueries(2):
+            found = statements.month_transactions([self.wallet.pk, other.pk], datetime(2020, 1, 1).date())
+        self.assertEqual([len(found[self.wallet.pk]), len(found[other.pk])], [2, 1])
+
+    @override_settings(LEDGER_HOT_MONTHS=3)
+    def test_horizon_reads_hot_months_setting(self):
+        start = timezone.localdate().replace(day=1)
+        horizon = archive.horizon()
+
+        self.assertEqual(horizon.day, 1)
+        self.assertEqual((start.year - horizon.year) * 12 + start.month - horizon.month, 3)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.wallet = User.objects.create_user('saver', password='password').wallet
+
+    def write(self, when, kind, amount):
+        with mock.patch('django.utils.timezone.now', return_value=when):
+            if kind == 'deposit':
+                self.wallet.deposit_funds(amount)
+            else:
+                self.wallet.withdraw_funds(amount)
+
+    def test_balance_as_of_agrees_around_checkpoints(self):
+        history = [
+            (moment(2020, 1, 5, 9), 'deposit', Decimal('100.00')),
+            (moment(2020, 1, 5, 9), 'withdrawal', Decimal('10.00')),
+            (moment(2020, 1, 6, 9), 'deposit', Decimal('25.25')),
+            (moment(2020, 1, 7, 9), 'withdrawal', Decimal('40.00')),
+            (moment(2020, 1, 7, 12), 'deposit', Decimal('5.05')),
+            (moment(2020, 1, 9, 9), 'withdrawal', Decimal('0.30')),
+        ]
+        for entry in history:
+            self.write(*entry)
+        moments = sorted({when + offset for when, _, _ in history
+                          for offset in (-timedelta(microseconds=1), timedelta(0), timedelta(microseconds=1))})
+        without = [self.wallet.balance_as_of(when) for when in moments]
+
+        self.assertEqual(ledger.build_checkpoints(self.wallet, moment(2020, 1, 8), every=2), 2)
+        self.assertEqual(ledger.build_checkpoints(self.wallet, moment(2020, 2, 1), every=2, daily=True), 2)
+
+        checkpoints = list(self.wallet.checkpoints.order_by('as_of').values_list('as_of', 'balance'))
+        self.assertEqual(checkpoints, [
+            (moment(2020, 1, 5, 9), Decimal('90.00')),
+            (moment(2020, 1, 7, 9), Decimal('75.25')),
+            (moment(2020, 1, 7, 12), Decimal('80.30')),
+            (moment(2020, 1, 9, 9), Decimal('80.00')),
+        ])
+        self.assertEqual([self.wallet.balance_as_of(when) for when in moments], without)
+
+    def test_rebuilt_daily_summaries_match_recorded_ones(self):
+        for entry in [
+            (moment(2020, 1, 5, 9), 'deposit', Decimal('100.00')),
+            (moment(2020, 1, 5, 17), 'withdrawal', Decimal('10.00')),
+            (moment(2020, 2, 6, 9), 'deposit', Decimal('25.25')),
+            (moment(2020, 2, 7, 9), 'withdrawal', Decimal('40.00')),
+            (moment(2020, 2, 7, 23, 59), 'deposit', Decimal('5.05')),
+        ]:
+            self.write(*entry)
+        # Part of the history is rebuilt from the archive
+        archive.archive_month(self.wallet, moment(2020, 1, 1))
+
+        def summaries():
+            return list(WalletDailySummary.objects.filter(wallet=self.wallet).order_by('date').values(
+                *(field.name for field in WalletDailySummary._meta.fields if field.name != 'id')))
+        recorded = summaries()
+
+        self.assertEqual(ledger.rebuild_daily_summaries(self.wallet), 3)
+        self.assertEqual(summaries(), recorded)
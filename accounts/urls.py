@@ -21,6 +21,7 @@ urlpatterns = [
     path('wallet/deposit/', views.deposit_funds, name='deposit_funds'),
     path('wallet/withdraw/', views.withdraw_funds, name='withdraw_funds'),
     path('wallet/statistics/', views.wallet_statistics, name='wallet_statistics'),
+    path('wallet/export/<str:fmt>/', views.export_transactions, name='export_transactions'),
     path('wallet/transaction/<int:transaction_id>/', views.transaction_detail, name='transaction_detail'),
     
     # Verification
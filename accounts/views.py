@@ -1,10 +1,16 @@
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
 from django.db import models
-from .models import UserProfile, Wallet, Transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from .models import UserProfile, Wallet, Transaction, WalletDailySummary
+from . import archive, exports
+from lending.pagination import InvalidCursor
 from .forms import (
     UserRegistrationForm, InvestorProfileForm, BorrowerProfileForm, 
     DepositForm, WithdrawalForm, BorrowerVerificationForm
@@ -145,15 +151,22 @@ def profile(request):
     
     return render(request, 'accounts/profile.html', context)
 
+# Transactions per page of the wallet history
+WALLET_PAGE_SIZE = 50
+
 @login_required
 def wallet_view(request):
     """Display user wallet and transaction history"""
     wallet = request.user.wallet
-    transactions = Transaction.objects.filter(wallet=wallet).order_by('-timestamp')
+    try:
+        page = archive.history_page(wallet, request.GET.get('cursor'), WALLET_PAGE_SIZE)
+    except InvalidCursor:
+        page = archive.history_page(wallet, None, WALLET_PAGE_SIZE)
     
     context = {
         'wallet': wallet,
-        'transactions': transactions
+        'transactions': Transaction.prefetch_related_entities(page),
+        'page': page,
     }
     
     return render(request, 'accounts/wallet.html', context)
@@ -204,7 +217,9 @@ def withdraw_funds(request):
                 return redirect('accounts:withdraw_funds')
             
             # Process withdrawal
-            wallet.withdraw_funds(amount)
+            if not wallet.withdraw_funds(amount):
+                messages.error(request, 'Insufficient funds in your wallet.')
+                return redirect('accounts:withdraw_funds')
             
             messages.success(request, f'Successfully withdrew ${amount} from your wallet.')
             return redirect('accounts:wallet')
@@ -262,22 +277,72 @@ def borrower_verification(request):
 @login_required
 def transaction_detail(request, transaction_id):
     """View details of a specific transaction"""
-    transaction = get_object_or_404(Transaction, id=transaction_id, wallet__user=request.user)
+    transaction = archive.find_transaction(transaction_id, wallet__user=request.user)
+    if transaction is None:
+        raise Http404('No transaction matches the given query.')
     
     return render(request, 'accounts/transaction_detail.html', {
         'transaction': transaction
     })
 
+@login_required
+def export_transactions(request, fmt):
+    """Stream the wallet's whole transaction history as CSV or JSONL"""
+    if fmt not in exports.FORMATS:
+        raise Http404('Unknown export format.')
+    user = exports.export_subject(request)
+    wallet = get_object_or_404(Wallet, user=user)
+    
+    return exports.export_response(
+        f'transactions-{user.username}', exports.TRANSACTION_FIELDS,
+        exports.transaction_rows(archive.wallet_ledger(wallet)), fmt,
+    )
+
+# Lookback windows of the monthly cash flow chart
+STATISTICS_MONTHS = (6, 12, 24, 60)
+
 @login_required
 def wallet_statistics(request):
     """Display detailed statistics for user's wallet"""
     wallet = request.user.wallet
     transactions = Transaction.objects.filter(wallet=wallet)
     
+    try:
+        lookback = int(request.GET.get('months', STATISTICS_MONTHS[0]))
+    except ValueError:
+        lookback = STATISTICS_MONTHS[0]
+    if lookback not in STATISTICS_MONTHS:
+        lookback = STATISTICS_MONTHS[0]
+    
+    # Calendar months of the window, oldest first
+    this_month = timezone.localdate().replace(day=1)
+    month_starts = [this_month - relativedelta(months=i) for i in range(lookback - 1, -1, -1)]
+    
+    # Statistics are read from the daily summaries, a row per day with activity, not from the ledger
+    summaries = WalletDailySummary.objects.filter(wallet=wallet)
+    
+    # Count and total of each transaction type, in one aggregate
+    type_names = [t_type for t_type, _ in Transaction.TRANSACTION_TYPE_CHOICES]
+    totals = summaries.aggregate(**{
+        f'{t_type}_{column}': models.Sum(f'{t_type}_{column}')
+        for t_type in type_names for column in ('count', 'amount')
+    })
+    
+    # Money in and out of every month in the window, in one query
+    cash_flow = {month: (0, 0) for month in month_starts}
+    monthly = summaries.filter(date__gte=month_starts[0]).annotate(
+        month=TruncMonth('date')
+    ).values('month').annotate(
+        money_in=models.Sum('money_in'),
+        money_out=models.Sum('money_out'),
+    ).order_by()
+    for row in monthly:
+        cash_flow[row['month']] = (row['money_in'], row['money_out'])
+    
     # Calculate basic statistics
-    deposit_sum = transactions.filter(transaction_type='deposit').aggregate(models.Sum('amount'))['amount__sum'] or Decimal('0.00')
-    withdrawal_sum = transactions.filter(transaction_type='withdrawal').aggregate(models.Sum('amount'))['amount__sum'] or Decimal('0.00')
-    transaction_count = transactions.count()
+    deposit_sum = totals['deposit_amount'] or Decimal('0.00')
+    withdrawal_sum = totals['withdrawal_amount'] or Decimal('0.00')
+    transaction_count = sum(totals[f'{t_type}_count'] or 0 for t_type in type_names)
     
     # Get recent transactions
     recent_transactions = transactions.order_by('-timestamp')[:5]
@@ -291,47 +356,17 @@ def wallet_statistics(request):
             roi = round(roi, 2)
     
     # Prepare data for charts
-    # Monthly cash flow
-    months_data = {}
-    for i in range(0, 6):  # Last 6 months
-        target_month = datetime.datetime.now() - datetime.timedelta(days=30 * i)
-        month_key = target_month.strftime('%b %Y')
-        
-        # Money in for the month
-        money_in = transactions.filter(
-            transaction_type__in=['deposit', 'return'],
-            timestamp__year=target_month.year,
-            timestamp__month=target_month.month
-        ).aggregate(models.Sum('amount'))['amount__sum'] or 0
-        
-        # Money out for the month
-        money_out = transactions.filter(
-            transaction_type__in=['withdrawal', 'investment', 'fee'],
-            timestamp__year=target_month.year,
-            timestamp__month=target_month.month
-        ).aggregate(models.Sum('amount'))['amount__sum'] or 0
-        
-        months_data[month_key] = {
-            'in': float(money_in),
-            'out': float(money_out)
-        }
-    
-    # Sort months chronologically
-    months = list(months_data.keys())
-    months.reverse()  # Most recent last
-    
-    money_in = [months_data[m]['in'] for m in months]
-    money_out = [months_data[m]['out'] for m in months]
+    # Monthly cash flow, most recent last
+    months = [month.strftime('%b %Y') for month in month_starts]
+    money_in = [float(cash_flow[month][0]) for month in month_starts]
+    money_out = [float(cash_flow[month][1]) for month in month_starts]
     
     # Transaction types distribution
     transaction_types = []
     transaction_amounts = []
     
     for t_type, t_name in Transaction.TRANSACTION_TYPE_CHOICES:
-        amount = transactions.filter(
-            transaction_type=t_type
-        ).aggregate(models.Sum('amount'))['amount__sum'] or 0
-        
+        amount = totals[f'{t_type}_amount'] or 0
         if amount > 0:
             transaction_types.append(t_name)
             transaction_amounts.append(float(amount))
@@ -347,7 +382,9 @@ def wallet_statistics(request):
         'money_in': money_in,
         'money_out': money_out,
         'transaction_types': transaction_types,
-        'transaction_amounts': transaction_amounts
+        'transaction_amounts': transaction_amounts,
+        'lookback': lookback,
+        'lookback_choices': STATISTICS_MONTHS,
     }
     
     return render(request, 'accounts/wallet_statistics.html', context)
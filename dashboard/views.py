@@ -1,6 +1,6 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, F, Value, DecimalField
+from django.db.models import Sum, F, Value, DecimalField, Prefetch
 from django.contrib import messages
 from accounts.models import Transaction
 from lending.models import Loan, Investment, LoanPayment
@@ -21,7 +21,9 @@ def investor_dashboard(request):
     wallet = request.user.wallet
     
     # Get user's investments
-    investments = Investment.objects.filter(investor=request.user).order_by('-date_invested')
+    investments = Investment.objects.filter(investor=request.user).prefetch_related(
+        Prefetch('loan', queryset=Loan.objects.with_payment_metrics())
+    ).order_by('-date_invested')
     
     # Get recent transactions
     recent_transactions = Transaction.objects.filter(wallet=wallet).order_by('-timestamp')[:10]
@@ -98,7 +100,7 @@ def borrower_dashboard(request):
     wallet = request.user.wallet
     
     # Get user's loans
-    loans = Loan.objects.filter(borrower=request.user).order_by('-created_at')
+    loans = Loan.objects.filter(borrower=request.user).with_payment_metrics().order_by('-created_at')
     
     # Get recent transactions
     recent_transactions = Transaction.objects.filter(wallet=wallet).order_by('-timestamp')[:10]
@@ -106,14 +108,14 @@ def borrower_dashboard(request):
     # Upcoming payments - find the next pending payment for each active loan
     upcoming_payments = []
     try:
-        for loan in loans.filter(status__in=['active', 'funded']):
-            next_payment = LoanPayment.objects.filter(
-                loan=loan,
-                status__in=['pending', 'late']
-            ).order_by('due_date').first()
-            
-            if next_payment:
-                upcoming_payments.append({'loan': loan, 'payment': next_payment})
+        open_payments = Prefetch(
+            'payments',
+            queryset=LoanPayment.objects.filter(status__in=['pending', 'late']).order_by('due_date'),
+            to_attr='open_payments'
+        )
+        for loan in loans.filter(status__in=['active', 'funded']).prefetch_related(open_payments):
+            if loan.open_payments:
+                upcoming_payments.append({'loan': loan, 'payment': loan.open_payments[0]})
     except Exception as e:
         # Log the error but continue
         print(f"Error processing upcoming payments: {e}")
@@ -129,7 +131,7 @@ def borrower_dashboard(request):
     total_borrowed = loans.aggregate(total=Sum('amount'))['total'] or 0
     active_loans_count = loans.filter(status__in=['active', 'funded']).count()
     active_loans = loans.filter(status__in=['active', 'funded'])
-    pending_loans = loans.filter(status='pending').count()
+    pending_loans = loans.filter(status='pending')
     
     # Calculate total repaid
     total_repaid = LoanPayment.objects.filter(
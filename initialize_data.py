@@ -214,6 +214,7 @@ def create_sample_investments(investors, loans):
                         loan=loan,
                         amount=available_amount
                     )
+                    loan.recalculate_funding_totals()
                     
                     # Update wallet
                     wallet.balance -= available_amount
@@ -3,7 +3,9 @@ from django.utils.html import format_html
 from django.urls import reverse, path
 from django.http import HttpResponseRedirect
 from django.contrib import messages
-from .models import Loan, Investment, LoanPayment, PortfolioAnalysis
+from django.db import transaction
+from .models import Loan, Investment, LoanPayment, PortfolioAnalysis, AutoInvestRule, refund_investment
+from . import detail_cache, live, orderbook
 
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
@@ -11,7 +13,7 @@ class LoanAdmin(admin.ModelAdmin):
                    'term_months', 'status', 'created_at', 'funding_progress', 'action_buttons')
     list_filter = ('status', 'purpose', 'risk_score', 'created_at', 'borrower_verified')
     search_fields = ('title', 'description', 'borrower__username', 'borrower__email')
-    readonly_fields = ('borrower', 'created_at', 'current_funded_amount', 'risk_score')
+    readonly_fields = ('borrower', 'created_at', 'funded_amount', 'investor_count', 'risk_score')
     
     # Define actions as a list or None
     actions = None
@@ -24,7 +26,7 @@ class LoanAdmin(admin.ModelAdmin):
             'fields': ('purpose', 'purpose_description', 'risk_score')
         }),
         ('Funding', {
-            'fields': ('current_funded_amount', 'funding_deadline')
+            'fields': ('funded_amount', 'investor_count', 'funding_deadline')
         }),
         ('Verification', {
             'fields': ('borrower_verified', 'identity_verified', 'income_verified')
@@ -46,7 +48,7 @@ class LoanAdmin(admin.ModelAdmin):
         if obj.amount == 0:
             percentage = 0
         else:
-            percentage = int((obj.current_funded_amount / obj.amount) * 100)
+            percentage = int((obj.funded_amount / obj.amount) * 100)
         
         return format_html(
             '<div style="width:100px; background-color:#f8f9fa; height:20px; border-radius:3px;">'
@@ -90,21 +92,36 @@ class LoanAdmin(admin.ModelAdmin):
         loan = self.get_object(request, object_id)
         if loan.status == 'pending':
             # Only change status if not all funding is received yet
-            if loan.current_funded_amount < loan.amount:
+            if loan.funded_amount < loan.amount:
                 loan.status = 'active'
-                loan.save()
+                loan.save(update_fields=['status'])
                 self.message_user(request, f"Loan '{loan.title}' has been approved and is now active.", messages.SUCCESS)
             else:
-                loan.status = 'funded'
-                loan.save()
+                # Writes the payment schedule and investor shares, as a filling investment does
+                with transaction.atomic():
+                    loan.close_funding()
                 self.message_user(request, f"Loan '{loan.title}' has been approved and is fully funded.", messages.SUCCESS)
+            orderbook.loan_changed(loan.pk)
+            live.publish_funding(loan)
+            detail_cache.loan_changed(loan.pk)
         return HttpResponseRedirect("../")
     
     def reject_loan(self, request, object_id, *args, **kwargs):
         loan = self.get_object(request, object_id)
         if loan.status == 'pending':
-            loan.status = 'cancelled'
-            loan.save()
+            with transaction.atomic():
+                loan.status = 'cancelled'
+                loan.save(update_fields=['status'])
+                
+                # Return any funds already committed by investors
+                for investment in loan.investments.select_related('investor', 'loan'):
+                    refund_investment(investment, description=f'Refund for rejected loan {loan.title}')
+                
+                orderbook.loan_changed(loan.pk)
+                loan.refresh_from_db(fields=['funded_amount', 'investor_count'])
+                live.publish_funding(loan)
+                detail_cache.loan_changed(loan.pk)
+            
             self.message_user(request, f"Loan '{loan.title}' has been rejected.", messages.WARNING)
         return HttpResponseRedirect("../")
 
@@ -147,6 +164,20 @@ class InvestmentAdmin(admin.ModelAdmin):
         # Only superusers can delete investments for audit purposes
         return request.user.is_superuser
 
+@admin.register(AutoInvestRule)
+class AutoInvestRuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'investor_name', 'name', 'risk_band', 'purpose', 'min_interest_rate',
+                    'amount_per_loan', 'invested_amount', 'max_exposure', 'is_active')
+    list_filter = ('is_active', 'risk_band', 'purpose')
+    search_fields = ('name', 'investor__username', 'investor__email')
+    readonly_fields = ('investor', 'invested_amount', 'created_at')
+    
+    def investor_name(self, obj):
+        return obj.investor.username
+    
+    def has_add_permission(self, request):
+        return False
+
 @admin.register(LoanPayment)
 class LoanPaymentAdmin(admin.ModelAdmin):
     list_display = ('id', 'loan_title', 'payment_number', 'due_date', 'amount_due', 
@@ -187,6 +218,7 @@ class LoanPaymentAdmin(admin.ModelAdmin):
             payment.payment_date = datetime.date.today()  # or use timezone.now().date()
             payment.amount_paid = payment.amount_due
             payment.save()
+            detail_cache.loan_changed(payment.loan_id)
         
         self.message_user(request, f"{queryset.count()} payment(s) marked as paid.")
     
@@ -196,6 +228,7 @@ class LoanPaymentAdmin(admin.ModelAdmin):
         for payment in queryset.filter(status='pending'):
             payment.status = 'late'
             payment.save()
+            detail_cache.loan_changed(payment.loan_id)
         
         self.message_user(request, f"{queryset.count()} payment(s) marked as late.")
     
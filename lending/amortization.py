@@ -0,0 +1,122 @@
+"""
+Vectorized amortization for many loans at once.
+
+Amounts are handled as integer cents so the results match the per-loan
+Decimal path (Loan.calculate_monthly_payment and
+Loan.build_repayment_schedule) to the cent. Any value that lands too close
+to a half-cent for floating point to round reliably is recomputed with
+Decimal.
+"""
+
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_EVEN
+import numpy as np
+
+Amortization = namedtuple('Amortization', ['payments', 'principal', 'interest'])
+
+CENT = Decimal('0.01')
+
+# Distance from a half cent below which float rounding is not trusted
+TIE_TOLERANCE = 1e-6
+
+
+def to_cents(values):
+    """Convert Decimal/float amounts to an int64 array of cents"""
+    return np.array([int((Decimal(str(value)) * 100).to_integral_value(ROUND_HALF_EVEN)) for value in values],
+                    dtype=np.int64)
+
+
+def cents_to_decimal(cents):
+    """Convert an integer number of cents back to a 2dp Decimal"""
+    return (Decimal(int(cents)) / 100).quantize(CENT)
+
+
+def _decimal_monthly_rate(annual_rate):
+    return Decimal(repr(float(annual_rate))) / Decimal('100') / 12
+
+
+def _round_half_even(values, exact):
+    """Round float cents half-to-even, recomputing near-ties with the Decimal fallback `exact(index)`"""
+    rounded = np.rint(values)
+    fraction = values - np.floor(values)
+    for index in np.flatnonzero(np.abs(fraction - 0.5) < TIE_TOLERANCE):
+        rounded[index] = exact(index)
+    return rounded.astype(np.int64)
+
+
+def monthly_payments(principal_cents, annual_rates, terms):
+    """Monthly payment in cents for each loan.
+
+    principal_cents: int64 array of loan amounts in cents
+    annual_rates: array of annual interest rates in percent (e.g. 10.5)
+    terms: int array of terms in months
+    """
+    principal_cents = np.asarray(principal_cents, dtype=np.int64)
+    annual_rates = np.asarray(annual_rates, dtype=np.float64)
+    terms = np.asarray(terms, dtype=np.int64)
+
+    principal = principal_cents.astype(np.float64)
+    r = annual_rates / 100.0 / 12.0
+
+    # Amortization formula: P = A * (r(1+r)^n) / ((1+r)^n - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.power(1.0 + r, terms)
+        payments = np.where(r == 0, principal / terms, principal * (r * growth) / (growth - 1.0))
+
+    def exact(index):
+        amount = Decimal(int(principal_cents[index])) / 100
+        rate = _decimal_monthly_rate(annual_rates[index])
+        n = int(terms[index])
+        if rate == 0:
+            payment = amount / n
+        else:
+            payment = amount * ((rate * (1 + rate) ** n) / ((1 + rate) ** n - 1))
+        return int((payment * 100).to_integral_value(ROUND_HALF_EVEN))
+
+    return _round_half_even(payments, exact)
+
+
+def amortize(principal_cents, annual_rates, terms, payments=None):
+    """Build the full schedule for every loan.
+
+    Returns an Amortization of int64 cents: `payments` with shape (loans,) and
+    `principal`/`interest` with shape (loans, max term), zero-padded past each
+    loan's term. Pass `payments` to amortize against stored monthly payments
+    instead of recomputing them.
+    """
+    principal_cents = np.asarray(principal_cents, dtype=np.int64)
+    annual_rates = np.asarray(annual_rates, dtype=np.float64)
+    terms = np.asarray(terms, dtype=np.int64)
+
+    if payments is None:
+        payments = monthly_payments(principal_cents, annual_rates, terms)
+    payments = np.asarray(payments, dtype=np.int64)
+
+    loan_count = len(principal_cents)
+    max_term = int(terms.max()) if loan_count else 0
+    principal = np.zeros((loan_count, max_term), dtype=np.int64)
+    interest = np.zeros((loan_count, max_term), dtype=np.int64)
+
+    r = annual_rates / 100.0 / 12.0
+    balance = principal_cents.copy()
+
+    for month in range(max_term):
+        active = month < terms
+        last = month == terms - 1
+
+        def exact(index):
+            raw = Decimal(int(balance[index])) / 100 * _decimal_monthly_rate(annual_rates[index])
+            return int((raw.quantize(CENT) * 100))
+
+        month_interest = _round_half_even(balance * r, exact)
+        month_principal = payments - month_interest
+
+        # Last payment - make sure we pay off exactly the balance
+        month_principal = np.where(last, balance, month_principal)
+        month_interest = np.where(last, payments - balance, month_interest)
+
+        principal[:, month] = np.where(active, month_principal, 0)
+        interest[:, month] = np.where(active, month_interest, 0)
+        balance = balance - principal[:, month]
+
+    return Amortization(payments, principal, interest)
@@ -0,0 +1,142 @@
+"""
+Auto-invest: investors' standing rules applied to new loans.
+
+A rule matches a loan when the loan is in the rule's risk band and purpose
+(blank means any), pays at least its minimum rate and runs no longer than its
+maximum term. Matching does not walk the rules: active rules are indexed on
+(risk_band, purpose, min_interest_rate), so a loan reads only the four
+band/purpose combinations that can apply to it and, within each, the rules
+whose minimum rate it clears.
+
+Matched rules are allocated oldest first, one investment per investor,
+limited by the rule's per-loan amount and remaining exposure, the investor's
+balance and the room left on the loan. All allocations for a loan are
+written in one transaction: the investments, wallet debits, ledger entries,
+investor totals and rule exposures each with one bulk statement.
+"""
+
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Q
+from accounts.models import InvestorProfile, Transaction, Wallet, WalletDailySummary
+from . import detail_cache, facets, live, orderbook
+from .models import AutoInvestRule, Investment, Loan, retry_on_conflict
+
+# Smallest investment a rule will place (the minimum of the investment form)
+MIN_ALLOCATION = Decimal('10.00')
+
+
+def risk_band(risk_score):
+    for key, _, low, high in facets.RISK_BUCKETS:
+        if facets.in_range(risk_score, low, high):
+            return key
+    return ''
+
+
+def matching_rules(loan):
+    """Active rules of other investors that the loan satisfies, oldest first"""
+    return AutoInvestRule.objects.filter(
+        is_active=True,
+        risk_band__in=['', risk_band(loan.risk_score)],
+        purpose__in=['', loan.purpose],
+        min_interest_rate__lte=loan.interest_rate,
+    ).filter(
+        Q(max_term_months__isnull=True) | Q(max_term_months__gte=loan.term_months),
+        invested_amount__lt=F('max_exposure'),
+    ).exclude(
+        investor_id=loan.borrower_id
+    ).exclude(
+        investor_id__in=Investment.objects.filter(loan_id=loan.pk).values('investor_id')
+    ).order_by('created_at', 'pk')
+
+
+def auto_invest(loan):
+    """Invest in a pending loan on behalf of every matching rule; returns the new investments"""
+    return retry_on_conflict(_auto_invest, loan)
+
+
+def _auto_invest(loan):
+    with transaction.atomic():
+        # One rule per investor: the oldest of theirs that matches. Matching only
+        # reads the loan's terms, which do not change while it is funded
+        rules = {}
+        for rule in matching_rules(loan):
+            rules.setdefault(rule.investor_id, rule)
+        if not rules:
+            return []
+
+        # Lock the wallets in primary key order, then the loan, as invest_in_loan and
+        # invest_in_basket do, so a run cannot deadlock with its rule owners' investments
+        wallets = {
+            wallet.user_id: wallet
+            for wallet in Wallet.objects.select_for_update().filter(user_id__in=rules).order_by('pk')
+        }
+        loan = Loan.objects.select_for_update().get(pk=loan.pk)
+        if loan.status != 'pending':
+            return []
+
+        # Rule owners who invested in the loan before the locks were taken are skipped
+        for investor_id in Investment.objects.filter(loan=loan, investor_id__in=rules).values_list(
+                'investor_id', flat=True):
+            rules.pop(investor_id, None)
+
+        room = loan.amount - loan.funded_amount
+        allocations = []
+        for investor_id, rule in rules.items():
+            wallet = wallets.get(investor_id)
+            if wallet is None:
+                continue
+            amount = min(rule.amount_per_loan, rule.remaining_exposure, wallet.balance, room)
+            if amount < MIN_ALLOCATION:
+                continue
+            room -= amount
+            allocations.append((rule, wallet, amount))
+            if room < MIN_ALLOCATION:
+                break
+
+        if not allocations:
+            return []
+
+        investments = Investment.objects.bulk_create([
+            Investment(investor_id=rule.investor_id, loan=loan, amount=amount, auto_invest_rule=rule)
+            for rule, _, amount in allocations
+        ])
+
+        balances = Wallet.adjust_balances({wallet.pk: -amount for _, wallet, amount in allocations})
+        WalletDailySummary.record(Transaction.objects.bulk_create([
+            Transaction(
+                wallet=wallet,
+                transaction_type='investment',
+                amount=amount,
+                description=f'Auto-invest in {loan.title}',
+                balance_after=balances[wallet.pk],
+                related_entity_type='investment',
+                related_entity_id=investment.pk,
+            )
+            for (_, wallet, amount), investment in zip(allocations, investments)
+        ]))
+
+        amounts = {rule.investor_id: amount for rule, _, amount in allocations}
+        profiles = list(InvestorProfile.objects.filter(user_profile__user_id__in=amounts)
+                        .select_related('user_profile'))
+        for profile in profiles:
+            profile.total_invested = F('total_invested') + amounts[profile.user_profile.user_id]
+        InvestorProfile.objects.bulk_update(profiles, ['total_invested'])
+
+        for rule, _, amount in allocations:
+            rule.invested_amount = F('invested_amount') + amount
+        AutoInvestRule.objects.bulk_update([rule for rule, _, _ in allocations], ['invested_amount'])
+
+        Loan.objects.filter(pk=loan.pk).update(
+            funded_amount=F('funded_amount') + sum(amounts.values()),
+            investor_count=F('investor_count') + len(allocations),
+        )
+        loan.refresh_from_db(fields=['funded_amount', 'investor_count'])
+        if loan.funded_amount >= loan.amount:
+            loan.close_funding()
+
+        orderbook.loan_changed(loan.pk)
+        live.publish_funding(loan)
+        detail_cache.loan_changed(loan.pk)
+
+        return investments
@@ -0,0 +1,48 @@
+"""
+Versioned cache of the loan detail page.
+
+Every loan has a version stamp in the cache. The writers that change what
+the page shows (investments, repayments, late payments and the admin status
+actions) call loan_changed(), which moves the loan to a fresh version once
+the transaction commits. The shared parts of the page are cached as template
+fragments keyed on that version, so a stale fragment is simply never looked
+up again, and the per-user parts are rendered live on every request. Only
+anonymous pages get an ETag, as signed-in ones depend on more than the loan.
+"""
+
+import hashlib
+import uuid
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'loan-detail:version:{}'
+
+# Fragments are also dropped after this long, which bounds how stale a page
+# can get when a loan is edited outside the functions above
+FRAGMENT_TIMEOUT = 3600
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def loan_version(loan_id):
+    return cache.get_or_set(VERSION_KEY.format(loan_id), _new_version, None)
+
+
+def loan_changed(loan_id):
+    """Invalidate the cached detail page of a loan once the transaction commits"""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY.format(loan_id), _new_version(), None))
+
+
+def loan_detail_etag(request, loan_id):
+    """ETag of an anonymous loan detail response: the loan's version"""
+    # Pages for signed-in users also carry their wallet balance and CSRF token,
+    # so they are always rendered; the cached fragments still spare the queries
+    if request.user.is_authenticated:
+        return None
+    # A page carrying flash messages must be sent in full
+    if len(messages.get_messages(request)):
+        return None
+    return hashlib.md5(f'{loan_id}:{loan_version(loan_id)}'.encode()).hexdigest()
@@ -0,0 +1,42 @@
+"""
+Streaming exports of an investor's investments and payouts.
+
+Built on accounts.exports: rows are produced lazily from chunked iterators.
+Investments carry the investor's stored share of the loan, and payouts are
+the repayment credits of the wallet, archived ones included.
+"""
+
+from django.db.models import OuterRef, Subquery
+from accounts.archive import wallet_ledger
+from accounts.exports import CHUNK_SIZE, chunks
+from accounts.models import Transaction
+from .models import Investment, LoanShare
+
+INVESTMENT_FIELDS = ('id', 'date_invested', 'loan_id', 'loan_title', 'loan_status', 'interest_rate',
+                     'term_months', 'amount', 'share', 'auto_invest_rule_id')
+
+PAYOUT_FIELDS = ('transaction_id', 'timestamp', 'loan_id', 'loan_title', 'payment_number', 'due_date', 'amount')
+
+
+def investment_rows(investor):
+    share = LoanShare.objects.filter(loan=OuterRef('loan'), investor=OuterRef('investor')).values('share')[:1]
+    return Investment.objects.filter(investor=investor).annotate(share=Subquery(share)).order_by(
+        'date_invested', 'id'
+    ).values_list(
+        'id', 'date_invested', 'loan_id', 'loan__title', 'loan__status', 'loan__interest_rate',
+        'loan__term_months', 'amount', 'share', 'auto_invest_rule_id',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def payout_rows(investor):
+    payouts = (transaction for transaction in wallet_ledger(investor.wallet, ['return'])
+               if transaction.related_entity_type == 'loan_payment')
+    for chunk in chunks(payouts):
+        for transaction in Transaction.prefetch_related_entities(chunk):
+            payment = transaction.related_entity
+            yield (
+                transaction.id, transaction.timestamp,
+                payment.loan_id if payment else '', payment.loan.title if payment else '',
+                payment.payment_number if payment else '', payment.due_date if payment else '',
+                transaction.amount,
+            )
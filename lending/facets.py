@@ -0,0 +1,200 @@
+"""
+Marketplace filters and their facet counts.
+
+Every filter group (amount, rate, term, risk) is a set of buckets. The count
+of each bucket under the current search and the other groups' filters is
+computed with one conditional-aggregation query. Counts are cached per
+normalized filter set; saving or deleting any loan moves the cache to a new
+version.
+"""
+
+import hashlib
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.db.models import Count, Q
+from .search import search_loans, search_terms
+
+FACET_CACHE_TIMEOUT = 300
+FACET_VERSION_KEY = 'marketplace-facets:version'
+
+# Buckets per filter group: (key, label, min, max), bounds inclusive
+TERM_BUCKETS = (
+    ('short', 'Short Term (≤ 12 months)', None, 12),
+    ('medium', 'Medium Term (13-36 months)', 13, 36),
+    ('long', 'Long Term (> 36 months)', 37, None),
+)
+
+RISK_BUCKETS = (
+    ('low', 'Low Risk (1-3)', None, 3),
+    ('medium', 'Medium Risk (4-7)', 4, 7),
+    ('high', 'High Risk (8-10)', 8, None),
+)
+
+# Quick ranges for the min/max inputs
+AMOUNT_RANGES = (
+    ('under_5k', 'Under R5,000', None, Decimal('4999.99')),
+    ('5k_10k', 'R5,000 - R10,000', Decimal('5000'), Decimal('9999.99')),
+    ('10k_25k', 'R10,000 - R25,000', Decimal('10000'), Decimal('24999.99')),
+    ('25k_plus', 'R25,000+', Decimal('25000'), None),
+)
+
+RATE_RANGES = (
+    ('under_8', 'Under 8%', None, Decimal('7.99')),
+    ('8_12', '8% - 12%', Decimal('8'), Decimal('11.99')),
+    ('12_plus', '12%+', Decimal('12'), None),
+)
+
+FILTER_FIELDS = {
+    'amount': 'amount',
+    'rate': 'interest_rate',
+    'term': 'term_months',
+    'risk': 'risk_score',
+}
+
+FACET_BUCKETS = {
+    'amount': AMOUNT_RANGES,
+    'rate': RATE_RANGES,
+    'term': TERM_BUCKETS,
+    'risk': RISK_BUCKETS,
+}
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return value if value.is_finite() else None
+
+
+def _range(field, minimum, maximum):
+    condition = Q()
+    if minimum is not None:
+        condition &= Q(**{f'{field}__gte': minimum})
+    if maximum is not None:
+        condition &= Q(**{f'{field}__lte': maximum})
+    return condition
+
+
+def in_range(value, minimum, maximum):
+    return (minimum is None or value >= minimum) and (maximum is None or value <= maximum)
+
+
+def normalize_filters(params):
+    """Canonical marketplace filters from request GET parameters; invalid values are dropped"""
+    term = params.get('term')
+    risk = params.get('risk')
+    return {
+        'q': ' '.join(search_terms(params.get('q'))),
+        'min_amount': _decimal(params.get('min_amount')),
+        'max_amount': _decimal(params.get('max_amount')),
+        'min_rate': _decimal(params.get('min_rate')),
+        'max_rate': _decimal(params.get('max_rate')),
+        'term': term if term in [key for key, _, _, _ in TERM_BUCKETS] else '',
+        'risk': risk if risk in [key for key, _, _, _ in RISK_BUCKETS] else '',
+    }
+
+
+def filter_bounds(filters):
+    """(min, max) per filter group for a normalized filter set, None meaning unbounded"""
+    def bucket(buckets, selected):
+        return next(((low, high) for key, _, low, high in buckets if key == selected), (None, None))
+
+    return {
+        'amount': (filters['min_amount'], filters['max_amount']),
+        'rate': (filters['min_rate'], filters['max_rate']),
+        'term': bucket(TERM_BUCKETS, filters['term']),
+        'risk': bucket(RISK_BUCKETS, filters['risk']),
+    }
+
+
+def filter_conditions(filters):
+    """One Q per filter group for a normalized filter set"""
+    return {
+        group: _range(FILTER_FIELDS[group], low, high)
+        for group, (low, high) in filter_bounds(filters).items()
+    }
+
+
+def matches_filters(loan, bounds):
+    """In-memory equivalent of filter_conditions for a loan and filter_bounds()"""
+    return all(
+        in_range(getattr(loan, FILTER_FIELDS[group]), low, high)
+        for group, (low, high) in bounds.items()
+    )
+
+
+def facet_buckets():
+    """{group: [(key, Q)]} for every bucket that gets a count"""
+    return {
+        group: [(key, _range(FILTER_FIELDS[group], low, high)) for key, _, low, high in buckets]
+        for group, buckets in FACET_BUCKETS.items()
+    }
+
+
+def count_facets(queryset, filters):
+    """Count every bucket in one query: {group: {bucket key: count}}.
+
+    A group's counts apply the search and the other groups' filters but not
+    its own, so the alternatives to the current choice stay visible.
+    """
+    conditions = filter_conditions(filters)
+    queryset = search_loans(queryset, filters['q']).order_by()
+
+    aggregates = {}
+    aliases = {}
+    for group, buckets in facet_buckets().items():
+        others = Q(*[condition for name, condition in conditions.items() if name != group])
+        for key, bucket in buckets:
+            alias = f'{group}_{key}'
+            aggregates[alias] = Count('pk', filter=others & bucket)
+            aliases[alias] = (group, key)
+
+    counts = {group: {} for group in conditions}
+    for alias, value in queryset.aggregate(**aggregates).items():
+        group, key = aliases[alias]
+        counts[group][key] = value
+    return counts
+
+
+def _cache_key(filters):
+    version = cache.get_or_set(FACET_VERSION_KEY, uuid.uuid4().hex, None)
+    normalized = json.dumps({
+        name: str(value.normalize()) if isinstance(value, Decimal) else value or ''
+        for name, value in filters.items()
+    }, sort_keys=True)
+    return f'marketplace-facets:{version}:{hashlib.sha1(normalized.encode()).hexdigest()}'
+
+
+def cached_facet_counts(queryset, filters):
+    """count_facets through the cache"""
+    key = _cache_key(filters)
+    counts = cache.get(key)
+    if counts is None:
+        counts = count_facets(queryset, filters)
+        cache.set(key, counts, FACET_CACHE_TIMEOUT)
+    return counts
+
+
+def invalidate_facets():
+    cache.set(FACET_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def marketplace_facets(queryset, filters):
+    """Template data for the filter form: bucket labels, bounds, counts and selection"""
+    counts = cached_facet_counts(queryset, filters)
+    bounds = filter_bounds(filters)
+
+    facets = {}
+    for group, buckets in FACET_BUCKETS.items():
+        facets[group] = [{
+            'value': key,
+            'label': label,
+            'min': low if low is not None else '',
+            'max': high if high is not None else '',
+            'count': counts[group][key],
+            'selected': (low, high) == bounds[group] and bounds[group] != (None, None),
+        } for key, label, low, high in buckets]
+    return facets
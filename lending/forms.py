@@ -1,5 +1,5 @@
 from django import forms
-from .models import Loan
+from .models import AutoInvestRule, Loan
 from decimal import Decimal
 
 class LoanRequestForm(forms.Form):
@@ -189,4 +189,50 @@ class LoanRepaymentForm(forms.Form):
         amount = self.cleaned_data.get('amount')
         if amount <= Decimal('0'):
             raise forms.ValidationError('Payment amount must be greater than zero')
-        return amount
\ No newline at end of file
+        return amount
+
+class AutoInvestRuleForm(forms.ModelForm):
+    """Form for creating an auto-invest rule"""
+    class Meta:
+        model = AutoInvestRule
+        fields = ['name', 'risk_band', 'purpose', 'min_interest_rate', 'max_term_months',
+                  'amount_per_loan', 'max_exposure']
+        labels = {
+            'risk_band': 'Risk band',
+            'min_interest_rate': 'Minimum interest rate (%)',
+            'max_term_months': 'Maximum term (months)',
+            'amount_per_loan': 'Amount per loan',
+            'max_exposure': 'Maximum total exposure',
+        }
+        widgets = {
+            'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Rule name'}),
+            'risk_band': forms.Select(attrs={'class': 'form-control'}),
+            'purpose': forms.Select(attrs={'class': 'form-control'}),
+            'min_interest_rate': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'step': '0.25'}),
+            'max_term_months': forms.NumberInput(attrs={
+                'class': 'form-control', 'placeholder': 'Any term', 'min': '1', 'max': '60'
+            }),
+            'amount_per_loan': forms.NumberInput(attrs={'class': 'form-control', 'min': '10.00', 'step': '5.00'}),
+            'max_exposure': forms.NumberInput(attrs={'class': 'form-control', 'min': '10.00', 'step': '50.00'}),
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['risk_band'].choices = [('', 'Any risk')] + list(AutoInvestRule.RISK_BAND_CHOICES)
+        self.fields['purpose'].choices = [('', 'Any purpose')] + list(Loan.LOAN_PURPOSE_CHOICES)
+    
+    def clean_amount_per_loan(self):
+        amount = self.cleaned_data.get('amount_per_loan')
+        if amount < Decimal('10.00'):
+            raise forms.ValidationError('Minimum investment amount is R10.00')
+        return amount
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        amount = cleaned_data.get('amount_per_loan')
+        max_exposure = cleaned_data.get('max_exposure')
+        
+        if amount and max_exposure is not None and max_exposure < amount:
+            self.add_error('max_exposure', 'Maximum exposure must be at least the amount per loan.')
+        
+        return cleaned_data
@@ -0,0 +1,175 @@
+"""
+Live funding updates over server-sent events.
+
+One in-process publisher fans each loan update out to every stream watching
+that loan or the whole marketplace. Publishing never touches the database:
+invest_in_loan and the admin status actions hand over the loan they just
+changed, so a thousand watchers cost one update rather than a thousand
+polling queries. Each subscription keeps only the latest update per loan,
+so a slow client never makes the publisher buffer without bound.
+
+Streams only see changes made in their own process: serve the site with an
+ASGI server (e.g. ``uvicorn p2p_platform.asgi:application``) so that the
+investments and the streams run in the same worker. A WSGI server would hold
+a worker for the whole stream and send nothing, so the pages only open
+streams when the LIVE_UPDATES setting is on, and the stream views answer 204
+(which tells EventSource not to reconnect) when it is off.
+"""
+
+import asyncio
+import json
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+
+MARKETPLACE_TOPIC = 'marketplace'
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_SECONDS = 15
+
+# Streams end after this long and the browser reconnects after RETRY_MS
+STREAM_SECONDS = 300
+RETRY_MS = 3000
+
+
+def enabled():
+    """Whether the site is served over ASGI with live updates turned on"""
+    return getattr(settings, 'LIVE_UPDATES', False)
+
+
+def disabled_response():
+    return HttpResponse(status=204)
+
+
+def loan_topic(loan_id):
+    return f'loan:{loan_id}'
+
+
+class Subscription:
+    """One stream's view of a topic; updates are coalesced per loan"""
+
+    def __init__(self, topic, loop):
+        self.topic = topic
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def deliver(self, loan_id, event):
+        # Runs in the subscription's event loop
+        self.pending[loan_id] = event
+        self.ready.set()
+
+    async def events(self):
+        """Wait for and return the events received since the last call"""
+        await self.ready.wait()
+        self.ready.clear()
+        events, self.pending = list(self.pending.values()), {}
+        return events
+
+
+def _deliver_all(subscriptions, loan_id, event):
+    for subscription in subscriptions:
+        subscription.deliver(loan_id, event)
+
+
+class Publisher:
+    def __init__(self):
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        """Subscribe the running event loop to a topic"""
+        subscription = Subscription(topic, asyncio.get_running_loop())
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._topics.get(subscription.topic)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._topics[subscription.topic]
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._topics.get(topic, ()))
+            return sum(len(subscriptions) for subscriptions in self._topics.values())
+
+    def publish(self, update):
+        """Hand an update to the watchers of its loan and of the marketplace; safe from any thread"""
+        with self._lock:
+            subscriptions = [
+                *self._topics.get(loan_topic(update['loan_id']), ()),
+                *self._topics.get(MARKETPLACE_TOPIC, ()),
+            ]
+
+        # Serialized once, and one callback per event loop rather than per subscriber
+        event = format_event(update)
+        by_loop = {}
+        for subscription in subscriptions:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+
+        for loop, loop_subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver_all, loop_subscriptions, update['loan_id'], event)
+            except RuntimeError:
+                # The loop has been closed; its streams are gone
+                for subscription in loop_subscriptions:
+                    self.unsubscribe(subscription)
+
+
+publisher = Publisher()
+
+
+def funding_update(loan):
+    """Event payload for a loan's funding state"""
+    return {
+        'loan_id': loan.pk,
+        'status': loan.status,
+        'status_display': loan.get_status_display(),
+        'amount': str(loan.amount),
+        'funded_amount': str(loan.funded_amount),
+        'funding_percentage': round(float(loan.funding_percentage), 2),
+        'investor_count': loan.investor_count,
+    }
+
+
+def publish_funding(loan):
+    """Push the loan's current funding state to its watchers once the transaction commits"""
+    update = funding_update(loan)
+    transaction.on_commit(lambda: publisher.publish(update))
+
+
+def format_event(update):
+    return f'event: funding\ndata: {json.dumps(update)}\n\n'
+
+
+async def event_stream(subscription, initial=()):
+    """Server-sent events for a subscription, starting with the `initial` updates"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_SECONDS
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for update in initial:
+            yield format_event(update)
+
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                events = await asyncio.wait_for(subscription.events(), min(HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield ''.join(events)
+    finally:
+        publisher.unsubscribe(subscription)
+
+
+def stream_response(subscription, initial=()):
+    response = StreamingHttpResponse(event_stream(subscription, initial), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum, Count
+from django.db import transaction
+from lending.models import Loan, Investment
+from decimal import Decimal
+
+class Command(BaseCommand):
+    help = 'Recalculate the stored funded amount and investor count of every loan from its investments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report loans whose stored totals are out of sync without updating them',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run', False)
+
+        # One grouped query for the true totals of every invested loan
+        totals = {
+            row['loan_id']: (row['total'] or Decimal('0.00'), row['investors'])
+            for row in Investment.objects.values('loan_id').annotate(
+                total=Sum('amount'),
+                investors=Count('investor', distinct=True)
+            )
+        }
+
+        stale_loans = []
+        for loan in Loan.objects.only('id', 'funded_amount', 'investor_count').iterator():
+            funded_amount, investor_count = totals.get(loan.id, (Decimal('0.00'), 0))
+            if loan.funded_amount != funded_amount or loan.investor_count != investor_count:
+                loan.funded_amount = funded_amount
+                loan.investor_count = investor_count
+                stale_loans.append(loan)
+
+        self.stdout.write(f'Found {len(stale_loans)} loans with out-of-date funding totals')
+
+        if dry_run or not stale_loans:
+            return
+
+        with transaction.atomic():
+            Loan.objects.bulk_update(stale_loans, ['funded_amount', 'investor_count'], batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated funding totals for {len(stale_loans)} loans'))
@@ -0,0 +1,112 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from lending.models import Loan
+from lending import amortization
+
+class Command(BaseCommand):
+    help = 'Benchmark the vectorized amortization engine against the per-loan Decimal path'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000],
+            help='Numbers of loans to amortize',
+        )
+        parser.add_argument(
+            '--verify-sample',
+            type=int,
+            default=10000,
+            help='Number of loans whose schedules are checked cent-for-cent against the Decimal path',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the generated loans',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        for size in options['sizes']:
+            loans = [self.make_loan(rng) for _ in range(size)]
+            self.stdout.write(f'\n{size} loans')
+
+            # Per-loan Decimal path (unsaved Loan instances, no database access)
+            start = time.perf_counter()
+            decimal_payments = []
+            for loan in loans:
+                loan.monthly_payment = loan.calculate_monthly_payment().quantize(amortization.CENT)
+                decimal_payments.append(loan.monthly_payment)
+            decimal_payment_time = time.perf_counter() - start
+
+            # Schedules are discarded as they are built to keep memory flat at 100k loans
+            start = time.perf_counter()
+            for loan in loans:
+                loan.build_repayment_schedule()
+            decimal_schedule_time = time.perf_counter() - start
+
+            # Vectorized path
+            start = time.perf_counter()
+            principal_cents = amortization.to_cents(loan.amount for loan in loans)
+            rates = [float(loan.interest_rate) for loan in loans]
+            terms = [loan.term_months for loan in loans]
+            conversion_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            payments = amortization.monthly_payments(principal_cents, rates, terms)
+            vector_payment_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            table = amortization.amortize(principal_cents, rates, terms, payments=payments)
+            vector_schedule_time = time.perf_counter() - start
+
+            sample = rng.sample(range(size), min(options['verify_sample'], size))
+            mismatches = self.count_mismatches(loans, decimal_payments, table, sample)
+
+            self.stdout.write(f'  input conversion:      {conversion_time:8.3f}s')
+            self.stdout.write(
+                f'  monthly payments:      decimal {decimal_payment_time:8.3f}s  '
+                f'vectorized {vector_payment_time:8.3f}s  '
+                f'({decimal_payment_time / max(vector_payment_time, 1e-9):.0f}x)'
+            )
+            self.stdout.write(
+                f'  full schedules:        decimal {decimal_schedule_time:8.3f}s  '
+                f'vectorized {vector_schedule_time:8.3f}s  '
+                f'({decimal_schedule_time / max(vector_schedule_time, 1e-9):.0f}x)'
+            )
+
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'  {mismatches} values differ from the Decimal path'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'  all payments and the installments of {len(sample)} sampled loans match to the cent'
+                ))
+
+    def make_loan(self, rng):
+        return Loan(
+            amount=Decimal(rng.randint(10000, 5000000)) / 100,
+            interest_rate=Decimal(rng.randint(500, 1400)) / 100,
+            term_months=rng.randint(1, 60),
+            status='funded',
+            start_date=datetime.date(2025, 1, 1),
+        )
+
+    def count_mismatches(self, loans, decimal_payments, table, sample):
+        mismatches = 0
+        for row, payment in enumerate(decimal_payments):
+            if amortization.cents_to_decimal(table.payments[row]) != payment:
+                mismatches += 1
+
+        for row in sample:
+            for month, installment in enumerate(loans[row].build_repayment_schedule()):
+                if amortization.cents_to_decimal(table.principal[row, month]) != installment.principal:
+                    mismatches += 1
+                if amortization.cents_to_decimal(table.interest[row, month]) != installment.interest:
+                    mismatches += 1
+        return mismatches
@@ -0,0 +1,109 @@
+import resource
+import time
+import uuid
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from accounts.models import Transaction, UserProfile, Wallet
+from accounts.views import export_transactions
+
+def current_rss():
+    """Resident set size of this process in MB, or the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Stream a wallet export of generated transactions and sample memory use as it goes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='Number of transactions to generate and export',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            default='csv',
+            help='Export format',
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=10,
+            help='Number of memory samples taken during the export',
+        )
+
+    def handle(self, *args, **options):
+        # The query log kept with DEBUG on would grow with the export
+        with override_settings(DEBUG=False):
+            # Everything is generated inside a transaction that is rolled back at the end
+            try:
+                with transaction.atomic():
+                    self.benchmark(options['rows'], options['format'], options['samples'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def benchmark(self, row_count, fmt, samples):
+        user = self.wallet_with_history(row_count)
+        request = RequestFactory().get(f'/accounts/wallet/export/{fmt}/')
+        request.user = user
+
+        baseline = current_rss()
+        self.stdout.write(f'{"rows":>9} {"RSS":>9} {"growth":>8} {"elapsed":>8}')
+        self.stdout.write(f'{0:>9} {baseline:>7.1f}MB {0:>6.1f}MB {0:>7.1f}s')
+
+        every = max(row_count // samples, 1)
+        rows = size = peak = 0
+        start = time.perf_counter()
+        response = export_transactions(request, fmt)
+        for line in response.streaming_content:
+            size += len(line)
+            rows += 1
+            if rows % every == 0:
+                rss = current_rss()
+                peak = max(peak, rss)
+                self.stdout.write(f'{rows:>9} {rss:>7.1f}MB {rss - baseline:>6.1f}MB '
+                                  f'{time.perf_counter() - start:>7.1f}s')
+
+        # CSV has a header line
+        exported = rows - 1 if fmt == 'csv' else rows
+        style = self.style.SUCCESS if exported == row_count else self.style.ERROR
+        self.stdout.write(style(
+            f'Exported {exported} rows ({size / 2 ** 20:.1f}MB) with at most '
+            f'{max(peak - baseline, 0):.1f}MB of memory growth'
+        ))
+
+    def wallet_with_history(self, row_count):
+        run = uuid.uuid4().hex[:8]
+        user = User.objects.create(username=f'export-benchmark-{run}')
+        UserProfile.objects.create(user=user, user_type='investor')
+        wallet = Wallet.objects.get_or_create(user=user)[0]
+
+        self.stdout.write(f'Generating {row_count} transactions...')
+        balance = Decimal('0.00')
+        batch = []
+        for index in range(row_count):
+            deposit = index % 3 != 2
+            amount = Decimal('10.00') if deposit else Decimal('5.00')
+            balance += amount if deposit else -amount
+            batch.append(Transaction(
+                wallet=wallet, transaction_type='deposit' if deposit else 'withdrawal', amount=amount,
+                description=f'Benchmark transaction {index}',
+                balance_after=balance,
+            ))
+            if len(batch) == 10000:
+                Transaction.objects.bulk_create(batch)
+                batch = []
+        Transaction.objects.bulk_create(batch)
+        return user
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+from lending import live
+from lending.models import Loan
+
+class Command(BaseCommand):
+    help = 'Open concurrent funding streams through the ASGI handler and time the fan-out of updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscribers',
+            type=int,
+            default=1000,
+            help='Number of concurrent stream connections',
+        )
+        parser.add_argument(
+            '--updates',
+            type=int,
+            default=20,
+            help='Number of funding updates published',
+        )
+        parser.add_argument(
+            '--loan',
+            type=int,
+            help='Loan to watch (defaults to the oldest pending loan)',
+        )
+
+    def handle(self, *args, **options):
+        loan = Loan.objects.filter(pk=options['loan']) if options['loan'] else Loan.objects.filter(status='pending')
+        loan = loan.order_by('pk').first()
+        if loan is None:
+            raise CommandError('No loan to watch.')
+
+        # The streams are served by the ASGI handler here, whatever the site runs on
+        with override_settings(LIVE_UPDATES=True):
+            asyncio.run(self.run(loan, options['subscribers'], options['updates']))
+
+    async def run(self, loan, subscriber_count, update_count):
+        application = ASGIHandler()
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.') or 'localhost'
+        loan_path = reverse('lending:loan_funding_stream', args=[loan.pk])
+        marketplace_path = reverse('lending:marketplace_stream')
+
+        # Arrival time of each update sequence number, per subscriber
+        arrivals = [{} for _ in range(subscriber_count)]
+        streaming = set()
+        disconnect = asyncio.Event()
+
+        async def subscriber(index):
+            path = loan_path if index % 2 == 0 else marketplace_path
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'root_path': '',
+                'query_string': b'',
+                'headers': [(b'host', host.encode()), (b'accept', b'text/event-stream')],
+                'client': ('127.0.0.1', 40000 + index),
+                'server': (host, 80),
+            }
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] != 'http.response.body':
+                    return
+                received = time.perf_counter()
+                streaming.add(index)
+                for block in message.get('body', b'').decode().split('\n\n'):
+                    if block.startswith('event: funding'):
+                        update = json.loads(block.split('data: ', 1)[1])
+                        if 'sequence' in update:
+                            arrivals[index][update['sequence']] = received
+
+            await application(scope, receive, send)
+
+        self.stdout.write(f'Opening {subscriber_count} streams on loan {loan.pk} and the marketplace...')
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber(index)) for index in range(subscriber_count)]
+        # Wait until every response has started streaming
+        while len(streaming) < subscriber_count:
+            await asyncio.sleep(0.05)
+        self.stdout.write(f'{subscriber_count} subscribers connected in {time.perf_counter() - start:.2f}s')
+
+        # Publish from another thread, as invest_in_loan does from a request worker
+        published = {}
+        update = live.funding_update(loan)
+
+        def publish_updates():
+            for sequence in range(update_count):
+                published[sequence] = time.perf_counter()
+                live.publisher.publish(dict(update, sequence=sequence))
+                time.sleep(0.05)
+
+        publisher_thread = threading.Thread(target=publish_updates)
+        publisher_thread.start()
+        while publisher_thread.is_alive():
+            await asyncio.sleep(0.05)
+
+        # Subscriptions coalesce updates per loan, so a busy stream may skip
+        # intermediate ones, but every subscriber must end on the final state
+        final = update_count - 1
+        deadline = time.perf_counter() + 10
+        while time.perf_counter() < deadline:
+            up_to_date = sum(1 for times in arrivals if final in times)
+            if up_to_date == subscriber_count:
+                break
+            await asyncio.sleep(0.05)
+
+        latencies = []
+        delivered = 0
+        for sequence, sent in published.items():
+            received = [times[sequence] for times in arrivals if sequence in times]
+            delivered += len(received)
+            if received:
+                latencies.append((max(received) - sent) * 1000)
+
+        self.stdout.write(
+            f'{delivered}/{update_count * subscriber_count} updates delivered '
+            f'({update_count * subscriber_count - delivered} coalesced), '
+            f'{up_to_date}/{subscriber_count} subscribers received the final state'
+        )
+        if latencies:
+            self.stdout.write(
+                f'Time for an update to reach every subscriber: '
+                f'p50 {statistics.median(latencies):.1f}ms, max {max(latencies):.1f}ms'
+            )
+
+        disconnect.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        remaining = live.publisher.subscriber_count()
+        style = self.style.SUCCESS if up_to_date == subscriber_count and remaining == 0 else self.style.ERROR
+        self.stdout.write(style(f'{remaining} subscriptions left open after disconnect'))
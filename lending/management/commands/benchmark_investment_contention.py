@@ -0,0 +1,195 @@
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.db.models import Count, Min, Sum
+from accounts.models import InvestorProfile, Transaction, UserProfile, Wallet
+from lending.models import Investment, Loan, LoanPayment, create_loan_request, invest_in_loan
+
+def invest_concurrently(investor_ids, loan_id, attempts, stake, seed, start_at):
+    """Run one thread per investor, each trying `attempts` investments; returns outcome counts"""
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def investor_thread(investor_id):
+        rng = random.Random(seed + investor_id)
+        investor = User.objects.select_related('wallet', 'profile__investor_profile').get(pk=investor_id)
+        loan = Loan.objects.get(pk=loan_id)
+        time.sleep(max(0, start_at - time.time()))
+        try:
+            for _ in range(attempts):
+                # Uneven amounts so the last investments find less room than they ask for
+                amount = (stake * Decimal(rng.uniform(0.5, 1))).quantize(Decimal('0.01'))
+                # Near the end, ask for what was left when this investor last looked
+                remaining = loan.amount - loan.funded_amount
+                if 0 < remaining < amount:
+                    amount = remaining
+                try:
+                    result = invest_in_loan(investor, loan, amount)
+                    outcome = 'invested' if result['success'] else result['message'].split(' $')[0]
+                except OperationalError as error:
+                    outcome = f'error: {error}'
+                with lock:
+                    outcomes[outcome] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=investor_thread, args=(investor_id,)) for investor_id in investor_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+def _process_worker(args):
+    return invest_concurrently(*args)
+
+class Command(BaseCommand):
+    help = 'Hammer one loan with concurrent investors and check it is never oversubscribed or overdrawn'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--investors',
+            type=int,
+            default=200,
+            help='Number of concurrent investors (one thread each)',
+        )
+        parser.add_argument(
+            '--attempts',
+            type=int,
+            default=5,
+            help='Investments attempted by each investor',
+        )
+        parser.add_argument(
+            '--stake',
+            type=Decimal,
+            default=Decimal('500'),
+            help='Largest single investment; each investor can afford three',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Spread the investor threads over this many processes',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the generated loan and users instead of deleting them',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the investment amounts',
+        )
+
+    def handle(self, *args, **options):
+        investor_count = options['investors']
+        stake = options['stake']
+        balance = stake * 3
+        # Demand exceeds the loan so it fills up while investors are still arriving
+        loan_amount = stake * investor_count
+
+        self.stdout.write(f'Creating a R{loan_amount} loan and {investor_count} investors with R{balance} each...')
+        run = uuid.uuid4().hex[:8]
+        borrower = User.objects.create(username=f'contention-borrower-{run}')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        loan = create_loan_request(borrower, f'Contention benchmark {run}', 'Benchmark loan', loan_amount, 12)
+
+        investor_ids = []
+        for index in range(investor_count):
+            investor = User.objects.create(username=f'contention-investor-{run}-{index}')
+            UserProfile.objects.create(user=investor, user_type='investor')
+            investor_ids.append(investor.pk)
+        Wallet.objects.filter(user_id__in=investor_ids).update(balance=balance)
+
+        try:
+            self.run(loan, investor_ids, options, balance)
+        finally:
+            if not options['keep']:
+                User.objects.filter(pk__in=[borrower.pk, *investor_ids]).delete()
+
+    def run(self, loan, investor_ids, options, balance):
+        processes = max(1, options['processes'])
+        start_at = time.time() + 1 + 0.01 * len(investor_ids)
+        slices = [
+            (investor_ids[index::processes], loan.pk, options['attempts'], options['stake'], options['seed'], start_at)
+            for index in range(processes)
+        ]
+
+        if processes == 1:
+            outcomes = invest_concurrently(*slices[0])
+        else:
+            # Forked workers must not share this process's database connection
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                outcomes = sum(pool.map(_process_worker, slices), Counter())
+        elapsed = time.time() - start_at
+
+        attempts = sum(outcomes.values())
+        self.stdout.write(
+            f'{attempts} attempts by {len(investor_ids)} investors over {processes} process(es) '
+            f'in {elapsed:.2f}s: {attempts / elapsed:,.0f} attempts/s, '
+            f'{outcomes["invested"] / elapsed:,.0f} investments/s'
+        )
+        for outcome, count in outcomes.most_common():
+            self.stdout.write(f'  {count:>6}  {outcome}')
+
+        problems = self.check_consistency(loan, investor_ids, balance)
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(problem))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Consistent: loan not oversubscribed, no negative balances, ledgers match investments'))
+
+    def check_consistency(self, loan, investor_ids, balance):
+        problems = []
+        loan.refresh_from_db()
+        investments = Investment.objects.filter(loan=loan).aggregate(
+            total=Sum('amount'), count=Count('pk'), investors=Count('investor', distinct=True))
+        # SQLite sums decimals as floats
+        invested = (investments['total'] or Decimal('0')).quantize(Decimal('0.01'))
+
+        if loan.funded_amount > loan.amount:
+            problems.append(f'Loan oversubscribed: R{loan.funded_amount} funded of R{loan.amount}')
+        if loan.funded_amount != invested:
+            problems.append(f'Loan funded amount R{loan.funded_amount} differs from its investments R{invested}')
+        if loan.investor_count != investments['investors']:
+            problems.append(f'Loan investor count {loan.investor_count} differs from {investments["investors"]} investors')
+        if (loan.funded_amount == loan.amount) != (loan.status == 'funded'):
+            problems.append(f'Loan status {loan.status} with R{loan.funded_amount} funded of R{loan.amount}')
+        if loan.status == 'funded' and LoanPayment.objects.filter(loan=loan).count() != loan.term_months:
+            problems.append('Funded loan does not have one payment per month of its term')
+
+        lowest = Wallet.objects.filter(user_id__in=investor_ids).aggregate(lowest=Min('balance'))['lowest']
+        if lowest < 0:
+            problems.append(f'Negative wallet balance: R{lowest}')
+
+        per_investor = {
+            investor_id: total.quantize(Decimal('0.01')) for investor_id, total in
+            Investment.objects.filter(loan=loan).values_list('investor').annotate(total=Sum('amount'))}
+        wallets = Wallet.objects.filter(user_id__in=investor_ids)
+        profiles = dict(InvestorProfile.objects.filter(
+            user_profile__user_id__in=investor_ids).values_list('user_profile__user_id', 'total_invested'))
+        latest = {}
+        for wallet_id, balance_after in (Transaction.objects.filter(wallet__in=wallets)
+                                         .order_by('wallet_id', 'pk').values_list('wallet_id', 'balance_after')):
+            latest[wallet_id] = balance_after
+
+        for wallet in wallets:
+            spent = per_investor.get(wallet.user_id, Decimal('0'))
+            if wallet.balance != balance - spent:
+                problems.append(f'Wallet {wallet.pk}: balance R{wallet.balance} after investing R{spent} of R{balance}')
+            if profiles.get(wallet.user_id) != spent:
+                problems.append(f'Investor {wallet.user_id}: total invested R{profiles.get(wallet.user_id)}, expected R{spent}')
+            if latest.get(wallet.pk, balance) != wallet.balance:
+                problems.append(f'Wallet {wallet.pk}: last transaction says R{latest[wallet.pk]}, balance is R{wallet.balance}')
+        return problems[:20]
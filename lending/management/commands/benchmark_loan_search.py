@@ -0,0 +1,111 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from lending.models import Loan
+from lending.search import search_loans
+
+WORDS = (
+    'business expansion equipment inventory tuition university college books laptop car repair engine '
+    'tyres medical surgery dental hospital wedding venue catering honeymoon holiday travel flights '
+    'kitchen roof plumbing solar panels renovation debt consolidation credit card store account '
+    'family children school uniform stock supplier farm seeds tractor salon shop bakery taxi '
+    'delivery van computer software training course certificate rent deposit furniture appliances'
+).split()
+
+QUERIES = ('solar', 'tuition university', 'bak', 'consolidation', 'engine repair taxi', 'zzzz')
+
+class Command(BaseCommand):
+    help = 'Compare marketplace search latency of the full-text index with the old LIKE scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loans',
+            type=int,
+            default=100000,
+            help='Number of pending loans to generate',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per query',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the generated loan text',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # Everything is generated inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.generate_loans(rng, options['loans'])
+            pending_loans = Loan.objects.filter(status='pending')
+
+            self.stdout.write(f'{pending_loans.count()} pending loans\n')
+            self.stdout.write(f'{"query":<22} {"matches":>8} {"LIKE page":>11} {"FTS page":>10} '
+                              f'{"LIKE count":>11} {"FTS count":>10}')
+
+            for query in QUERIES:
+                like_qs = self.like_search(pending_loans, query).order_by('-created_at')
+                fts_qs = search_loans(pending_loans, query)
+
+                like_page = self.time_query(lambda: list(like_qs[:50]), options['repeat'])
+                fts_page = self.time_query(lambda: list(fts_qs[:50]), options['repeat'])
+                like_count = self.time_query(like_qs.count, options['repeat'])
+                fts_count = self.time_query(fts_qs.count, options['repeat'])
+
+                self.stdout.write(
+                    f'{query:<22} {fts_qs.count():>8} {like_page:>9.1f}ms {fts_page:>8.1f}ms '
+                    f'{like_count:>9.1f}ms {fts_count:>8.1f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+    def generate_loans(self, rng, count):
+        borrower = User.objects.create_user(username=f'search-benchmark-{rng.random()}')
+        loans = []
+        for _ in range(count):
+            title_words = rng.sample(WORDS, 3)
+            loans.append(Loan(
+                borrower=borrower,
+                title=' '.join(title_words).capitalize(),
+                description=' '.join(rng.choice(WORDS) for _ in range(60)),
+                purpose_description=' '.join(rng.choice(WORDS) for _ in range(10)),
+                purpose=rng.choice(Loan.LOAN_PURPOSE_CHOICES)[0],
+                amount=Decimal('1000.00'),
+                interest_rate=Decimal('10.00'),
+                term_months=12,
+                monthly_payment=Decimal('87.92'),
+                total_repayment=Decimal('1055.04'),
+                risk_score=rng.randint(1, 10),
+            ))
+
+        start = time.perf_counter()
+        Loan.objects.bulk_create(loans, batch_size=2000)
+        self.stdout.write(f'Inserted {count} loans (index maintained by triggers) '
+                          f'in {time.perf_counter() - start:.1f}s')
+
+    def like_search(self, queryset, query):
+        """The marketplace filter before the full-text index"""
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(purpose__icontains=query)
+        )
+
+    def time_query(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
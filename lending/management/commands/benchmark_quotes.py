@@ -0,0 +1,83 @@
+import json
+import random
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from lending import pricing
+from lending.views import loan_quote
+
+class Command(BaseCommand):
+    help = 'Measure latency percentiles of the loan quote endpoint for batches of quotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-sizes',
+            type=int,
+            nargs='+',
+            default=[1, 100, 1000, 5000],
+            help='Number of quotes per request',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of requests timed per batch size',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the generated quote requests',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        factory = RequestFactory()
+
+        for batch_size in options['batch_sizes']:
+            # Fewer repetitions for the largest batches so a run stays short
+            request_count = max(10, min(options['requests'], 200000 // batch_size))
+
+            bodies = [
+                json.dumps({'quotes': [self.make_quote(rng) for _ in range(batch_size)]})
+                for _ in range(request_count)
+            ]
+
+            pricing.base_interest_rate.cache_clear()
+            pricing.amortization_factor.cache_clear()
+
+            latencies = []
+            for body in bodies:
+                request = factory.post('/lending/quote/', data=body, content_type='application/json')
+                request.user = AnonymousUser()
+
+                start = time.perf_counter()
+                response = loan_quote(request)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+                if response.status_code != 200:
+                    self.stdout.write(self.style.ERROR(f'Request failed: {response.content[:200]}'))
+                    return
+
+            cache_info = pricing.amortization_factor.cache_info()
+            self.stdout.write(
+                f'batch {batch_size:>5}: {request_count:>4} requests  '
+                f'p50 {self.percentile(latencies, 50):8.2f}ms  '
+                f'p99 {self.percentile(latencies, 99):8.2f}ms  '
+                f'max {max(latencies):8.2f}ms  '
+                f'({batch_size * request_count / (sum(latencies) / 1000):,.0f} quotes/s, '
+                f'factor cache {cache_info.hits} hits / {cache_info.misses} misses)'
+            )
+
+    def make_quote(self, rng):
+        return {
+            'amount': str(rng.randrange(100, 50000, 50)),
+            'term_months': rng.randint(1, 60),
+            'credit_score': rng.randint(500, 850),
+        }
+
+    def percentile(self, values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
@@ -0,0 +1,101 @@
+import time
+import uuid
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from accounts.models import InvestorProfile, UserProfile, Wallet
+from lending.models import Investment, LoanPayment, create_loan_request, distribute_repayment
+
+def legacy_distribute(loan, payment, distributable_amount):
+    """The per-investment loop process_loan_repayment used before, kept for comparison"""
+    for investment in loan.investments.all():
+        investor = investment.investor
+        investor_percentage = investment.investment_percentage / 100
+        investor_share = distributable_amount * investor_percentage
+
+        investor_wallet = investor.wallet
+        investor_wallet.deposit_funds(investor_share)
+
+        investor_profile = investor.profile.investor_profile
+        interest_share = payment.interest * investor_percentage
+        investor_profile.total_earnings += interest_share
+        investor_profile.save()
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Compare the per-investor repayment distribution loop with the bulk distribution'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--investors',
+            type=int,
+            nargs='+',
+            default=[10, 100, 500],
+            help='Number of investors in the repaid loan',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"investors":>9} {"loop queries":>13} {"loop time":>10} '
+                          f'{"bulk queries":>13} {"bulk time":>10}  credited')
+        for investor_count in options['investors']:
+            # Everything is generated inside a transaction that is rolled back at the end
+            try:
+                with transaction.atomic():
+                    self.compare(investor_count)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def compare(self, investor_count):
+        loan, payments = self.funded_loan(investor_count)
+        distributable = payments[0].amount_due - payments[0].interest * Decimal('0.02')
+        wallets = Wallet.objects.filter(user__investments__loan=loan).distinct()
+
+        timings = []
+        for distribute, payment in ((legacy_distribute, payments[0]), (distribute_repayment, payments[1])):
+            before = wallets.aggregate(total=Sum('balance'))['total']
+            loan.refresh_from_db()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                distribute(loan, payment, distributable)
+                elapsed = (time.perf_counter() - start) * 1000
+            credited = (wallets.aggregate(total=Sum('balance'))['total'] - before).quantize(Decimal('0.01'))
+            timings.append((len(queries), elapsed, credited))
+
+        (loop_queries, loop_time, loop_credited), (bulk_queries, bulk_time, bulk_credited) = timings
+        style = self.style.SUCCESS if abs(loop_credited - bulk_credited) <= Decimal('0.01') * investor_count else self.style.ERROR
+        self.stdout.write(style(
+            f'{investor_count:>9} {loop_queries:>13} {loop_time:>8.1f}ms '
+            f'{bulk_queries:>13} {bulk_time:>8.1f}ms  R{loop_credited} / R{bulk_credited} of R{distributable.quantize(Decimal("0.01"))}'
+        ))
+
+    def funded_loan(self, investor_count):
+        run = uuid.uuid4().hex[:8]
+        borrower = User.objects.create(username=f'distribution-borrower-{run}')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        loan = create_loan_request(borrower, f'Distribution benchmark {run}', 'Benchmark loan',
+                                   Decimal('100') * investor_count, 12)
+
+        # Investors are bulk created, so their wallets and profiles are made here rather than by signals
+        investors = User.objects.bulk_create([
+            User(username=f'distribution-investor-{run}-{index}') for index in range(investor_count)
+        ])
+        profiles = UserProfile.objects.bulk_create([
+            UserProfile(user=investor, user_type='investor') for investor in investors
+        ])
+        InvestorProfile.objects.bulk_create([InvestorProfile(user_profile=profile) for profile in profiles])
+        Wallet.objects.bulk_create([Wallet(user=investor) for investor in investors])
+        Investment.objects.bulk_create([
+            Investment(investor=investor, loan=loan, amount=Decimal('100')) for investor in investors
+        ])
+
+        loan.funded_amount = loan.amount
+        loan.investor_count = investor_count
+        loan.save(update_fields=['funded_amount', 'investor_count'])
+        loan.close_funding()
+        return loan, list(LoanPayment.objects.filter(loan=loan).order_by('payment_number')[:2])
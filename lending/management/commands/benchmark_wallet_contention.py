@@ -0,0 +1,127 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from accounts.models import Transaction, UserProfile, Wallet
+from lending.models import retry_on_conflict
+
+def legacy_payout(wallet, amount):
+    """The read-add-save deposit_funds used before, on the caller's possibly stale instance"""
+    wallet.balance += amount
+    wallet.save()
+    Transaction.objects.create(wallet=wallet, transaction_type='deposit', amount=amount,
+                               description='Benchmark payout', balance_after=wallet.balance)
+
+def locked_payout(wallet, amount):
+    """Serialize on the wallet row: lock it, then read, add and save"""
+    with transaction.atomic():
+        wallet = Wallet.objects.select_for_update().get(pk=wallet.pk)
+        wallet.balance += amount
+        wallet.save(update_fields=['balance'])
+        Transaction.objects.create(wallet=wallet, transaction_type='deposit', amount=amount,
+                                   description='Benchmark payout', balance_after=wallet.balance)
+
+def atomic_payout(wallet, amount):
+    """The F() expression update of Wallet.deposit_funds"""
+    wallet.deposit_funds(amount, description='Benchmark payout')
+
+PAYOUTS = {
+    'legacy': legacy_payout,
+    'locked': locked_payout,
+    'atomic': atomic_payout,
+}
+
+class Command(BaseCommand):
+    help = 'Credit one wallet from many concurrent threads and check no payout is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=20,
+            help='Number of concurrent payers (one thread each)',
+        )
+        parser.add_argument(
+            '--payouts',
+            type=int,
+            default=100,
+            help='Payouts made by each thread',
+        )
+        parser.add_argument(
+            '--amount',
+            type=Decimal,
+            default=Decimal('1.25'),
+            help='Amount of every payout',
+        )
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            choices=list(PAYOUTS),
+            default=list(PAYOUTS),
+            help='Payout implementations to compare',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{options["threads"]} threads x {options["payouts"]} payouts of R{options["amount"]} into one wallet')
+        self.stdout.write(f'{"mode":>8} {"payouts/s":>10} {"errors":>7} {"expected":>10} {"balance":>10} {"lost":>6}  ledger')
+        for mode in options['modes']:
+            user = User.objects.create(username=f'wallet-contention-{uuid.uuid4().hex[:8]}')
+            UserProfile.objects.create(user=user, user_type='investor')
+            try:
+                self.run(mode, user.wallet, options)
+            finally:
+                user.delete()
+
+    def run(self, mode, wallet, options):
+        payout = PAYOUTS[mode]
+        amount = options['amount']
+        outcomes = Counter()
+        lock = threading.Lock()
+        start_at = time.time() + 0.5
+
+        def payer():
+            # Each payer works with its own instance, loaded once, as a request handler would
+            instance = Wallet.objects.get(pk=wallet.pk)
+            time.sleep(max(0, start_at - time.time()))
+            try:
+                for _ in range(options['payouts']):
+                    try:
+                        retry_on_conflict(payout, instance, amount)
+                        outcome = 'paid'
+                    except OperationalError:
+                        outcome = 'error'
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=payer) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start_at
+
+        wallet.refresh_from_db()
+        expected = amount * outcomes['paid']
+        ledger = list(Transaction.objects.filter(wallet=wallet).order_by('pk').values_list('amount', 'balance_after'))
+        # Every entry's balance_after must be the previous one plus its amount
+        running = Decimal('0.00')
+        broken = 0
+        for entry_amount, balance_after in ledger:
+            running += entry_amount
+            if balance_after != running:
+                broken += 1
+                running = balance_after
+        lost = (expected - wallet.balance) / amount
+
+        style = self.style.SUCCESS if not lost and not broken else self.style.ERROR
+        self.stdout.write(style(
+            f'{mode:>8} {outcomes["paid"] / elapsed:>10,.0f} {outcomes["error"]:>7} '
+            f'{expected:>10} {wallet.balance:>10} {lost:>6.0f}  '
+            f'{len(ledger)} entries, {broken} with a wrong balance_after'
+        ))
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from dateutil.relativedelta import relativedelta
+from lending.models import Loan, LoanPayment
+from lending import amortization
+
+class Command(BaseCommand):
+    help = 'Create the missing repayment schedules of funded, active and repaid loans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of installments written per bulk insert',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the loans that need a schedule without creating it',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options.get('dry_run', False)
+
+        loans = Loan.objects.filter(
+            status__in=['funded', 'active', 'repaid'],
+            payments__isnull=True
+        ).defer('description', 'purpose_description', 'collateral_description')
+
+        missing_start_date = loans.filter(start_date__isnull=True).count()
+        if missing_start_date:
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {missing_start_date} loans without a start date'
+            ))
+
+        loans = loans.filter(start_date__isnull=False)
+        self.stdout.write(f'Found {loans.count()} loans without a repayment schedule')
+
+        if dry_run:
+            return
+
+        loan_count = 0
+        payment_count = 0
+        chunk = []
+
+        with transaction.atomic():
+            for loan in loans.iterator(chunk_size=500):
+                chunk.append(loan)
+
+                if len(chunk) >= 500:
+                    payment_count += self.create_schedules(chunk, batch_size)
+                    loan_count += len(chunk)
+                    chunk = []
+
+            if chunk:
+                payment_count += self.create_schedules(chunk, batch_size)
+                loan_count += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {payment_count} installments for {loan_count} loans'
+        ))
+
+    def create_schedules(self, loans, batch_size):
+        """Amortize a chunk of loans in one vectorized pass and bulk insert their installments"""
+        table = amortization.amortize(
+            amortization.to_cents(loan.amount for loan in loans),
+            [float(loan.interest_rate) for loan in loans],
+            [loan.term_months for loan in loans],
+            payments=amortization.to_cents(loan.monthly_payment for loan in loans),
+        )
+
+        payments = []
+        for row, loan in enumerate(loans):
+            amount_due = amortization.cents_to_decimal(table.payments[row])
+            due_date = loan.start_date
+            for month in range(loan.term_months):
+                payments.append(LoanPayment(
+                    loan=loan,
+                    payment_number=month + 1,
+                    due_date=due_date,
+                    amount_due=amount_due,
+                    principal=amortization.cents_to_decimal(table.principal[row, month]),
+                    interest=amortization.cents_to_decimal(table.interest[row, month]),
+                    status='pending'
+                ))
+                due_date = due_date + relativedelta(months=1)
+
+        LoanPayment.objects.bulk_create(payments, batch_size=batch_size, ignore_conflicts=True)
+        return len(payments)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from lending.autoinvest import auto_invest
+from lending.models import Loan
+
+class Command(BaseCommand):
+    help = 'Apply the auto-invest rules to the loans already open for investment, oldest first'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the number of open loans without investing',
+        )
+
+    def handle(self, *args, **options):
+        loans = Loan.objects.filter(status='pending').defer(
+            'description', 'purpose_description', 'collateral_description'
+        ).order_by('created_at', 'pk')
+        self.stdout.write(f'Found {loans.count()} loans open for investment')
+
+        if options.get('dry_run', False):
+            return
+
+        loan_count = 0
+        investment_count = 0
+        for loan in loans.iterator(chunk_size=500):
+            investments = auto_invest(loan)
+            if investments:
+                loan_count += 1
+                investment_count += len(investments)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Placed {investment_count} auto-investments in {loan_count} loans'
+        ))
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 17:47
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_funding_totals(apps, schema_editor):
+    Loan = apps.get_model('lending', 'Loan')
+    Investment = apps.get_model('lending', 'Investment')
+
+    totals = Investment.objects.values('loan_id').annotate(
+        total=models.Sum('amount'),
+        investors=models.Count('investor', distinct=True),
+    )
+    for row in totals:
+        Loan.objects.filter(pk=row['loan_id']).update(
+            funded_amount=row['total'] or Decimal('0.00'),
+            investor_count=row['investors'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lending', '0003_add_automated_payment_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='funded_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='investor_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_funding_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import lending.models
+from lending import search
+
+
+def install_search_index(apps, schema_editor):
+    search.install_search_index(schema_editor, apps.get_model('lending', 'Loan'))
+
+
+def uninstall_search_index(apps, schema_editor):
+    search.uninstall_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lending', '0004_loan_funded_amount_loan_investor_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanSearchIndex',
+            fields=[
+                ('loan', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='lending.loan')),
+                ('document', lending.models.FullTextField(db_column='lending_loan_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'lending_loan_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 18:01
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lending', '0005_loan_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'interest_rate'], name='loan_status_rate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'risk_score'], name='loan_status_risk_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'term_months'], name='loan_status_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'amount'], name='loan_status_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'created_at'], name='loan_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(models.F('status'), models.ExpressionWrapper(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('funded_amount', models.FloatField()), '/', django.db.models.functions.comparison.Cast('amount', models.FloatField())), output_field=models.FloatField()), name='loan_status_funding_idx'),
+        ),
+    ]
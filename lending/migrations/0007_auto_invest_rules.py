@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 18:20
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('lending', '0006_loan_marketplace_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoInvestRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('risk_band', models.CharField(blank=True, choices=[('low', 'Low Risk (1-3)'), ('medium', 'Medium Risk (4-7)'), ('high', 'High Risk (8-10)')], max_length=10)),
+                ('purpose', models.CharField(blank=True, choices=[('personal', 'Personal'), ('business', 'Business'), ('education', 'Education'), ('debt_consolidation', 'Debt Consolidation'), ('home_improvement', 'Home Improvement'), ('medical', 'Medical'), ('car', 'Car Purchase'), ('vacation', 'Vacation'), ('wedding', 'Wedding'), ('other', 'Other')], max_length=20)),
+                ('min_interest_rate', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=5)),
+                ('max_term_months', models.IntegerField(blank=True, null=True)),
+                ('amount_per_loan', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('max_exposure', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('invested_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('investor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auto_invest_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='investment',
+            name='auto_invest_rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='investments', to='lending.autoinvestrule'),
+        ),
+        migrations.AddIndex(
+            model_name='autoinvestrule',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['risk_band', 'purpose', 'min_interest_rate'], name='autoinvest_predicate_idx'),
+        ),
+    ]
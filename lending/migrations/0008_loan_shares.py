@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 18:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('lending', '0007_auto_invest_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanShare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('share', models.DecimalField(decimal_places=12, max_digits=13)),
+                ('rounding_order', models.PositiveIntegerField()),
+                ('investor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loan_shares', to=settings.AUTH_USER_MODEL)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='lending.loan')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='loanshare',
+            constraint=models.UniqueConstraint(fields=('loan', 'investor'), name='loan_share_unique_investor'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lending', '0008_loan_shares'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='investment',
+            index=models.Index(fields=['investor', 'date_invested', 'id'], name='investment_investor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrower', 'created_at', 'id'], name='loan_borrower_created_idx'),
+        ),
+    ]
@@ -1,10 +1,63 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db import transaction
-from decimal import Decimal
+from django.utils.functional import cached_property
+from django.db import OperationalError, transaction
+from django.db.models import F, Q, ExpressionWrapper, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Substr
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from decimal import Decimal, ROUND_HALF_UP
 import math
+import random
+import time
 from dateutil.relativedelta import relativedelta
+from accounts.models import InvestorProfile, Transaction, Wallet, WalletDailySummary
+from . import detail_cache, facets, live, orderbook, pricing
+
+# Funded fraction of a loan (0 to 1); also the expression of the funding sort index,
+# so it must stay free of query parameters for SQLite to match the two
+FUNDING_PROGRESS = ExpressionWrapper(
+    Cast('funded_amount', models.FloatField()) / Cast('amount', models.FloatField()),
+    output_field=models.FloatField()
+)
+
+class LoanQuerySet(models.QuerySet):
+    """QuerySet with batch helpers for loan list pages"""
+    
+    def for_marketplace(self):
+        """Loan card projection: long text columns are deferred and replaced by a
+        short description preview, and funding progress is annotated for sorting"""
+        return self.defer(
+            'description', 'purpose_description', 'collateral_description'
+        ).annotate(
+            description_preview=Substr('description', 1, 101),
+            funding_progress=FUNDING_PROGRESS,
+        )
+    
+    def with_payment_metrics(self):
+        """Annotate the repayment metrics used by remaining_balance, repayment_progress,
+        is_late and on_time_payment_percentage so they don't query per loan"""
+        def payment_subquery(aggregate, output_field, **filters):
+            payments = LoanPayment.objects.filter(loan=OuterRef('pk'), **filters).order_by()
+            return Coalesce(
+                Subquery(payments.values('loan').annotate(value=aggregate).values('value')[:1],
+                         output_field=output_field),
+                Value(0),
+                output_field=output_field
+            )
+        
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=2)
+        on_time = Q(payment_date__isnull=True) | Q(payment_date__lte=F('due_date'))
+        
+        return self.annotate(
+            paid_principal_total=payment_subquery(models.Sum('principal'), decimal_field, status='paid'),
+            late_payment_count=payment_subquery(models.Count('id'), models.IntegerField(), status='late'),
+            settled_payment_count=payment_subquery(
+                models.Count('id'), models.IntegerField(), status__in=['paid', 'late']),
+            on_time_payment_count=payment_subquery(
+                models.Count('id', filter=on_time), models.IntegerField(), status='paid'),
+        )
 
 class Loan(models.Model):
     STATUS_CHOICES = (
@@ -67,23 +120,54 @@ class Loan(models.Model):
     days_late_count = models.IntegerField(default=0)
     times_late_count = models.IntegerField(default=0)
     
+    # Funding totals (maintained by invest_in_loan and refund_investment)
+    funded_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    investor_count = models.IntegerField(default=0)
+    
+    objects = LoanQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Marketplace filters and keyset sort orders (see views.MARKETPLACE_SORTS)
+            models.Index(fields=['status', 'interest_rate'], name='loan_status_rate_idx'),
+            models.Index(fields=['status', 'risk_score'], name='loan_status_risk_idx'),
+            models.Index(fields=['status', 'term_months'], name='loan_status_term_idx'),
+            models.Index(fields=['status', 'amount'], name='loan_status_amount_idx'),
+            models.Index(fields=['status', 'created_at'], name='loan_status_created_idx'),
+            models.Index(F('status'), FUNDING_PROGRESS, name='loan_status_funding_idx'),
+            # Keyset order of the borrower's loan history (see views.HISTORY_ORDERING)
+            models.Index(fields=['borrower', 'created_at', 'id'], name='loan_borrower_created_idx'),
+        ]
+    
     @property
     def current_funded_amount(self):
-        """Calculate total amount invested in this loan"""
-        return Investment.objects.filter(loan=self).aggregate(
-            total=models.Sum('amount'))['total'] or Decimal('0.00')
+        """Total amount invested in this loan (stored counter)"""
+        return self.funded_amount
     
     @property
     def funding_percentage(self):
         """Calculate percentage of loan that has been funded"""
         if self.amount <= 0:
             return 0
-        return (self.current_funded_amount / self.amount) * 100
+        return (self.funded_amount / self.amount) * 100
     
     @property
     def remaining_amount(self):
         """Calculate remaining amount needed to fully fund the loan"""
-        return self.amount - self.current_funded_amount
+        return self.amount - self.funded_amount
+    
+    def recalculate_funding_totals(self, save=True):
+        """Recompute funded_amount and investor_count from the Investment rows"""
+        totals = Investment.objects.filter(loan=self).aggregate(
+            total=models.Sum('amount'),
+            investors=models.Count('investor', distinct=True)
+        )
+        self.funded_amount = totals['total'] or Decimal('0.00')
+        self.investor_count = totals['investors'] or 0
+        
+        if save:
+            self.save(update_fields=['funded_amount', 'investor_count'])
+        return self.funded_amount
         
     @property
     def total_interest(self):
@@ -97,10 +181,13 @@ class Loan(models.Model):
         if self.status not in ['active', 'funded', 'repaid']:
             return self.amount
             
-        # Calculate based on payments made
-        paid_amount = LoanPayment.objects.filter(
-            loan=self, status='paid'
-        ).aggregate(total_principal=models.Sum('principal'))['total_principal'] or Decimal('0.00')
+        # Calculate based on payments made (annotated by with_payment_metrics when available)
+        if hasattr(self, 'paid_principal_total'):
+            paid_amount = self.paid_principal_total or Decimal('0.00')
+        else:
+            paid_amount = LoanPayment.objects.filter(
+                loan=self, status='paid'
+            ).aggregate(total_principal=models.Sum('principal'))['total_principal'] or Decimal('0.00')
         
         return self.amount - paid_amount
         
@@ -114,81 +201,74 @@ class Loan(models.Model):
     @property
     def is_late(self):
         """Check if loan has any late payments"""
+        if hasattr(self, 'late_payment_count'):
+            return self.late_payment_count > 0
         return LoanPayment.objects.filter(loan=self, status='late').exists()
         
     @property
     def on_time_payment_percentage(self):
         """Calculate percentage of payments made on time"""
-        total_payments = LoanPayment.objects.filter(
-            loan=self, status__in=['paid', 'late']
-        ).count()
+        if hasattr(self, 'settled_payment_count'):
+            total_payments = self.settled_payment_count
+        else:
+            total_payments = LoanPayment.objects.filter(
+                loan=self, status__in=['paid', 'late']
+            ).count()
         
         if total_payments == 0:
             return 100
-            
-        on_time_payments = LoanPayment.objects.filter(
-            loan=self, status='paid'
-        ).exclude(payment_date__gt=F('due_date')).count()
+        
+        if hasattr(self, 'on_time_payment_count'):
+            on_time_payments = self.on_time_payment_count
+        else:
+            on_time_payments = LoanPayment.objects.filter(
+                loan=self, status='paid'
+            ).exclude(payment_date__gt=F('due_date')).count()
         
         return (on_time_payments / total_payments) * 100
     
     def calculate_monthly_payment(self):
         """Calculate monthly payment amount using amortization formula"""
-        r = self.interest_rate / Decimal('100') / 12  # Monthly interest rate
-        n = self.term_months  # Number of payments
-        
         # Amortization formula: P = A * (r(1+r)^n) / ((1+r)^n - 1)
-        if r == 0:
-            return self.amount / n
-        
-        numerator = r * (1 + r) ** n
-        denominator = (1 + r) ** n - 1
+        if self.interest_rate == 0:
+            return self.amount / self.term_months
         
-        return self.amount * (numerator / denominator)
+        return self.amount * pricing.amortization_factor(Decimal(self.interest_rate), self.term_months)
     
-    def generate_repayment_schedule(self):
-        """Generate or retrieve the repayment schedule for this loan"""
-        # If we've already generated the schedule, return it
-        if LoanPayment.objects.filter(loan=self).exists():
-            return LoanPayment.objects.filter(loan=self).order_by('payment_number')
-        
-        # If loan is not funded yet, return empty list
-        if self.status not in ['funded', 'active', 'repaid'] or not self.start_date:
+    def build_repayment_schedule(self):
+        """Build the (unsaved) amortized installments for this loan, rounded to cents"""
+        if not self.start_date:
             return []
         
+        cent = Decimal('0.01')
+        monthly_rate = self.interest_rate / Decimal('100') / 12
+        monthly_payment = Decimal(self.monthly_payment).quantize(cent)
+        
         # Calculate payment details
-        balance = self.amount
+        balance = Decimal(self.amount)
         payment_date = self.start_date
         
         schedule = []
         
         for payment_number in range(1, self.term_months + 1):
             # Calculate interest and principal
-            monthly_interest = balance * (self.interest_rate / Decimal('100') / 12)
-            
             if payment_number == self.term_months:
                 # Last payment - make sure we pay off exactly the balance
                 principal = balance
-                interest = self.monthly_payment - principal
+                interest = monthly_payment - principal
             else:
-                interest = monthly_interest
-                principal = self.monthly_payment - interest
+                interest = (balance * monthly_rate).quantize(cent)
+                principal = monthly_payment - interest
             
-            # Create payment record
-            payment = LoanPayment(
+            schedule.append(LoanPayment(
                 loan=self,
                 payment_number=payment_number,
                 due_date=payment_date,
-                amount_due=self.monthly_payment,
+                amount_due=monthly_payment,
                 principal=principal,
                 interest=interest,
                 status='pending'
-            )
-            
-            if hasattr(payment, 'id'):  # If it's a saved instance
-                schedule.append(payment)
-            else:
-                schedule.append(payment)  # Unsaved but will be returned for display
+            ))
             
             # Update balance and next payment date
             balance -= principal
@@ -196,15 +276,118 @@ class Loan(models.Model):
         
         return schedule
     
+    def close_funding(self):
+        """Mark a fully funded loan as funded and create its payment schedule"""
+        self.status = 'funded'
+        self.start_date = timezone.now().date()
+        self.end_date = self.start_date + relativedelta(months=self.term_months)
+        self.save(update_fields=['status', 'start_date', 'end_date'])
+        self.create_repayment_schedule()
+        self.capture_shares()
+    
+    def capture_shares(self):
+        """Store each investor's pro-rata share of the loan; returns the shares in rounding order.
+        
+        Several investments by one investor become one position. The rounding
+        order settles ties when apportion() hands out leftover cents: larger
+        positions first, then by investor.
+        """
+        positions = list(
+            self.investments.order_by().values_list('investor_id').annotate(total=models.Sum('amount'))
+        )
+        total = sum(amount for _, amount in positions)
+        if not total:
+            return []
+        
+        shares = [
+            LoanShare(loan=self, investor_id=investor_id, amount=amount,
+                      share=(amount / total).quantize(LoanShare.SHARE_QUANTUM), rounding_order=order)
+            for order, (investor_id, amount) in enumerate(
+                sorted(positions, key=lambda position: (-position[1], position[0])))
+        ]
+        return LoanShare.objects.bulk_create(shares, ignore_conflicts=True)
+    
+    def create_repayment_schedule(self):
+        """Persist the repayment schedule with a single bulk insert.
+        
+        Installments that already exist for this loan are left untouched, so
+        calling this more than once is safe.
+        """
+        if self.status not in ['funded', 'active', 'repaid']:
+            return []
+        
+        existing_numbers = set(
+            LoanPayment.objects.filter(loan=self).values_list('payment_number', flat=True))
+        missing = [
+            payment for payment in self.build_repayment_schedule()
+            if payment.payment_number not in existing_numbers
+        ]
+        
+        if missing:
+            LoanPayment.objects.bulk_create(missing, ignore_conflicts=True)
+        
+        self.__dict__.pop('repayment_schedule', None)
+        return self.repayment_schedule
+    
+    def generate_repayment_schedule(self):
+        """Retrieve the saved repayment schedule, or preview it if it hasn't been created yet"""
+        schedule = list(LoanPayment.objects.filter(loan=self).order_by('payment_number'))
+        if schedule:
+            return schedule
+        
+        # If loan is not funded yet, return empty list
+        if self.status not in ['funded', 'active', 'repaid']:
+            return []
+        
+        return self.build_repayment_schedule()
+    
+    @cached_property
+    def repayment_schedule(self):
+        """Ordered repayment schedule, loaded once per instance"""
+        return self.generate_repayment_schedule()
+    
     def __str__(self):
         return f"{self.title} - ${self.amount} ({self.get_status_display()})"
 
+class FullTextField(models.TextField):
+    """Column of a full-text index table; supports the `match` lookup"""
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+    
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+class LoanSearchIndex(models.Model):
+    """SQLite FTS5 index over loan text, maintained by triggers (see lending.search)"""
+    loan = models.OneToOneField(Loan, on_delete=models.DO_NOTHING, primary_key=True,
+                                db_column='rowid', related_name='search_index')
+    document = FullTextField(db_column='lending_loan_fts')
+    rank = models.FloatField()
+    
+    class Meta:
+        managed = False
+        db_table = 'lending_loan_fts'
+
 class Investment(models.Model):
     investor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='investments')
     loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='investments')
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     date_invested = models.DateTimeField(auto_now_add=True)
     
+    # Set when the investment was placed by one of the investor's auto-invest rules
+    auto_invest_rule = models.ForeignKey('AutoInvestRule', on_delete=models.SET_NULL, null=True, blank=True,
+                                         related_name='investments')
+    
+    class Meta:
+        indexes = [
+            # Keyset order of the investor's investment history (see views.HISTORY_ORDERING)
+            models.Index(fields=['investor', 'date_invested', 'id'], name='investment_investor_date_idx'),
+        ]
+    
     @property
     def investment_percentage(self):
         """Calculate what percentage of the loan this investment represents"""
@@ -215,6 +398,61 @@ class Investment(models.Model):
     def __str__(self):
         return f"{self.investor.username} invested ${self.amount} in {self.loan.title}"
 
+class LoanShare(models.Model):
+    """An investor's pro-rata share of a loan, captured once when the loan is funded"""
+    SHARE_QUANTUM = Decimal('0.000000000001')
+    
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='shares')
+    investor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='loan_shares')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    share = models.DecimalField(max_digits=13, decimal_places=12)
+    
+    # Order in which tied leftover cents are handed out (0 first)
+    rounding_order = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'investor'], name='loan_share_unique_investor'),
+        ]
+    
+    def __str__(self):
+        return f"{self.investor.username} holds {self.share:.4%} of {self.loan.title}"
+
+class AutoInvestRule(models.Model):
+    """An investor's standing order to invest in new loans that meet its criteria"""
+    RISK_BAND_CHOICES = tuple((key, label) for key, label, _, _ in facets.RISK_BUCKETS)
+    
+    investor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='auto_invest_rules')
+    name = models.CharField(max_length=100)
+    is_active = models.BooleanField(default=True)
+    
+    # Criteria; a blank risk band, purpose or term matches any loan
+    risk_band = models.CharField(max_length=10, choices=RISK_BAND_CHOICES, blank=True)
+    purpose = models.CharField(max_length=20, choices=Loan.LOAN_PURPOSE_CHOICES, blank=True)
+    min_interest_rate = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
+    max_term_months = models.IntegerField(null=True, blank=True)
+    
+    # Allocation
+    amount_per_loan = models.DecimalField(max_digits=12, decimal_places=2)
+    max_exposure = models.DecimalField(max_digits=12, decimal_places=2)
+    invested_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Predicate index used to match a new loan (see lending.autoinvest)
+            models.Index(fields=['risk_band', 'purpose', 'min_interest_rate'],
+                         name='autoinvest_predicate_idx', condition=Q(is_active=True)),
+        ]
+    
+    @property
+    def remaining_exposure(self):
+        return max(self.max_exposure - self.invested_amount, Decimal('0.00'))
+    
+    def __str__(self):
+        return f"{self.investor.username}'s auto-invest rule {self.name}"
+
 class LoanPayment(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -280,9 +518,10 @@ class LoanPayment(models.Model):
             # Update loan's late payment metrics
             self.loan.times_late_count += 1
             self.loan.days_late_count += self.days_overdue()
-            self.loan.save()
+            self.loan.save(update_fields=['times_late_count', 'days_late_count'])
             
             self.save()
+            detail_cache.loan_changed(self.loan_id)
             return True
         return False
 
@@ -330,19 +569,15 @@ class PortfolioAnalysis(models.Model):
         # Performance metrics
         self.total_invested = investments.aggregate(sum=Sum('amount'))['sum'] or Decimal('0.00')
         
-        # Calculate earnings (both realized and expected)
-        paid_payments = LoanPayment.objects.filter(
-            loan__investments__investor=self.investor,
-            status='paid'
-        )
-        
-        pending_payments = LoanPayment.objects.filter(
-            loan__investments__investor=self.investor,
-            status__in=['pending', 'late']
+        # Calculate earnings (both realized and expected): the investor's stored share of the interest
+        interest_share = ExpressionWrapper(F('interest') * F('loan__shares__share'), output_field=DecimalField())
+        earnings = LoanPayment.objects.filter(loan__shares__investor=self.investor).aggregate(
+            paid=Sum(interest_share, filter=Q(status='paid')),
+            expected=Sum(interest_share, filter=Q(status__in=['pending', 'late'])),
         )
         
-        self.total_earnings = paid_payments.aggregate(sum=Sum('interest'))['sum'] or Decimal('0.00')
-        self.expected_earnings = pending_payments.aggregate(sum=Sum('interest'))['sum'] or Decimal('0.00')
+        self.total_earnings = (earnings['paid'] or Decimal('0.00')).quantize(Decimal('0.01'))
+        self.expected_earnings = (earnings['expected'] or Decimal('0.00')).quantize(Decimal('0.01'))
         
         # Calculate annual return rate
         if self.total_invested > 0:
@@ -409,8 +644,14 @@ class PortfolioAnalysis(models.Model):
         return self
 
 # Function to create a loan request
-def create_loan_request(borrower, title, description, amount, term_months, purpose=''):
-    """Create a new loan request with risk assessment and interest rate calculation"""
+def create_loan_request(borrower, title, description, amount, term_months, purpose='',
+                        borrower_verified=False, is_secured=False, collateral_value=None, **details):
+    """Create a new loan request with risk assessment and interest rate calculation.
+    
+    The rate includes the verified-borrower and secured-loan discounts, and the
+    loan is written and announced to the order book once. `details` are other
+    Loan fields recorded with the request (purpose description, history, ...).
+    """
     # Get borrower's credit score
     try:
         borrower_profile = borrower.profile.borrower_profile
@@ -423,24 +664,24 @@ def create_loan_request(borrower, title, description, amount, term_months, purpo
         # Default credit score if we couldn't get the borrower profile
         credit_score = 650
     
-    # Calculate interest rate based on credit score and loan term
-    # Higher credit score = lower interest rate
-    # Longer term = higher interest rate
-    base_rate = Decimal('10.00')  # Base rate of 10%
+    # Secured loans are discounted by their loan-to-value ratio
+    loan_to_value_ratio = None
+    if not is_secured:
+        collateral_value = None
+    elif collateral_value is not None and collateral_value > 0:
+        loan_to_value_ratio = amount / collateral_value
     
-    # Adjust for credit score: 0.02% reduction for each point above 650, up to 3%
-    credit_adjustment = min((credit_score - 650) * Decimal('0.02'), Decimal('3.00'))
-    
-    # Adjust for term: 0.1% increase for each month above 12, up to 2%
-    term_adjustment = min((term_months - 12) * Decimal('0.1'), Decimal('2.00'))
-    
-    interest_rate = base_rate - credit_adjustment + term_adjustment
-    interest_rate = max(interest_rate, Decimal('5.00'))  # Minimum 5% interest rate
+    # Calculate interest rate based on credit score and loan term, then apply the discounts
+    interest_rate = pricing.adjust_interest_rate(
+        pricing.base_interest_rate(credit_score, term_months),
+        borrower_verified=borrower_verified,
+        is_secured=is_secured,
+        loan_to_value_ratio=loan_to_value_ratio
+    )
     
     # Calculate the risk score (1-10 scale, 10 being highest risk)
-    risk_score = 10 - int(min(credit_score / 80, 10))
+    risk_score = pricing.calculate_risk_score(credit_score)
     
-    # Calculate monthly payment and total repayment
     loan = Loan(
         borrower=borrower,
         title=title,
@@ -449,67 +690,307 @@ def create_loan_request(borrower, title, description, amount, term_months, purpo
         interest_rate=interest_rate,
         term_months=term_months,
         risk_score=risk_score,
-        purpose=purpose
+        purpose=purpose,
+        borrower_verified=borrower_verified,
+        is_secured=is_secured,
+        collateral_value=collateral_value,
+        loan_to_value_ratio=loan_to_value_ratio,
+        **details
     )
     
-    # Calculate monthly payment
-    monthly_payment = loan.calculate_monthly_payment()
-    loan.monthly_payment = monthly_payment
-    
-    # Calculate total repayment
-    loan.total_repayment = monthly_payment * Decimal(term_months)
+    # Calculate monthly payment and total repayment as the quote endpoint does
+    loan.monthly_payment, loan.total_repayment = pricing.payment_terms(Decimal(amount), interest_rate, term_months)
     
     # Save the loan
     loan.save()
+    orderbook.loan_changed(loan.pk)
     
     return loan
 
+# Attempts made at an investment that hits a lock conflict or deadlock
+INVEST_ATTEMPTS = 5
+
+def retry_on_conflict(func, *args, **kwargs):
+    """Call a function that runs its own transaction, retrying it on lock conflicts and deadlocks"""
+    # Inside an enclosing transaction a conflict can only be retried by the caller
+    if transaction.get_connection().in_atomic_block:
+        return func(*args, **kwargs)
+    
+    for attempt in range(INVEST_ATTEMPTS):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError:
+            if attempt == INVEST_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
 # Function to process an investment in a loan
 def invest_in_loan(investor, loan, amount):
-    """Process an investment in a loan"""
+    """Process an investment in a loan, retrying when it collides with concurrent investments"""
+    return retry_on_conflict(_invest_in_loan, investor, loan, amount)
+
+def _invest_in_loan(investor, loan, amount):
+    # Loaded before the transaction so that its first statement is a write and takes the locks
+    wallet = investor.wallet
+    
     with transaction.atomic():
-        # Verify the loan is still available for investment
-        if loan.status != 'pending':
-            return {'success': False, 'message': 'This loan is no longer available for investment.'}
-        
-        # Verify investor has sufficient funds
-        wallet = investor.wallet
-        if wallet.balance < amount:
+        # 1. Deduct funds from investor's wallet; the guarded update refuses to go negative.
+        # Its ledger entry is written once the investment it belongs to exists
+        if wallet.adjust_balance(-amount, minimum=Decimal('0.00')) is None:
             return {'success': False, 'message': 'Insufficient funds in your wallet.'}
         
-        # Verify the investment amount doesn't exceed what's still needed
-        remaining_needed = loan.amount - loan.current_funded_amount
-        if amount > remaining_needed:
-            return {'success': False, 'message': f'The maximum you can invest is ${remaining_needed}.'}
+        # 2. Take the amount from the loan only while it is open and has room for it,
+        # so concurrent investors can never oversubscribe it
+        funded = Loan.objects.filter(
+            pk=loan.pk, status='pending', funded_amount__lte=F('amount') - amount
+        ).update(funded_amount=F('funded_amount') + amount)
+        if funded:
+            return _record_investment(investor, wallet, loan, amount)
+        
+        # Give the debit back
+        transaction.set_rollback(True)
+    
+    wallet.refresh_from_db(fields=['balance'])
+    loan.refresh_from_db(fields=['status', 'funded_amount', 'investor_count'])
+    if loan.status != 'pending':
+        return {'success': False, 'message': 'This loan is no longer available for investment.'}
+    return {'success': False, 'message': f'The maximum you can invest is ${loan.amount - loan.funded_amount}.'}
+
+def _record_investment(investor, wallet, loan, amount):
+    """Remaining steps of an investment once the wallet and the loan have taken the amount"""
+    # 3. Create investment record and the wallet's ledger entry for it
+    is_new_investor = not Investment.objects.filter(loan=loan, investor=investor).exists()
+    investment = Investment.objects.create(
+        investor=investor,
+        loan=loan,
+        amount=amount
+    )
+    WalletDailySummary.record([Transaction.objects.create(
+        wallet=wallet,
+        transaction_type='investment',
+        amount=amount,
+        description=f'Investment in {loan.title}',
+        balance_after=wallet.balance,
+        related_entity_type='investment',
+        related_entity_id=investment.pk,
+    )])
+    if is_new_investor:
+        Loan.objects.filter(pk=loan.pk).update(investor_count=F('investor_count') + 1)
+    loan.refresh_from_db(fields=['status', 'funded_amount', 'investor_count'])
+    
+    # 4. Update investor's total invested amount
+    investor_profile = investor.profile.investor_profile
+    InvestorProfile.objects.filter(pk=investor_profile.pk).update(
+        total_invested=F('total_invested') + amount)
+    investor_profile.refresh_from_db(fields=['total_invested'])
+    
+    # 5. Check if loan is now fully funded; only the investment that filled it gets here
+    if loan.funded_amount >= loan.amount:
+        loan.close_funding()
+    
+    orderbook.loan_changed(loan.pk)
+    live.publish_funding(loan)
+    detail_cache.loan_changed(loan.pk)
+    
+    return {'success': True, 'message': f'Successfully invested ${amount} in {loan.title}.'}
+
+# Function to invest in many loans at once
+def invest_in_basket(investor, lines):
+    """Invest in several loans in one transaction.
+    
+    `lines` is a sequence of (loan_id, amount) pairs. Lines are accepted in
+    order while the wallet and each loan have room for them; the rest are
+    declined. Returns the usual result dict plus a 'results' list with the
+    outcome of every line.
+    """
+    return retry_on_conflict(_invest_in_basket, investor, lines)
+
+def _invest_in_basket(investor, lines):
+    results = [{'loan': loan_id, 'amount': str(amount)} for loan_id, amount in lines]
+    accepted = []
+    
+    with transaction.atomic():
+        # Lock the wallet, then the loans in primary key order (as invest_in_loan does),
+        # so concurrent baskets and investments cannot deadlock
+        wallet = Wallet.objects.select_for_update().get(user=investor)
+        loans = {
+            loan.pk: loan
+            for loan in Loan.objects.select_for_update().filter(pk__in={loan_id for loan_id, _ in lines})
+                .defer('description', 'purpose_description', 'collateral_description').order_by('pk')
+        }
+        already_invested = set(Investment.objects.filter(
+            investor=investor, loan_id__in=loans).values_list('loan_id', flat=True))
+        
+        # Validate every line against the wallet and the loans' remaining room
+        balance = wallet.balance
+        added = {}
+        for result, (loan_id, amount) in zip(results, lines):
+            loan = loans.get(loan_id)
+            success = False
+            if loan is None:
+                message = 'Loan not found.'
+            elif amount <= 0:
+                message = 'Investment amount must be greater than zero.'
+            elif loan.status != 'pending':
+                message = 'This loan is no longer available for investment.'
+            elif loan.borrower_id == investor.pk:
+                message = 'You cannot invest in your own loan.'
+            elif amount > balance:
+                message = 'Insufficient funds in your wallet.'
+            elif amount > loan.amount - loan.funded_amount - added.get(loan_id, 0):
+                message = f'The maximum you can invest is ${loan.amount - loan.funded_amount - added.get(loan_id, 0)}.'
+            else:
+                balance -= amount
+                added[loan_id] = added.get(loan_id, 0) + amount
+                accepted.append((loan, amount))
+                success = True
+                message = f'Invested ${amount} in {loan.title}.'
+            result.update(success=success, message=message)
+        
+        if not accepted:
+            return {'success': False, 'message': 'None of the investments could be made.', 'results': results}
+        
+        total = sum(added.values())
+        
+        # 1. One debit and one ledger entry for the whole basket
+        if wallet.adjust_balance(-total, minimum=Decimal('0.00')) is None:
+            # Only possible if the balance changed after it was read
+            transaction.set_rollback(True)
+            for result in results:
+                result.update(success=False, message='Insufficient funds in your wallet.')
+            return {'success': False, 'message': 'Insufficient funds in your wallet.', 'results': results}
+        WalletDailySummary.record([Transaction.objects.create(
+            wallet=wallet,
+            transaction_type='investment',
+            amount=total,
+            description=f'Investment in {len(added)} loans',
+            balance_after=wallet.balance
+        )])
+        
+        # 2. Investment records
+        Investment.objects.bulk_create([
+            Investment(investor=investor, loan=loan, amount=amount) for loan, amount in accepted
+        ])
+        
+        # 3. Loan funding totals; the loans are locked, so their values are current
+        for loan_id, amount in added.items():
+            loan = loans[loan_id]
+            loan.funded_amount += amount
+            if loan_id not in already_invested:
+                loan.investor_count += 1
+        Loan.objects.bulk_update([loans[loan_id] for loan_id in added], ['funded_amount', 'investor_count'])
+        
+        # 4. Investor's total invested amount
+        InvestorProfile.objects.filter(user_profile__user=investor).update(
+            total_invested=F('total_invested') + total)
+        
+        # 5. Close the loans this basket filled
+        for loan_id in added:
+            loan = loans[loan_id]
+            if loan.funded_amount >= loan.amount:
+                loan.close_funding()
+            orderbook.loan_changed(loan_id)
+            live.publish_funding(loan)
+            detail_cache.loan_changed(loan_id)
+    
+    return {
+        'success': True,
+        'message': f'Invested ${total} in {len(added)} loans.',
+        'results': results,
+    }
+
+# Function to refund an investment back to the investor
+def refund_investment(investment, description=None):
+    """Return an investment to the investor's wallet and remove it from the loan's funding"""
+    with transaction.atomic():
+        loan = investment.loan
         
-        # Process the investment
-        # 1. Deduct funds from investor's wallet
-        wallet.withdraw_funds(amount)
+        # Only loans that have not started repaying can be refunded
+        if loan.status not in ['pending', 'cancelled']:
+            return {'success': False, 'message': 'Investments can only be refunded before the loan is funded.'}
         
-        # 2. Create investment record
-        investment = Investment.objects.create(
-            investor=investor,
-            loan=loan,
-            amount=amount
+        investor = investment.investor
+        amount = investment.amount
+        
+        # 1. Credit the investor's wallet
+        investor.wallet.deposit_funds(
+            amount,
+            description=description or f'Refund of investment in {loan.title}'
         )
         
-        # 3. Update investor's total invested amount
-        investor_profile = investor.profile.investor_profile
-        investor_profile.total_invested += amount
-        investor_profile.save()
-        
-        # 4. Check if loan is now fully funded
-        if loan.current_funded_amount >= loan.amount:
-            # Update loan status to funded
-            loan.status = 'funded'
-            loan.start_date = timezone.now().date()
-            loan.end_date = loan.start_date + relativedelta(months=loan.term_months)
-            loan.save()
-            
-            # Create payment schedule
-            loan.generate_repayment_schedule()
+        # 2. Update investor's total invested amount
+        InvestorProfile.objects.filter(user_profile__user=investor).update(
+            total_invested=F('total_invested') - amount)
         
-        return {'success': True, 'message': f'Successfully invested ${amount} in {loan.title}.'}
+        # 3. Give the amount back to the auto-invest rule that placed it
+        if investment.auto_invest_rule_id:
+            AutoInvestRule.objects.filter(pk=investment.auto_invest_rule_id).update(
+                invested_amount=F('invested_amount') - amount)
+        
+        # 4. Remove the investment (the post_delete handler updates the loan's funding totals
+        # and tells the order book, the detail cache and the funding streams once this commits)
+        investment.delete()
+        loan.refresh_from_db(fields=['funded_amount', 'investor_count'])
+        
+        return {'success': True, 'message': f'Refunded ${amount} to {investor.username}.'}
+
+def apportion(total, weights):
+    """Split `total` into cents in proportion to `weights`, which must be in rounding order.
+    
+    Every part is rounded down and the cents left over go one each to the
+    parts with the largest remainders of this total, ties going to the
+    earlier part, so the parts always add up to exactly the total.
+    """
+    cents = int((total * 100).to_integral_value(ROUND_HALF_UP))
+    exact = [cents * weight for weight in weights]
+    parts = [int(value) for value in exact]
+    by_remainder = sorted(range(len(parts)), key=lambda index: (parts[index] - exact[index], index))
+    for position in range(cents - sum(parts)):
+        parts[by_remainder[position % len(parts)]] += 1
+    return [Decimal(part).scaleb(-2) for part in parts]
+
+def distribute_repayment(loan, payment, distributable_amount):
+    """Credit every investor's share of a repayment in a fixed number of statements.
+    
+    The amount is split by the shares stored when the loan was funded, to the
+    cent. The wallets are credited with one `balance + credit` update, each credit
+    gets a ledger entry from one bulk insert, and the interest part of the
+    shares is added to the investors' earnings with one more bulk update.
+    """
+    shares = list(loan.shares.order_by('rounding_order'))
+    if not shares:
+        # Funded before shares were stored
+        shares = loan.capture_shares()
+    if not shares:
+        return
+    
+    weights = [share.share for share in shares]
+    credits = dict(zip((share.investor_id for share in shares), apportion(distributable_amount, weights)))
+    interest = dict(zip((share.investor_id for share in shares), apportion(payment.interest, weights)))
+    
+    wallets = dict(Wallet.objects.filter(user_id__in=credits).values_list('pk', 'user_id'))
+    balances = Wallet.adjust_balances({
+        wallet_id: credits[user_id] for wallet_id, user_id in wallets.items() if credits[user_id]
+    })
+    
+    WalletDailySummary.record(Transaction.objects.bulk_create([
+        Transaction(
+            wallet_id=wallet_id,
+            transaction_type='return',
+            amount=credits[wallets[wallet_id]],
+            description=f'Repayment #{payment.payment_number} of {loan.title}',
+            balance_after=balance,
+            related_entity_type='loan_payment',
+            related_entity_id=payment.pk,
+        )
+        for wallet_id, balance in balances.items()
+    ]))
+    
+    profiles = list(InvestorProfile.objects.filter(user_profile__user_id__in=credits)
+                    .select_related('user_profile'))
+    for profile in profiles:
+        profile.total_earnings = F('total_earnings') + interest[profile.user_profile.user_id]
+    InvestorProfile.objects.bulk_update(profiles, ['total_earnings'])
 
 # Function to process a loan repayment
 def process_loan_repayment(loan, amount):
@@ -536,7 +1017,8 @@ def process_loan_repayment(loan, amount):
         
         # Process the payment
         # 1. Deduct funds from borrower's wallet
-        wallet.withdraw_funds(amount)
+        if not wallet.withdraw_funds(amount):
+            return {'success': False, 'message': 'Insufficient funds in your wallet.'}
         
         # 2. Update payment record
         next_payment.amount_paid = amount
@@ -546,7 +1028,7 @@ def process_loan_repayment(loan, amount):
         
         # 3. Distribute payment to investors
         platform_fee_percentage = Decimal('0.02')  # 2% platform fee
-        platform_fee = next_payment.interest * platform_fee_percentage
+        platform_fee = (next_payment.interest * platform_fee_percentage).quantize(Decimal('0.01'))
         
         distributable_amount = amount - platform_fee
         
@@ -560,28 +1042,48 @@ def process_loan_repayment(loan, amount):
             pass
         
         # Distribute to investors proportionally
-        for investment in loan.investments.all():
-            investor = investment.investor
-            investor_percentage = investment.investment_percentage / 100
-            investor_share = distributable_amount * investor_percentage
-            
-            # Add to investor's wallet
-            investor_wallet = investor.wallet
-            investor_wallet.deposit_funds(investor_share)
-            
-            # Update investor's earnings
-            investor_profile = investor.profile.investor_profile
-            interest_share = next_payment.interest * investor_percentage
-            investor_profile.total_earnings += interest_share
-            investor_profile.save()
+        distribute_repayment(loan, next_payment, distributable_amount)
         
         # 4. Update loan status if this was the last payment
         if not LoanPayment.objects.filter(loan=loan, status__in=['pending', 'late']).exists():
             loan.status = 'repaid'
-            loan.save()
+            loan.save(update_fields=['status'])
         elif loan.status == 'funded':
             # Change status to active after first payment
             loan.status = 'active'
-            loan.save()
+            loan.save(update_fields=['status'])
+        
+        detail_cache.loan_changed(loan.pk)
         
         return {'success': True, 'message': f'Payment of ${amount} processed successfully.'}
+
+# Signal to keep the stored loan funding totals in sync when an investment is removed
+@receiver(post_delete, sender=Investment)
+def release_investment_funding(sender, instance, **kwargs):
+    """Subtract a deleted investment from its loan's funded amount and investor count"""
+    still_invested = Investment.objects.filter(
+        loan_id=instance.loan_id, investor_id=instance.investor_id).exists()
+    
+    Loan.objects.filter(pk=instance.loan_id).update(
+        funded_amount=F('funded_amount') - instance.amount,
+        investor_count=F('investor_count') - (0 if still_invested else 1)
+    )
+    
+    # Refunds and deletions in the admin alike reach the book, the page cache and the streams
+    loan = Loan.objects.filter(pk=instance.loan_id).first()
+    if loan is not None:
+        orderbook.loan_changed(loan.pk)
+        live.publish_funding(loan)
+        detail_cache.loan_changed(loan.pk)
+
+# Signal to refresh the marketplace facet counts when a loan is created, changes state or is removed
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def invalidate_marketplace_facets(sender, instance, **kwargs):
+    """Move the facet count cache to a new version"""
+    facets.invalidate_facets()
+
+# Signal to drop a deleted loan from the order book
+@receiver(post_delete, sender=Loan)
+def remove_from_order_book(sender, instance, **kwargs):
+    orderbook.loan_changed(instance.pk)
@@ -0,0 +1,148 @@
+"""
+In-memory order book of the loans open for investment.
+
+Each process keeps the pending loans (marketplace card columns) in memory
+and serves unsearched marketplace pages from it. Writers announce a changed
+loan with loan_changed(): once the transaction commits, the version stamp in
+the cache is incremented and the loan id is recorded under the new version.
+A reader whose book is behind reloads only the loans changed since its
+version and re-sorts them into place, or rebuilds the book when the change
+log is incomplete. With a shared cache backend every process follows the
+same change log; with a per-process cache the book is also rebuilt after
+BOOK_MAX_AGE seconds so changes made by other processes show up.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db import transaction
+from .facets import filter_bounds, matches_filters
+from .pagination import object_sort_key, paginate_sorted
+
+VERSION_KEY = 'orderbook:version'
+CHANGE_KEY = 'orderbook:change:{}'
+CHANGE_TIMEOUT = 3600
+
+# A book further behind than this many changes is rebuilt rather than replayed
+MAX_REPLAY = 500
+
+BOOK_MAX_AGE = 300
+
+
+def current_version():
+    return cache.get_or_set(VERSION_KEY, 0, None)
+
+
+def _publish(loan_id):
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.incr(VERSION_KEY)
+    cache.set(CHANGE_KEY.format(version), loan_id, CHANGE_TIMEOUT)
+
+
+def loan_changed(loan_id):
+    """Record that a loan was created or its funding or status changed"""
+    transaction.on_commit(lambda: _publish(loan_id))
+
+
+def _load(loan_ids=None):
+    from .models import Loan
+
+    loans = Loan.objects.filter(status='pending').for_marketplace()
+    if loan_ids is not None:
+        loans = loans.filter(pk__in=loan_ids)
+    return {loan.pk: loan for loan in loans}
+
+
+class Snapshot:
+    """Immutable state of the book at one version, with lazily sorted views"""
+
+    def __init__(self, version, loans, orderings=None, built=None):
+        self.version = version
+        self.loans = loans
+        self.orderings = orderings if orderings is not None else {}
+        # When the loans were last all read from the database
+        self.built = built if built is not None else time.monotonic()
+
+    def sorted(self, ordering):
+        """(sort keys, loans) in `ordering`"""
+        ordering = tuple(ordering)
+        if ordering not in self.orderings:
+            keyed = sorted((object_sort_key(loan, ordering), loan) for loan in self.loans.values())
+            self.orderings[ordering] = ([key for key, _ in keyed], [loan for _, loan in keyed])
+        return self.orderings[ordering]
+
+    def replace(self, version, loan_ids, fresh):
+        """New snapshot with `loan_ids` removed and the `fresh` loans put in their place"""
+        loans = dict(self.loans)
+        orderings = {}
+        for ordering, (keys, items) in list(self.orderings.items()):
+            keys, items = list(keys), list(items)
+            for loan_id in loan_ids:
+                if loan_id in loans:
+                    index = bisect_left(keys, object_sort_key(loans[loan_id], ordering))
+                    del keys[index]
+                    del items[index]
+            for loan in fresh.values():
+                key = object_sort_key(loan, ordering)
+                index = bisect_left(keys, key)
+                keys.insert(index, key)
+                items.insert(index, loan)
+            orderings[ordering] = (keys, items)
+
+        for loan_id in loan_ids:
+            loans.pop(loan_id, None)
+        loans.update(fresh)
+        return Snapshot(version, loans, orderings, built=self.built)
+
+
+class OrderBook:
+    def __init__(self):
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def _changes(self, old, new):
+        """Loan ids changed between two versions, or None when they can't be replayed"""
+        if new < old or new - old > MAX_REPLAY:
+            return None
+        keys = [CHANGE_KEY.format(version) for version in range(old + 1, new + 1)]
+        found = cache.get_many(keys)
+        if len(found) != len(keys):
+            return None
+        return set(found.values())
+
+    def sync(self):
+        """Bring the book up to the current version and return its snapshot"""
+        # Read the version before the loans so no change can be missed
+        version = current_version()
+        snapshot = self.snapshot
+        if (snapshot is not None and snapshot.version == version
+                and time.monotonic() - snapshot.built < BOOK_MAX_AGE):
+            return snapshot
+
+        with self._lock:
+            snapshot = self.snapshot
+            if snapshot is None or time.monotonic() - snapshot.built >= BOOK_MAX_AGE:
+                changed = None
+            elif snapshot.version == version:
+                return snapshot
+            else:
+                changed = self._changes(snapshot.version, version)
+
+            if changed is None:
+                self.snapshot = Snapshot(version, _load())
+            else:
+                self.snapshot = snapshot.replace(version, changed, _load(changed))
+            return self.snapshot
+
+
+book = OrderBook()
+
+
+def marketplace_page(filters, ordering, cursor=None, page_size=24):
+    """KeysetPage of pending loans matching normalized marketplace filters (no search query)"""
+    snapshot = book.sync()
+    keys, items = snapshot.sorted(ordering)
+    bounds = filter_bounds(filters)
+    return paginate_sorted(items, keys, ordering, cursor, page_size,
+                           predicate=lambda loan: matches_filters(loan, bounds))
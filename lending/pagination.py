@@ -0,0 +1,231 @@
+"""
+Keyset (cursor) pagination for list pages.
+
+A page is selected with a WHERE clause on the sort key of the last row seen
+rather than an OFFSET, so with an index on the sort columns page 500 costs
+the same as page 1. The ordering must end with a unique column (normally
+id) and its columns must not be NULL.
+"""
+
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """One page of results plus the cursors of its neighbours"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'v': [_json_value(value) for value in values], 'b': backwards})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (values, backwards) from a cursor token; raises InvalidCursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return list(payload['v']), bool(payload['b'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Malformed page cursor.')
+
+
+def _after(ordering, values):
+    """Q selecting rows that come after `values` in `ordering`"""
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[f'{name}__exact'] = value
+
+    # Redundant bound on the first column so the database can start an index range scan there
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+
+def _reverse(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+def paginate(queryset, ordering, cursor=None, page_size=24):
+    """Return the KeysetPage of `queryset` in `ordering` that `cursor` points at.
+
+    `ordering` is a sequence of field or annotation names as for order_by().
+    Without a cursor the first page is returned.
+    """
+    ordering = list(ordering)
+    names = [field.lstrip('-') for field in ordering]
+
+    values, backwards = (None, False)
+    if cursor:
+        values, backwards = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor('Page cursor does not match the sort order.')
+
+    if backwards:
+        page_qs = queryset.filter(_after(_reverse(ordering), values)).order_by(*_reverse(ordering))
+    elif values is not None:
+        page_qs = queryset.filter(_after(ordering, values)).order_by(*ordering)
+    else:
+        page_qs = queryset.order_by(*ordering)
+
+    # One extra row tells whether there is anything beyond this page
+    items = list(page_qs[:page_size + 1])
+    return _page(items, names, page_size, backwards, values is not None)
+
+
+def _page(items, names, page_size, backwards, from_cursor):
+    """KeysetPage from up to page_size + 1 rows fetched in the direction of travel"""
+    more = len(items) > page_size
+    items = items[:page_size]
+    if backwards:
+        items.reverse()
+
+    if not items:
+        return KeysetPage(items)
+
+    def row_key(obj):
+        return [getattr(obj, name) for name in names]
+
+    has_next = more if not backwards else True
+    has_previous = more if backwards else from_cursor
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(row_key(items[-1])) if has_next else None,
+        previous_cursor=encode_cursor(row_key(items[0]), backwards=True) if has_previous else None,
+    )
+
+
+def _sort_value(value):
+    """Comparable number for a sort column value; cursors carry decimals and datetimes as strings"""
+    if isinstance(value, str):
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise InvalidCursor('Malformed page cursor.')
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, Decimal) and not value.is_finite():
+        raise InvalidCursor('Malformed page cursor.')
+    if not isinstance(value, (int, float, Decimal)):
+        raise InvalidCursor('Malformed page cursor.')
+    return value
+
+
+def sort_key(values, ordering):
+    """Ascending sort key for column values in `ordering` (descending columns negated)"""
+    return tuple(
+        -_sort_value(value) if field.startswith('-') else _sort_value(value)
+        for field, value in zip(ordering, values)
+    )
+
+
+def object_sort_key(obj, ordering):
+    return sort_key([getattr(obj, field.lstrip('-')) for field in ordering], ordering)
+
+
+def paginate_sorted(items, keys, ordering, cursor=None, page_size=24, predicate=None):
+    """In-memory counterpart of paginate() for a list already sorted by `ordering`.
+
+    `keys` holds object_sort_key() of every item, so a cursor is found by
+    bisection. Items failing `predicate` are skipped.
+    """
+    ordering = list(ordering)
+    names = [field.lstrip('-') for field in ordering]
+
+    backwards = False
+    start = 0
+    if cursor:
+        values, backwards = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor('Page cursor does not match the sort order.')
+        position = sort_key(values, ordering)
+        start = bisect_left(keys, position) - 1 if backwards else bisect_right(keys, position)
+
+    page = []
+    step = -1 if backwards else 1
+    index = start
+    while 0 <= index < len(items) and len(page) <= page_size:
+        if predicate is None or predicate(items[index]):
+            page.append(items[index])
+        index += step
+
+    return _page(page, names, page_size, backwards, bool(cursor))
+
+
+def queryset_source(queryset):
+    """Source for paginate_chain() reading rows from a queryset"""
+    def rows(ordering, values, backwards, limit):
+        direction = _reverse(ordering) if backwards else ordering
+        page_qs = queryset.filter(_after(direction, values)) if values is not None else queryset
+        return list(page_qs.order_by(*direction)[:limit])
+    return rows
+
+
+def paginate_chain(sources, ordering, cursor=None, page_size=24):
+    """Keyset pagination across sources whose rows follow one another in `ordering`.
+
+    Every row of a source sorts before every row of the sources after it, as
+    with a table of recent rows followed by an archive of older ones. A source
+    is a callable(ordering, values, backwards, limit) returning up to `limit`
+    rows after the cursor `values` (None at the start) in the direction of
+    travel, so a source is only read when the page reaches it.
+    """
+    ordering = list(ordering)
+    names = [field.lstrip('-') for field in ordering]
+
+    values, backwards = (None, False)
+    if cursor:
+        values, backwards = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor('Page cursor does not match the sort order.')
+
+    items = []
+    for source in (reversed(sources) if backwards else sources):
+        items += source(ordering, values, backwards, page_size + 1 - len(items))
+        if len(items) > page_size:
+            break
+    return _page(items, names, page_size, backwards, values is not None)
@@ -0,0 +1,119 @@
+"""
+Loan pricing: interest rates, risk scores and payment quotes.
+
+The rules here are shared by create_loan_request and the quote endpoint.
+The amortization factor for a (rate, term) pair is memoized: credit score
+and term bound the pairs to a few tens of thousands.
+"""
+
+from decimal import Decimal
+from functools import lru_cache
+
+BASE_RATE = Decimal('10.00')
+MIN_RATE = Decimal('5.00')
+DEFAULT_CREDIT_SCORE = 650
+
+MIN_AMOUNT = Decimal('100.00')
+MAX_AMOUNT = Decimal('50000.00')
+MIN_TERM = 1
+MAX_TERM = 60
+
+CENT = Decimal('0.01')
+
+
+@lru_cache(maxsize=65536)
+def base_interest_rate(credit_score, term_months):
+    """Interest rate from credit score and loan term"""
+    # Higher credit score = lower interest rate
+    # Longer term = higher interest rate
+
+    # Adjust for credit score: 0.02% reduction for each point above 650, up to 3%
+    credit_adjustment = min((credit_score - 650) * Decimal('0.02'), Decimal('3.00'))
+
+    # Adjust for term: 0.1% increase for each month above 12, up to 2%
+    term_adjustment = min((term_months - 12) * Decimal('0.1'), Decimal('2.00'))
+
+    interest_rate = BASE_RATE - credit_adjustment + term_adjustment
+    return max(interest_rate, MIN_RATE)  # Minimum 5% interest rate
+
+
+def adjust_interest_rate(interest_rate, borrower_verified=False, is_secured=False, loan_to_value_ratio=None):
+    """Apply the verified-borrower and secured-loan discounts to a rate"""
+    # Adjust interest rate if borrower is verified
+    if borrower_verified:
+        interest_rate = max(interest_rate - Decimal('1.5'), MIN_RATE)
+
+    # Adjust interest rate for secured loans
+    if is_secured and loan_to_value_ratio is not None and loan_to_value_ratio < Decimal('0.8'):
+        interest_rate = max(interest_rate - Decimal('1.0'), MIN_RATE)
+
+    return interest_rate
+
+
+def calculate_risk_score(credit_score):
+    """Risk score on a 1-10 scale, 10 being highest risk"""
+    return 10 - int(min(credit_score / 80, 10))
+
+
+@lru_cache(maxsize=65536)
+def amortization_factor(interest_rate, term_months):
+    """r(1+r)^n / ((1+r)^n - 1) for an annual rate in percent; multiply by the principal for the payment"""
+    r = interest_rate / Decimal('100') / 12  # Monthly interest rate
+    n = term_months  # Number of payments
+
+    if r == 0:
+        return Decimal('1') / n
+
+    numerator = r * (1 + r) ** n
+    denominator = (1 + r) ** n - 1
+
+    return numerator / denominator
+
+
+def payment_terms(amount, interest_rate, term_months):
+    """Monthly payment and total repayment, in cents, of a loan at `interest_rate`"""
+    monthly_payment = (amount * amortization_factor(interest_rate, term_months)).quantize(CENT)
+    return monthly_payment, (monthly_payment * term_months).quantize(CENT)
+
+
+def quote_loan(amount, term_months, credit_score=DEFAULT_CREDIT_SCORE, borrower_verified=False,
+               is_secured=False, collateral_value=None):
+    """Price a hypothetical loan without saving anything.
+
+    Raises ValueError when the amount or term is outside what the platform offers,
+    or when a secured loan's collateral value is not positive.
+    """
+    amount = Decimal(str(amount))
+    term_months = int(term_months)
+    credit_score = int(credit_score)
+
+    if not MIN_AMOUNT <= amount <= MAX_AMOUNT:
+        raise ValueError(f'Loan amount must be between R{MIN_AMOUNT} and R{MAX_AMOUNT}.')
+    if not MIN_TERM <= term_months <= MAX_TERM:
+        raise ValueError(f'Loan term must be between {MIN_TERM} and {MAX_TERM} months.')
+
+    loan_to_value_ratio = None
+    if is_secured and collateral_value is not None:
+        collateral_value = Decimal(str(collateral_value))
+        if collateral_value <= 0:
+            raise ValueError('Collateral value must be greater than zero.')
+        loan_to_value_ratio = amount / collateral_value
+
+    interest_rate = adjust_interest_rate(
+        base_interest_rate(credit_score, term_months),
+        borrower_verified=borrower_verified,
+        is_secured=is_secured,
+        loan_to_value_ratio=loan_to_value_ratio
+    )
+
+    monthly_payment, total_repayment = payment_terms(amount, interest_rate, term_months)
+
+    return {
+        'amount': amount,
+        'term_months': term_months,
+        'interest_rate': interest_rate,
+        'monthly_payment': monthly_payment,
+        'total_repayment': total_repayment,
+        'total_interest': total_repayment - amount,
+        'risk_score': calculate_risk_score(credit_score),
+    }
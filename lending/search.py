@@ -0,0 +1,168 @@
+"""
+Full-text search over loan title, description, purpose and purpose description.
+
+On SQLite the text is indexed in an FTS5 external-content table
+(lending_loan_fts) that triggers on lending_loan keep in sync. On PostgreSQL
+a GIN index covers the same tsvector expression the search query builds.
+Any other database falls back to icontains filters.
+"""
+
+import re
+from django.db import connections
+from django.db.models import F, Q
+
+SEARCH_FIELDS = ('title', 'description', 'purpose', 'purpose_description')
+
+SQLITE_FTS_TABLE = 'lending_loan_fts'
+
+# bm25 column weights (title, description, purpose, purpose_description)
+SQLITE_RANK = 'bm25(10.0, 1.0, 2.0, 2.0)'
+
+POSTGRES_CONFIG = 'english'
+POSTGRES_INDEX = 'lending_loan_search_gin'
+
+# Longest query (in words) that is passed to the index
+MAX_SEARCH_TERMS = 10
+
+SQLITE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS lending_loan_fts_insert AFTER INSERT ON lending_loan BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description, purpose, purpose_description)
+        VALUES (new.id, new.title, new.description, new.purpose, new.purpose_description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS lending_loan_fts_delete AFTER DELETE ON lending_loan BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description, purpose, purpose_description)
+        VALUES ('delete', old.id, old.title, old.description, old.purpose, old.purpose_description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS lending_loan_fts_update
+    AFTER UPDATE OF title, description, purpose, purpose_description ON lending_loan BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description, purpose, purpose_description)
+        VALUES ('delete', old.id, old.title, old.description, old.purpose, old.purpose_description);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description, purpose, purpose_description)
+        VALUES (new.id, new.title, new.description, new.purpose, new.purpose_description);
+    END
+    """,
+)
+
+# Database aliases known to have the FTS table
+_sqlite_installed_aliases = set()
+
+
+def search_terms(query):
+    """Split a user query into lower-case word tokens"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_SEARCH_TERMS]
+
+
+def postgres_search_vector():
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector(*SEARCH_FIELDS, config=POSTGRES_CONFIG)
+
+
+def sqlite_search_installed(connection):
+    if connection.alias not in _sqlite_installed_aliases:
+        if SQLITE_FTS_TABLE not in connection.introspection.table_names():
+            return False
+        _sqlite_installed_aliases.add(connection.alias)
+    return True
+
+
+def install_sqlite_triggers(connection):
+    """Create the sync triggers if they are missing.
+
+    SQLite drops triggers whenever Django rebuilds lending_loan during a
+    schema migration, so this also runs after every migrate.
+    """
+    with connection.cursor() as cursor:
+        for trigger in SQLITE_TRIGGERS:
+            cursor.execute(trigger)
+
+
+def rebuild_sqlite_index(connection):
+    """Re-read every loan into the FTS index"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def install_search_index(schema_editor, loan_model):
+    """Create the full-text index for the schema editor's database and fill it"""
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+            f"title, description, purpose, purpose_description, "
+            f"content='lending_loan', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rank) VALUES ('rank', %s)", [SQLITE_RANK])
+        install_sqlite_triggers(connection)
+        rebuild_sqlite_index(connection)
+
+    elif connection.vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        schema_editor.add_index(loan_model, GinIndex(postgres_search_vector(), name=POSTGRES_INDEX))
+
+
+def uninstall_search_index(schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        for trigger in ('lending_loan_fts_insert', 'lending_loan_fts_delete', 'lending_loan_fts_update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+        _sqlite_installed_aliases.discard(connection.alias)
+
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_INDEX}')
+
+
+def ensure_search_index(sender, using='default', **kwargs):
+    """post_migrate handler restoring the SQLite sync triggers"""
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and sqlite_search_installed(connection):
+        install_sqlite_triggers(connection)
+
+
+def search_loans(queryset, query):
+    """Filter a Loan queryset to matches for `query`, best matches first.
+
+    Every word is matched as a prefix, so "edu" finds "education". Matching
+    loans are annotated with `search_rank`.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'sqlite' and sqlite_search_installed(connection):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(
+            search_index__document__match=match
+        ).annotate(
+            search_rank=F('search_index__rank')
+        ).order_by('search_rank')
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms), search_type='raw', config=POSTGRES_CONFIG)
+        vector = postgres_search_vector()
+        return queryset.annotate(
+            search_document=vector,
+            search_rank=SearchRank(vector, search_query)
+        ).filter(search_document=search_query).order_by('-search_rank')
+
+    # No index available: plain substring match on every term
+    for term in terms:
+        queryset = queryset.filter(
+            Q(title__icontains=term) |
+            Q(description__icontains=term) |
+            Q(purpose__icontains=term) |
+            Q(purpose_description__icontains=term)
+        )
+    return queryset
@@ -1,3 +1,433 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from accounts.models import InvestorProfile, Transaction, UserProfile, WalletDailySummary
+from . import detail_cache, live, orderbook, pricing
+from .admin import LoanAdmin
+from .autoinvest import auto_invest
+from .pagination import paginate, paginate_sorted
+from .models import (AutoInvestRule, Investment, Loan, LoanPayment, apportion, create_loan_request, invest_in_loan,
+                     process_loan_repayment, refund_investment)
 
-# Create your tests here.
+
+class CreateLoanViewTests(TestCase):
+    def setUp(self):
+        self.borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=self.borrower, user_type='borrower')
+        self.client.force_login(self.borrower)
+
+    def test_get_renders_form(self):
+        response = self.client.get(reverse('lending:create_loan'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'lending/create_loan.html')
+
+    def test_invalid_post_renders_form(self):
+        response = self.client.post(reverse('lending:create_loan'), {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'lending/create_loan.html')
+
+    def test_valid_post_creates_loan(self):
+        response = self.client.post(reverse('lending:create_loan'), {
+            'title': 'New roof', 'description': 'Replacing the roof', 'amount': '10000', 'term_months': '24',
+            'purpose': 'personal', 'purpose_description': 'Roofing', 'is_secured': 'on',
+            'collateral_description': 'Car', 'collateral_value': '20000',
+            'monthly_income': '30000', 'monthly_debt_payments': '6000',
+        })
+
+        loan = Loan.objects.get(borrower=self.borrower)
+        self.assertRedirects(response, reverse('lending:loan_detail', args=[loan.pk]), fetch_redirect_response=False)
+        self.assertEqual((loan.purpose_description, loan.is_secured, loan.collateral_value),
+                         ('Roofing', True, Decimal('20000.00')))
+        self.assertEqual(loan.loan_to_value_ratio, Decimal('0.50'))
+        self.assertEqual(loan.debt_to_income_ratio, Decimal('0.20'))
+
+    def test_loan_is_announced_once_with_its_final_rate(self):
+        book_version = orderbook.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = create_loan_request(self.borrower, 'Test loan', 'A loan', Decimal('10000'), 24,
+                                       borrower_verified=True, is_secured=True, collateral_value=Decimal('20000'))
+
+        self.assertEqual(orderbook.current_version(), book_version + 1)
+        self.assertEqual(orderbook._load([loan.pk])[loan.pk].interest_rate, loan.interest_rate)
+        base_rate = pricing.base_interest_rate(self.borrower.profile.borrower_profile.credit_score, 24)
+        self.assertEqual(loan.interest_rate, base_rate - Decimal('2.5'))
+
+    def test_stored_loan_matches_quote(self):
+        profile = self.borrower.profile.borrower_profile
+        profile.verification_status = 'verified'
+        profile.save()
+        quote = self.client.get(reverse('lending:loan_quote'), {
+            'amount': '10000', 'term_months': '24', 'is_secured': 'true', 'collateral_value': '20000',
+        }).json()
+
+        self.client.post(reverse('lending:create_loan'), {
+            'title': 'New roof', 'description': 'Replacing the roof', 'amount': '10000', 'term_months': '24',
+            'purpose': 'personal', 'is_secured': 'on', 'collateral_description': 'Car', 'collateral_value': '20000',
+            'monthly_income': '30000', 'monthly_debt_payments': '6000',
+        })
+
+        loan = Loan.objects.get(borrower=self.borrower)
+        self.assertEqual(
+            (loan.interest_rate, loan.monthly_payment, loan.total_repayment),
+            (Decimal(quote['interest_rate']), Decimal(quote['monthly_payment']), Decimal(quote['total_repayment'])),
+        )
+
+
+class LoanDetailViewTests(TestCase):
+    def setUp(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        self.loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        self.investor = User.objects.create_user('investor', password='password')
+        UserProfile.objects.create(user=self.investor, user_type='investor')
+        self.url = reverse('lending:loan_detail', args=[self.loan.pk])
+
+    def test_anonymous_conditional_get_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_signed_in_page_shows_current_balance(self):
+        self.client.force_login(self.investor)
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('ETag'))
+
+        self.investor.wallet.deposit_funds(Decimal('250.00'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '250.00')
+
+    def test_live_updates_off_by_default(self):
+        stream_url = reverse('lending:loan_funding_stream', args=[self.loan.pk])
+        self.assertNotContains(self.client.get(self.url), stream_url)
+        # 204 tells EventSource not to reconnect
+        self.assertEqual(self.client.get(stream_url).status_code, 204)
+
+    @override_settings(LIVE_UPDATES=True)
+    def test_live_updates_on(self):
+        stream_url = reverse('lending:loan_funding_stream', args=[self.loan.pk])
+        self.assertContains(self.client.get(self.url), stream_url)
+
+
+class ApproveLoanTests(TestCase):
+    def test_approving_fully_funded_loan_closes_funding(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        investor = User.objects.create_user('investor', password='password')
+        UserProfile.objects.create(user=investor, user_type='investor')
+        loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        Investment.objects.create(investor=investor, loan=loan, amount=Decimal('1000'))
+        Loan.objects.filter(pk=loan.pk).update(funded_amount=Decimal('1000'), investor_count=1)
+
+        self.client.force_login(admin_user)
+        self.client.get(reverse('admin:approve_loan', args=[loan.pk]))
+
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'funded')
+        self.assertEqual(loan.payments.count(), 12)
+        self.assertEqual(loan.shares.count(), 1)
+
+    def test_approving_keeps_concurrent_funding(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        self.client.force_login(admin_user)
+
+        # The admin loads the loan, then an investment lands before it saves
+        original_get_object = LoanAdmin.get_object
+        def get_object(admin, request, object_id, from_field=None):
+            stale = original_get_object(admin, request, object_id, from_field)
+            Loan.objects.filter(pk=loan.pk).update(funded_amount=Decimal('300.00'), investor_count=1)
+            return stale
+        with mock.patch.object(LoanAdmin, 'get_object', get_object):
+            self.client.get(reverse('admin:approve_loan', args=[loan.pk]))
+
+        loan.refresh_from_db()
+        self.assertEqual((loan.status, loan.funded_amount, loan.investor_count), ('active', Decimal('300.00'), 1))
+
+
+class InvestInLoanTests(TestCase):
+    def test_records_investment_transaction(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        investor = User.objects.create_user('investor', password='password')
+        UserProfile.objects.create(user=investor, user_type='investor')
+        investor.wallet.deposit_funds(Decimal('500.00'))
+        loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+
+        result = invest_in_loan(investor, loan, Decimal('200.00'))
+
+        self.assertTrue(result['success'])
+        entry = investor.wallet.transactions.latest('timestamp')
+        investment = Investment.objects.get(investor=investor, loan=loan)
+        self.assertEqual(entry.transaction_type, 'investment')
+        self.assertEqual((entry.related_entity_type, entry.related_entity_id), ('investment', investment.pk))
+        self.assertEqual(entry.balance_after, Decimal('300.00'))
+        summary = WalletDailySummary.objects.get(wallet=investor.wallet)
+        self.assertEqual((summary.investment_count, summary.withdrawal_count), (1, 0))
+
+
+class InvestBasketViewTests(TestCase):
+    def setUp(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        self.loans = [create_loan_request(borrower, f'Loan {index}', 'A loan', Decimal('1000'), 12)
+                      for index in range(2)]
+        self.url = reverse('lending:invest_basket')
+
+    def post(self, lines):
+        return self.client.post(self.url, json.dumps({'lines': lines}), content_type='application/json')
+
+    def test_anonymous_is_sent_to_login(self):
+        response = self.post([{'loan': self.loans[0].pk, 'amount': '50'}])
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Investment.objects.exists())
+
+    def test_user_without_profile_is_refused(self):
+        self.client.force_login(User.objects.create_user('someone', password='password'))
+        self.assertEqual(self.post([{'loan': self.loans[0].pk, 'amount': '50'}]).status_code, 403)
+
+    def test_investor_invests_in_every_line(self):
+        investor = User.objects.create_user('investor', password='password')
+        UserProfile.objects.create(user=investor, user_type='investor')
+        investor.wallet.deposit_funds(Decimal('500.00'))
+        self.client.force_login(investor)
+
+        response = self.post([{'loan': loan.pk, 'amount': '50'} for loan in self.loans])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Investment.objects.filter(investor=investor).count(), 2)
+
+
+class LoanQuoteViewTests(TestCase):
+    def test_zero_collateral_is_rejected(self):
+        response = self.client.get(reverse('lending:loan_quote'), {
+            'amount': '10000', 'term_months': '12', 'is_secured': 'true', 'collateral_value': '0',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Collateral value must be greater than zero.'})
+
+    def test_secured_quote(self):
+        response = self.client.get(reverse('lending:loan_quote'), {
+            'amount': '10000', 'term_months': '12', 'is_secured': 'true', 'collateral_value': '20000',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('monthly_payment', response.json())
+
+
+class AutoInvestTests(TestCase):
+    def setUp(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        self.loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        self.investors = []
+        for index in range(2):
+            investor = User.objects.create_user(f'investor{index}', password='password')
+            UserProfile.objects.create(user=investor, user_type='investor')
+            investor.wallet.deposit_funds(Decimal('500.00'))
+            AutoInvestRule.objects.create(investor=investor, name='Any loan', amount_per_loan=Decimal('100.00'),
+                                          max_exposure=Decimal('1000.00'))
+            self.investors.append(investor)
+
+    def test_invests_for_each_rule_owner_once(self):
+        invest_in_loan(self.investors[0], self.loan, Decimal('50.00'))
+
+        investments = auto_invest(self.loan)
+
+        self.assertEqual([investment.investor_id for investment in investments], [self.investors[1].pk])
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.funded_amount, Decimal('150.00'))
+        self.assertEqual(self.investors[1].wallet.transactions.filter(transaction_type='investment').count(), 1)
+
+
+class RefundInvestmentTests(TestCase):
+    def setUp(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        self.investor = User.objects.create_user('investor', password='password')
+        UserProfile.objects.create(user=self.investor, user_type='investor')
+        self.investor.wallet.deposit_funds(Decimal('500.00'))
+        self.loan = create_loan_request(borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        invest_in_loan(self.investor, self.loan, Decimal('200.00'))
+        self.investment = Investment.objects.get(investor=self.investor, loan=self.loan)
+
+    def test_refund_restores_wallet_and_totals(self):
+        result = refund_investment(self.investment)
+
+        self.assertTrue(result['success'])
+        self.investor.wallet.refresh_from_db()
+        self.assertEqual(self.investor.wallet.balance, Decimal('500.00'))
+        self.assertEqual(InvestorProfile.objects.get(user_profile__user=self.investor).total_invested, Decimal('0.00'))
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.funded_amount, self.loan.investor_count), (Decimal('0.00'), 0))
+
+    def assert_loan_announced(self, remove):
+        book_version = orderbook.current_version()
+        page_version = detail_cache.loan_version(self.loan.pk)
+        with mock.patch.object(live.publisher, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                remove()
+
+        self.assertEqual(orderbook.current_version(), book_version + 1)
+        self.assertNotEqual(detail_cache.loan_version(self.loan.pk), page_version)
+        update = publish.call_args.args[0]
+        self.assertEqual((update['loan_id'], update['funded_amount']), (self.loan.pk, '0.00'))
+
+    def test_refund_announces_loan_change(self):
+        self.assert_loan_announced(lambda: refund_investment(self.investment))
+
+    def test_deleting_investment_announces_loan_change(self):
+        self.assert_loan_announced(self.investment.delete)
+
+
+class ApportionTests(TestCase):
+    def test_parts_add_up_to_total(self):
+        parts = apportion(Decimal('10.00'), [Decimal('0.333333')] * 3)
+
+        self.assertEqual(parts, [Decimal('3.34'), Decimal('3.33'), Decimal('3.33')])
+        self.assertEqual(sum(parts), Decimal('10.00'))
+
+    def test_leftover_cents_go_to_largest_remainders(self):
+        weights = [Decimal('0.2'), Decimal('0.3'), Decimal('0.5')]
+
+        self.assertEqual(apportion(Decimal('0.07'), weights), [Decimal('0.01'), Decimal('0.02'), Decimal('0.04')])
+
+    def test_tied_remainders_go_to_earlier_parts(self):
+        weights = [Decimal('0.333333')] * 3
+
+        self.assertEqual(apportion(Decimal('0.01'), weights), [Decimal('0.01'), Decimal('0.00'), Decimal('0.00')])
+        self.assertEqual(apportion(Decimal('0.02'), weights), [Decimal('0.01'), Decimal('0.01'), Decimal('0.00')])
+
+    def test_single_part_takes_total(self):
+        self.assertEqual(apportion(Decimal('12.34'), [Decimal('1')]), [Decimal('12.34')])
+
+
+class DistributeRepaymentTests(TestCase):
+    def setUp(self):
+        self.borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=self.borrower, user_type='borrower')
+        self.borrower.wallet.deposit_funds(Decimal('1000.00'))
+        self.platform = User.objects.create_user('platform', password='password')
+
+    def fund_loan(self, *stakes):
+        loan = create_loan_request(self.borrower, 'Test loan', 'A loan', sum(stakes), 12)
+        for number, stake in enumerate(stakes):
+            investor = User.objects.create_user(f'investor{number}', password='password')
+            UserProfile.objects.create(user=investor, user_type='investor')
+            investor.wallet.deposit_funds(stake)
+            invest_in_loan(investor, loan, stake)
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'funded')
+        return loan
+
+    def repay(self, loan):
+        payment = LoanPayment.objects.get(loan=loan, payment_number=1)
+        result = process_loan_repayment(loan, payment.amount_due)
+        self.assertTrue(result['success'])
+        credits = {
+            row.wallet.user.username: row.amount
+            for row in Transaction.objects.filter(transaction_type='return').select_related('wallet__user')
+        }
+        earnings = {
+            profile.user_profile.user.username: profile.total_earnings
+            for profile in InvestorProfile.objects.select_related('user_profile__user')
+        }
+        self.platform.wallet.refresh_from_db()
+        return payment, credits, earnings, self.platform.wallet.balance
+
+    def test_credits_add_up_to_distributable_amount(self):
+        loan = self.fund_loan(Decimal('100.00'), Decimal('100.00'), Decimal('100.00'))
+
+        payment, credits, earnings, fee = self.repay(loan)
+
+        self.assertEqual(fee, (payment.interest * Decimal('0.02')).quantize(Decimal('0.01')))
+        self.assertEqual(sum(credits.values()), payment.amount_due - fee)
+        self.assertEqual(sum(credits.values()) + fee, payment.amount_due)
+        self.assertEqual(sum(earnings.values()), payment.interest)
+        self.assertLessEqual(max(credits.values()) - min(credits.values()), Decimal('0.01'))
+
+    def test_tied_positions_take_leftover_cents_in_investor_order(self):
+        loan = self.fund_loan(Decimal('100.00'), Decimal('100.00'), Decimal('100.00'))
+
+        payment, credits, earnings, fee = self.repay(loan)
+
+        amounts = [credits[f'investor{number}'] for number in range(3)]
+        self.assertEqual(amounts, sorted(amounts, reverse=True))
+
+    def test_single_investor_receives_whole_payment(self):
+        loan = self.fund_loan(Decimal('300.00'))
+
+        payment, credits, earnings, fee = self.repay(loan)
+
+        self.assertEqual(credits, {'investor0': payment.amount_due - fee})
+        self.assertEqual(earnings, {'investor0': payment.interest})
+
+
+class KeysetPaginationTests(TestCase):
+    ORDERINGS = [('-amount', '-id'), ('-interest_rate', '-id'), ('term_months', 'id')]
+
+    def setUp(self):
+        borrower = User.objects.create_user('borrower', password='password')
+        UserProfile.objects.create(user=borrower, user_type='borrower')
+        # Ties on every sort column but id
+        for amount, term in [(1000, 12), (1000, 12), (1000, 24), (2000, 12), (2000, 24),
+                             (500, 12), (500, 36), (1000, 36)]:
+            create_loan_request(borrower, 'Test loan', 'A loan', Decimal(amount), term)
+
+    def walk(self, load_page):
+        """Pages of ids forward to the end, then back to the start"""
+        forward = [load_page(None)]
+        while forward[-1].has_next:
+            forward.append(load_page(forward[-1].next_cursor))
+        backward = [forward[-1]]
+        while backward[-1].has_previous:
+            backward.append(load_page(backward[-1].previous_cursor))
+        return ([[loan.pk for loan in page] for page in forward],
+                [[loan.pk for loan in page] for page in reversed(backward)])
+
+    def expected(self, ordering):
+        ids = list(Loan.objects.order_by(*ordering).values_list('pk', flat=True))
+        return [ids[start:start + 3] for start in range(0, len(ids), 3)]
+
+    def test_paginate_walks_across_ties(self):
+        for ordering in self.ORDERINGS:
+            loans = Loan.objects.filter(status='pending').for_marketplace()
+            forward, backward = self.walk(lambda cursor: paginate(loans, ordering, cursor, 3))
+
+            self.assertEqual(forward, self.expected(ordering))
+            self.assertEqual(backward, forward)
+
+    def test_paginate_sorted_walks_across_ties(self):
+        snapshot = orderbook.Snapshot(0, orderbook._load())
+        for ordering in self.ORDERINGS:
+            keys, items = snapshot.sorted(ordering)
+            forward, backward = self.walk(lambda cursor: paginate_sorted(items, keys, ordering, cursor, 3))
+
+            self.assertEqual(forward, self.expected(ordering))
+            self.assertEqual(backward, forward)
+
+    def test_replaced_snapshot_matches_fresh_load(self):
+        snapshot = orderbook.Snapshot(0, orderbook._load())
+        for ordering in self.ORDERINGS:
+            snapshot.sorted(ordering)
+        loans = list(Loan.objects.order_by('pk'))
+        # A loan moves to another place, one leaves the book and one joins it
+        Loan.objects.filter(pk=loans[0].pk).update(amount=Decimal('500'), term_months=36, interest_rate=Decimal('20'))
+        Loan.objects.filter(pk=loans[3].pk).update(status='active')
+        added = create_loan_request(loans[0].borrower, 'Test loan', 'A loan', Decimal('1000'), 12)
+        changed = {loans[0].pk, loans[3].pk, added.pk}
+
+        replaced = snapshot.replace(1, changed, orderbook._load(changed))
+        fresh = orderbook.Snapshot(1, orderbook._load())
+
+        self.assertEqual(set(replaced.loans), set(fresh.loans))
+        for ordering in self.ORDERINGS:
+            keys, items = replaced.sorted(ordering)
+            fresh_keys, fresh_items = fresh.sorted(ordering)
+            self.assertEqual(keys, fresh_keys)
+            self.assertEqual([loan.pk for loan in items], [loan.pk for loan in fresh_items])
@@ -6,17 +6,28 @@ app_name = 'lending'
 urlpatterns = [
     # Marketplace
     path('marketplace/', views.marketplace, name='marketplace'),
+    path('marketplace/stream/', views.marketplace_stream, name='marketplace_stream'),
     path('loan/<int:loan_id>/', views.loan_detail, name='loan_detail'),
+    path('loan/<int:loan_id>/stream/', views.loan_funding_stream, name='loan_funding_stream'),
     
     # Create Loan
     path('create-loan/', views.create_loan, name='create_loan'),
+    path('quote/', views.loan_quote, name='loan_quote'),
     
     # Investments
     path('loan/<int:loan_id>/invest/', views.invest, name='invest'),
+    path('invest/basket/', views.invest_basket, name='invest_basket'),
     path('my-investments/', views.my_investments, name='my_investments'),
+    path('my-investments/export/<str:fmt>/', views.export_investments, name='export_investments'),
+    path('my-investments/payouts/export/<str:fmt>/', views.export_payouts, name='export_payouts'),
     path('my-loans/', views.my_loans, name='my_loans'),
     path('portfolio-analysis/', views.portfolio_analysis, name='portfolio_analysis'),
     
+    # Auto-invest
+    path('auto-invest/', views.auto_invest_rules, name='auto_invest_rules'),
+    path('auto-invest/<int:rule_id>/toggle/', views.toggle_auto_invest_rule, name='toggle_auto_invest_rule'),
+    path('auto-invest/<int:rule_id>/delete/', views.delete_auto_invest_rule, name='delete_auto_invest_rule'),
+    
     # Repayments
     path('loan/<int:loan_id>/repay/', views.repay_loan, name='repay_loan'),
 ]
\ No newline at end of file
@@ -2,94 +2,140 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Q, Sum, F
-from .models import Loan, Investment, LoanPayment, PortfolioAnalysis, create_loan_request, invest_in_loan, process_loan_repayment
-from .forms import LoanRequestForm, InvestmentForm, LoanRepaymentForm
-from decimal import Decimal
+from django.db.models import Q, Sum, Count, F
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+from .models import Loan, Investment, LoanPayment, PortfolioAnalysis, AutoInvestRule, create_loan_request, invest_in_basket, invest_in_loan, process_loan_repayment
+from .forms import LoanRequestForm, InvestmentForm, LoanRepaymentForm, AutoInvestRuleForm
+from . import autoinvest, exports, live, pricing
+from accounts import exports as export_formats
+from accounts.models import UserProfile
+from .search import search_loans
+from .pagination import paginate, InvalidCursor
+from .facets import normalize_filters, filter_conditions, marketplace_facets
+from .orderbook import marketplace_page
+from .detail_cache import FRAGMENT_TIMEOUT, loan_detail_etag, loan_version
+from decimal import Decimal, InvalidOperation
+import json
+
+# Largest number of quotes accepted in one request to the quote endpoint
+MAX_QUOTE_BATCH = 5000
+
+# Largest number of loans in one basket investment
+MAX_BASKET_LINES = 1000
+
+MARKETPLACE_PAGE_SIZE = 24
+
+# Marketplace sort options: keyset orderings ending in a unique column
+MARKETPLACE_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'rate': ('-interest_rate', '-id'),
+    'funding': ('-funding_progress', '-id'),
+    'amount': ('-amount', '-id'),
+    'term': ('term_months', 'id'),
+}
+
+# Rows per page of the investor's and borrower's history lists
+HISTORY_PAGE_SIZE = 20
+
+# Keyset orderings of the history lists, served by the (user, date, id) indexes
+HISTORY_ORDERING = {
+    'investments': ('-date_invested', '-id'),
+    'loans': ('-created_at', '-id'),
+}
+
+def section_page(request, queryset, ordering, cursor_param):
+    """Page of one list on a page with several, and the query string its links keep"""
+    try:
+        page = paginate(queryset, ordering, request.GET.get(cursor_param), HISTORY_PAGE_SIZE)
+    except InvalidCursor:
+        page = paginate(queryset, ordering, None, HISTORY_PAGE_SIZE)
+    
+    # The other lists stay on their pages
+    query = request.GET.copy()
+    query.pop(cursor_param, None)
+    return page, query.urlencode()
 
 def marketplace(request):
     """Display all pending loans for investment"""
-    # Get all pending loans
-    pending_loans = Loan.objects.filter(status='pending')
+    # Get all pending loans (card columns only)
+    pending_loans = Loan.objects.filter(status='pending').for_marketplace()
     
-    # Filter loans by search query if provided
+    # Search query, amount and rate ranges, term and risk level (invalid values are ignored)
+    filters = normalize_filters(request.GET)
     query = request.GET.get('q')
+    
+    # Filter loans by search query if provided (ranked full-text match)
     if query:
-        pending_loans = pending_loans.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(purpose__icontains=query)
-        )
+        pending_loans = search_loans(pending_loans, query)
+    
+    pending_loans = pending_loans.filter(*filter_conditions(filters).values())
     
-    # Filter by amount range if provided
-    min_amount = request.GET.get('min_amount')
-    max_amount = request.GET.get('max_amount')
-    
-    if min_amount:
-        pending_loans = pending_loans.filter(amount__gte=Decimal(min_amount))
-    
-    if max_amount:
-        pending_loans = pending_loans.filter(amount__lte=Decimal(max_amount))
-    
-    # Filter by interest rate if provided
-    min_rate = request.GET.get('min_rate')
-    max_rate = request.GET.get('max_rate')
-    
-    if min_rate:
-        pending_loans = pending_loans.filter(interest_rate__gte=Decimal(min_rate))
-    
-    if max_rate:
-        pending_loans = pending_loans.filter(interest_rate__lte=Decimal(max_rate))
-    
-    # Filter by term if provided
-    term = request.GET.get('term')
-    if term:
-        if term == 'short':
-            pending_loans = pending_loans.filter(term_months__lte=12)
-        elif term == 'medium':
-            pending_loans = pending_loans.filter(term_months__gt=12, term_months__lte=36)
-        elif term == 'long':
-            pending_loans = pending_loans.filter(term_months__gt=36)
-    
-    # Filter by risk score if provided
-    risk = request.GET.get('risk')
-    if risk:
-        if risk == 'low':
-            pending_loans = pending_loans.filter(risk_score__lte=3)
-        elif risk == 'medium':
-            pending_loans = pending_loans.filter(risk_score__gt=3, risk_score__lte=7)
-        elif risk == 'high':
-            pending_loans = pending_loans.filter(risk_score__gt=7)
+    # Bucket counts for the filter form, one cached aggregate query
+    facets = marketplace_facets(Loan.objects.filter(status='pending'), filters)
+    
+    # Search results default to relevance, kept in the rank order search_loans applied
+    sort = request.GET.get('sort')
+    searching = 'search_rank' in pending_loans.query.annotations
+    if sort not in MARKETPLACE_SORTS and not (sort == 'relevance' and searching):
+        sort = 'relevance' if searching else 'newest'
+    
+    if sort == 'relevance':
+        ordering = (*pending_loans.query.order_by, 'id')
+    else:
+        ordering = MARKETPLACE_SORTS[sort]
+    
+    def load_page(cursor):
+        if filters['q']:
+            return paginate(pending_loans, ordering, cursor, MARKETPLACE_PAGE_SIZE)
+        # Without a search the page comes from the in-memory order book
+        return marketplace_page(filters, ordering, cursor, MARKETPLACE_PAGE_SIZE)
+    
+    try:
+        page = load_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = load_page(None)
+    
+    # Filters and sort carried over to the next/previous page links
+    page_query = request.GET.copy()
+    page_query.pop('cursor', None)
+    page_query['sort'] = sort
     
     context = {
-        'loans': pending_loans,
+        'loans': page.items,
+        'page': page,
+        'page_query': page_query.urlencode(),
+        'sort': sort,
+        'searching': searching,
+        'facets': facets,
         'query': query,
-        'min_amount': min_amount,
-        'max_amount': max_amount,
-        'min_rate': min_rate,
-        'max_rate': max_rate,
-        'term': term,
-        'risk': risk,
+        'min_amount': filters['min_amount'],
+        'max_amount': filters['max_amount'],
+        'min_rate': filters['min_rate'],
+        'max_rate': filters['max_rate'],
+        'term': filters['term'],
+        'risk': filters['risk'],
+        'live_updates': live.enabled(),
     }
     
     return render(request, 'lending/marketplace.html', context)
 
+async def marketplace_stream(request):
+    """Server-sent funding updates for every loan"""
+    if not live.enabled():
+        return live.disabled_response()
+    return live.stream_response(live.publisher.subscribe(live.MARKETPLACE_TOPIC))
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=loan_detail_etag)
 def loan_detail(request, loan_id):
     """Display detailed information about a loan"""
     loan = get_object_or_404(Loan, id=loan_id)
     
-    # Get investments for this loan
-    investments = Investment.objects.filter(loan=loan)
-    
-    # Get payment schedule if loan is funded or active
-    payment_schedule = None
-    if loan.status in ['funded', 'active', 'repaid']:
-        payment_schedule = loan.generate_repayment_schedule()
-    
-    # Check if current user has already invested in this loan
-    user_investment = None
-    if request.user.is_authenticated:
-        user_investment = Investment.objects.filter(loan=loan, investor=request.user).first()
+    # Only evaluated by the template when the shared fragments are not cached
+    investments = Investment.objects.filter(loan=loan).select_related('investor', 'loan')
     
     # Prepare investment form for authenticated investors
     investment_form = None
@@ -105,14 +151,29 @@ def loan_detail(request, loan_id):
     context = {
         'loan': loan,
         'investments': investments,
-        'payment_schedule': payment_schedule,
-        'user_investment': user_investment,
         'investment_form': investment_form,
         'can_invest': can_invest,
+        'cache_version': loan_version(loan.pk),
+        'fragment_timeout': FRAGMENT_TIMEOUT,
+        'live_updates': live.enabled(),
     }
     
     return render(request, 'lending/loan_detail.html', context)
 
+async def loan_funding_stream(request, loan_id):
+    """Server-sent funding updates for one loan, starting with its current state"""
+    if not live.enabled():
+        return live.disabled_response()
+    # Subscribe before reading the loan so no update falls in between
+    subscription = live.publisher.subscribe(live.loan_topic(loan_id))
+    loan = await Loan.objects.filter(pk=loan_id).only(
+        'status', 'amount', 'funded_amount', 'investor_count').afirst()
+    if loan is None:
+        live.publisher.unsubscribe(subscription)
+        raise Http404('Loan not found')
+    
+    return live.stream_response(subscription, [live.funding_update(loan)])
+
 @login_required
 def create_loan(request):
     """Create a new loan request"""
@@ -132,6 +193,7 @@ def create_loan(request):
         # Check if the borrower is verified
         borrower_verified = borrower_profile.verification_status == 'verified'
     except:
+        borrower_profile = None
         borrower_verified = False
     
     if request.method == 'POST':
@@ -163,53 +225,27 @@ def create_loan(request):
             previous_loans_count = Loan.objects.filter(borrower=request.user).count()
             previous_loans_repaid = Loan.objects.filter(borrower=request.user, status='repaid').count()
             
-            # Create loan request
+            # Create loan request, priced with the verified-borrower and secured-loan discounts
             loan = create_loan_request(
                 borrower=request.user,
                 title=title,
                 description=description,
                 amount=amount,
                 term_months=term_months,
-                purpose=purpose
+                purpose=purpose,
+                borrower_verified=borrower_verified,
+                is_secured=is_secured,
+                collateral_value=collateral_value,
+                collateral_description=collateral_description if is_secured else '',
+                purpose_description=purpose_description,
+                debt_to_income_ratio=debt_to_income_ratio,
+                income_verified=getattr(borrower_profile, 'income_verified', False),
+                previous_loans_count=previous_loans_count,
+                previous_loans_repaid=previous_loans_repaid,
             )
             
-            # Update additional loan details
-            loan.purpose_description = purpose_description
-            loan.debt_to_income_ratio = debt_to_income_ratio
-            
-            # Set verification status
-            loan.borrower_verified = borrower_verified
-            
-            if hasattr(borrower_profile, 'identity_verified'):
-                loan.identity_verified = borrower_profile.identity_verified
-            
-            if hasattr(borrower_profile, 'income_verified'):
-                loan.income_verified = borrower_profile.income_verified
-            
-            # Update loan history
-            loan.previous_loans_count = previous_loans_count
-            loan.previous_loans_repaid = previous_loans_repaid
-            
-            # Update secured loan details if applicable
-            if is_secured:
-                loan.is_secured = True
-                loan.collateral_description = collateral_description
-                loan.collateral_value = collateral_value
-                
-                # Calculate loan-to-value ratio
-                if collateral_value > 0:
-                    loan.loan_to_value_ratio = amount / collateral_value
-            
-            # Adjust interest rate if borrower is verified
-            if borrower_verified:
-                loan.interest_rate = max(loan.interest_rate - Decimal('1.5'), Decimal('5.0'))
-                
-            # Adjust interest rate for secured loans
-            if is_secured and loan.loan_to_value_ratio < Decimal('0.8'):
-                loan.interest_rate = max(loan.interest_rate - Decimal('1.0'), Decimal('5.0'))
-            
-            # Save updated loan
-            loan.save()
+            # Let investors' auto-invest rules fund it
+            autoinvest.auto_invest(loan)
             
             messages.success(request, f'Loan request "{title}" created successfully! It is now available for investors to fund.')
             return redirect('lending:loan_detail', loan_id=loan.id)
@@ -221,6 +257,64 @@ def create_loan(request):
         'is_verified': borrower_verified
     })
 
+def _borrower_pricing_defaults(user):
+    """Credit score and verification status used to quote for the signed-in borrower"""
+    try:
+        borrower_profile = user.profile.borrower_profile
+        return {
+            'credit_score': borrower_profile.credit_score,
+            'borrower_verified': borrower_profile.verification_status == 'verified',
+        }
+    except Exception:
+        return {}
+
+def _quote(params, defaults):
+    """Price one quote request, returning the quote or an error entry"""
+    try:
+        return pricing.quote_loan(
+            amount=params['amount'],
+            term_months=params['term_months'],
+            credit_score=defaults.get('credit_score', params.get('credit_score', pricing.DEFAULT_CREDIT_SCORE)),
+            borrower_verified=defaults.get('borrower_verified', str(params.get('borrower_verified', '')).lower() in ('1', 'true')),
+            is_secured=str(params.get('is_secured', '')).lower() in ('1', 'true'),
+            collateral_value=params.get('collateral_value') or None
+        )
+    except KeyError as e:
+        return {'error': f'Missing field: {e.args[0]}'}
+    except (ValueError, TypeError, InvalidOperation) as e:
+        return {'error': str(e) or 'Invalid quote request.'}
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def loan_quote(request):
+    """Quote interest rate, payments and risk score for hypothetical loans.
+    
+    GET takes a single quote as query parameters; POST takes a JSON body of
+    the form {"quotes": [{"amount": ..., "term_months": ...}, ...]}.
+    """
+    defaults = _borrower_pricing_defaults(request.user) if request.user.is_authenticated else {}
+    
+    if request.method == 'GET':
+        quote = _quote(request.GET, defaults)
+        return JsonResponse(quote, status=400 if 'error' in quote else 200)
+    
+    try:
+        quotes = json.loads(request.body)['quotes']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body with a "quotes" list.'}, status=400)
+    
+    if not isinstance(quotes, list):
+        return JsonResponse({'error': '"quotes" must be a list.'}, status=400)
+    if len(quotes) > MAX_QUOTE_BATCH:
+        return JsonResponse({'error': f'At most {MAX_QUOTE_BATCH} quotes can be requested at once.'}, status=400)
+    
+    return JsonResponse({
+        'quotes': [
+            _quote(params, defaults) if isinstance(params, dict) else {'error': 'Invalid quote request.'}
+            for params in quotes
+        ]
+    })
+
 @login_required
 def invest(request, loan_id):
     """Process an investment in a loan"""
@@ -257,7 +351,7 @@ def invest(request, loan_id):
                 return redirect('lending:invest', loan_id=loan_id)
             
             # Check if amount doesn't exceed remaining needed
-            remaining_needed = loan.amount - loan.current_funded_amount
+            remaining_needed = loan.remaining_amount
             if amount > remaining_needed:
                 messages.error(request, f'The maximum you can invest is ${remaining_needed}.')
                 return redirect('lending:invest', loan_id=loan_id)
@@ -323,9 +417,46 @@ def repay_loan(request, loan_id):
     return render(request, 'lending/repay.html', {
         'form': form,
         'loan': loan,
-        'next_payment': next_payment
+        'next_payment': next_payment,
+        'payment_schedule': loan.repayment_schedule
     })
 
+@login_required
+@require_http_methods(['POST'])
+def invest_basket(request):
+    """Invest in many loans in one request.
+    
+    Takes a JSON body of the form {"lines": [{"loan": <id>, "amount": "25.00"}, ...]}
+    and returns the outcome of every line.
+    """
+    try:
+        if request.user.profile.user_type != 'investor':
+            return JsonResponse({'error': 'Only investors can invest in loans.'}, status=403)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'error': 'Only investors can invest in loans.'}, status=403)
+    
+    try:
+        lines = json.loads(request.body)['lines']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body with a "lines" list.'}, status=400)
+    
+    if not isinstance(lines, list) or not lines:
+        return JsonResponse({'error': '"lines" must be a non-empty list.'}, status=400)
+    if len(lines) > MAX_BASKET_LINES:
+        return JsonResponse({'error': f'At most {MAX_BASKET_LINES} loans can be invested in at once.'}, status=400)
+    
+    parsed = []
+    for line in lines:
+        try:
+            loan_id = int(line['loan'])
+            amount = Decimal(str(line['amount'])).quantize(Decimal('0.01'))
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            return JsonResponse({'error': 'Every line needs a loan id and an amount.'}, status=400)
+        parsed.append((loan_id, amount))
+    
+    result = invest_in_basket(request.user, parsed)
+    return JsonResponse(result, status=200 if result['success'] else 409)
+
 @login_required
 def my_investments(request):
     """Display user's investments"""
@@ -338,15 +469,16 @@ def my_investments(request):
         messages.error(request, 'User profile not found.')
         return redirect('home')
     
-    # Get all investments for this user
-    investments = Investment.objects.filter(investor=request.user).order_by('-date_invested')
+    investments = Investment.objects.filter(investor=request.user)
+    active = Q(loan__status__in=['active', 'funded'])
+    completed = Q(loan__status__in=['repaid', 'defaulted'])
     
-    # Group by status
-    active_investments = investments.filter(loan__status__in=['active', 'funded'])
-    completed_investments = investments.filter(loan__status__in=['repaid', 'defaulted'])
-    
-    # Calculate totals
-    total_invested = investments.aggregate(total=Sum('amount'))['total'] or 0
+    # Totals and group sizes in one aggregate
+    summary = investments.aggregate(
+        total_invested=Sum('amount'),
+        active_count=Count('pk', filter=active),
+        completed_count=Count('pk', filter=completed),
+    )
     
     # Calculate returns
     total_returns = LoanPayment.objects.filter(
@@ -356,16 +488,98 @@ def my_investments(request):
         total=Sum('amount_due')
     )['total'] or 0
     
+    # One page of each group, newest first
+    listed = investments.select_related('loan')
+    active_page, active_query = section_page(request, listed.filter(active), HISTORY_ORDERING['investments'], 'active_cursor')
+    completed_page, completed_query = section_page(
+        request, listed.filter(completed), HISTORY_ORDERING['investments'], 'completed_cursor')
+    
     context = {
-        'investments': investments,
-        'active_investments': active_investments,
-        'completed_investments': completed_investments,
-        'total_invested': total_invested,
+        'active_investments': active_page,
+        'active_query': active_query,
+        'completed_investments': completed_page,
+        'completed_query': completed_query,
+        'active_count': summary['active_count'],
+        'completed_count': summary['completed_count'],
+        'total_invested': summary['total_invested'] or 0,
         'total_returns': total_returns
     }
     
     return render(request, 'lending/my_investments.html', context)
 
+@login_required
+def export_investments(request, fmt):
+    """Stream all of the investor's investments as CSV or JSONL"""
+    if fmt not in export_formats.FORMATS:
+        raise Http404('Unknown export format.')
+    investor = export_formats.export_subject(request)
+    
+    return export_formats.export_response(
+        f'investments-{investor.username}', exports.INVESTMENT_FIELDS, exports.investment_rows(investor), fmt)
+
+@login_required
+def export_payouts(request, fmt):
+    """Stream every repayment the investor has been paid as CSV or JSONL"""
+    if fmt not in export_formats.FORMATS:
+        raise Http404('Unknown export format.')
+    investor = export_formats.export_subject(request)
+    if not hasattr(investor, 'wallet'):
+        raise Http404('No wallet found.')
+    
+    return export_formats.export_response(
+        f'payouts-{investor.username}', exports.PAYOUT_FIELDS, exports.payout_rows(investor), fmt)
+
+@login_required
+def auto_invest_rules(request):
+    """List and create the investor's auto-invest rules"""
+    # Check if user is an investor
+    try:
+        if request.user.profile.user_type != 'investor':
+            messages.warning(request, 'Only investors can set up auto-invest rules.')
+            return redirect('home')
+    except:
+        messages.error(request, 'User profile not found.')
+        return redirect('home')
+    
+    if request.method == 'POST':
+        form = AutoInvestRuleForm(request.POST)
+        if form.is_valid():
+            rule = form.save(commit=False)
+            rule.investor = request.user
+            rule.save()
+            messages.success(request, f'Auto-invest rule "{rule.name}" saved. It applies to new loans.')
+            return redirect('lending:auto_invest_rules')
+    else:
+        form = AutoInvestRuleForm()
+    
+    rules = AutoInvestRule.objects.filter(investor=request.user).order_by('created_at')
+    
+    return render(request, 'lending/auto_invest.html', {
+        'form': form,
+        'rules': rules,
+    })
+
+@login_required
+@require_http_methods(['POST'])
+def toggle_auto_invest_rule(request, rule_id):
+    """Pause or resume an auto-invest rule"""
+    rule = get_object_or_404(AutoInvestRule, id=rule_id, investor=request.user)
+    rule.is_active = not rule.is_active
+    rule.save(update_fields=['is_active'])
+    
+    messages.success(request, f'Auto-invest rule "{rule.name}" {"resumed" if rule.is_active else "paused"}.')
+    return redirect('lending:auto_invest_rules')
+
+@login_required
+@require_http_methods(['POST'])
+def delete_auto_invest_rule(request, rule_id):
+    """Delete an auto-invest rule; investments it placed are kept"""
+    rule = get_object_or_404(AutoInvestRule, id=rule_id, investor=request.user)
+    rule.delete()
+    
+    messages.success(request, f'Auto-invest rule "{rule.name}" deleted.')
+    return redirect('lending:auto_invest_rules')
+
 @login_required
 def my_loans(request):
     """Display user's loans"""
@@ -378,17 +592,18 @@ def my_loans(request):
         messages.error(request, 'User profile not found.')
         return redirect('home')
     
-    # Get all loans for this user
-    loans = Loan.objects.filter(borrower=request.user).order_by('-created_at')
-    
-    # Group by status
-    pending_loans = loans.filter(status='pending')
-    active_loans = loans.filter(status__in(['active', 'funded']))
-    completed_loans = loans.filter(status__in(['repaid', 'defaulted', 'cancelled']))
+    loans = Loan.objects.filter(borrower=request.user)
+    groups = {
+        'pending': Q(status='pending'),
+        'active': Q(status__in=['active', 'funded']),
+        'completed': Q(status__in=['repaid', 'defaulted', 'cancelled']),
+    }
     
-    # Calculate totals
-    total_borrowed = loans.filter(status__in(['active', 'funded', 'repaid'])).aggregate(
-        total=Sum('amount'))['total'] or 0
+    # Totals and group sizes in one aggregate
+    summary = loans.aggregate(
+        total_borrowed=Sum('amount', filter=Q(status__in=['active', 'funded', 'repaid'])),
+        **{f'{group}_count': Count('pk', filter=condition) for group, condition in groups.items()},
+    )
     
     # Calculate payments
     total_repaid = LoanPayment.objects.filter(
@@ -399,14 +614,18 @@ def my_loans(request):
     )['total'] or 0
     
     context = {
-        'loans': loans,
-        'pending_loans': pending_loans,
-        'active_loans': active_loans,
-        'completed_loans': completed_loans,
-        'total_borrowed': total_borrowed,
+        'total_borrowed': summary['total_borrowed'] or 0,
         'total_repaid': total_repaid
     }
     
+    # One page of each group, newest first
+    listed = loans.with_payment_metrics()
+    for group, condition in groups.items():
+        page, query = section_page(request, listed.filter(condition), HISTORY_ORDERING['loans'], f'{group}_cursor')
+        context[f'{group}_loans'] = page
+        context[f'{group}_query'] = query
+        context[f'{group}_count'] = summary[f'{group}_count']
+    
     return render(request, 'lending/my_loans.html', context)
 
 @login_required
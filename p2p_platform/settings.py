@@ -136,3 +136,14 @@ LOGIN_URL = "accounts:login"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Whole months of wallet transactions kept in the Transaction table; older
+# months are moved to the compressed archive by archive_transactions
+LEDGER_HOT_MONTHS = 12
+
+# Directory the monthly wallet statements are written to by generate_statements
+STATEMENT_ROOT = BASE_DIR / "statements"
+
+# Stream live funding progress to the marketplace and loan pages; only turn
+# this on when the site is served by an ASGI server such as uvicorn
+LIVE_UPDATES = False